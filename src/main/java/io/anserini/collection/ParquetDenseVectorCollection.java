@@ -24,16 +24,27 @@ import java.util.Arrays;
 import java.util.List;
 import java.util.NoSuchElementException;
 
+import com.fasterxml.jackson.databind.JsonNode;
+import com.fasterxml.jackson.databind.ObjectMapper;
+import org.apache.hadoop.conf.Configuration;
 import org.apache.parquet.example.data.Group;
+import org.apache.parquet.hadoop.ParquetFileReader;
 import org.apache.parquet.hadoop.ParquetReader;
 import org.apache.parquet.hadoop.example.GroupReadSupport;
+import org.apache.parquet.hadoop.util.HadoopInputFile;
 import org.apache.parquet.schema.PrimitiveType;
 
 /**
  * Collection class for managing Parquet dense vectors
  * Extends the DocumentCollection class for handling documents.
+ *
+ * Vectors are lists of DOUBLE or FLOAT, or quantized lists of float16 or int8 as written by
+ * src/main/python/parquet with --quantization, which are dequantized to floats using the
+ * parameters stored under the {@value #QUANTIZATION_METADATA_KEY} key of the file metadata.
  */
 public class ParquetDenseVectorCollection extends DocumentCollection<ParquetDenseVectorCollection.Document> {
+  public static final String QUANTIZATION_METADATA_KEY = "anserini.quantization";
+
   protected String docidField = "docid";
   protected String vectorField = "vector";
   protected boolean normalizeVectors = false;
@@ -141,6 +152,9 @@ public class ParquetDenseVectorCollection extends DocumentCollection<ParquetDens
     private String docidField;
     private String vectorField;
     private boolean normalizeVectors;
+    private String quantization = "none";
+    private float[] scale;
+    private float[] offset;
 
     /**
      * Constructor for the Segment class using a file path.
@@ -196,6 +210,7 @@ public class ParquetDenseVectorCollection extends DocumentCollection<ParquetDens
       org.apache.hadoop.fs.Path hadoopPath = new org.apache.hadoop.fs.Path(path.toString());
 
       reader = ParquetReader.builder(new GroupReadSupport(), hadoopPath).build();
+      readQuantization(hadoopPath);
 
       // Initialize lists to store data read from the Parquet file
       vectors = new ArrayList<>();
@@ -203,6 +218,40 @@ public class ParquetDenseVectorCollection extends DocumentCollection<ParquetDens
       readerInitialized = true;
     }
 
+    /**
+     * Reads the quantization type, and the per-dimension int8 scale and offset, from the file metadata.
+     *
+     * @param hadoopPath the path to the Parquet file.
+     * @throws IOException if an I/O error occurs or the metadata is malformed.
+     */
+    private void readQuantization(org.apache.hadoop.fs.Path hadoopPath) throws IOException {
+      String metadata;
+      try (ParquetFileReader fileReader = ParquetFileReader.open(HadoopInputFile.fromPath(hadoopPath, new Configuration()))) {
+        metadata = fileReader.getFooter().getFileMetaData().getKeyValueMetaData().get(QUANTIZATION_METADATA_KEY);
+      }
+      if (metadata == null) {
+        return;
+      }
+
+      JsonNode node = new ObjectMapper().readTree(metadata);
+      quantization = node.get("type").asText();
+      if (quantization.equals("int8")) {
+        scale = toFloatArray(node.get("scale"));
+        offset = toFloatArray(node.get("offset"));
+        if (scale.length != offset.length) {
+          throw new IOException(String.format("Mismatched int8 scale and offset lengths in %s", hadoopPath));
+        }
+      }
+    }
+
+    private static float[] toFloatArray(JsonNode node) {
+      float[] values = new float[node.size()];
+      for (int i = 0; i < values.length; i++) {
+        values[i] = (float) node.get(i).asDouble();
+      }
+      return values;
+    }
+
     /**
      * @param vector the vector to normalize.
      * @return the normalized vector.
@@ -254,18 +303,35 @@ public class ParquetDenseVectorCollection extends DocumentCollection<ParquetDens
       
       Group firstElement = vectorGroup.getGroup(0, 0);
       PrimitiveType.PrimitiveTypeName primitiveType = firstElement.getType().getFields().get(0).asPrimitiveType().getPrimitiveTypeName();
-      boolean isDouble = primitiveType.equals(PrimitiveType.PrimitiveTypeName.DOUBLE);
-      boolean isFloat = primitiveType.equals(PrimitiveType.PrimitiveTypeName.FLOAT);
-      
-      if (!isDouble && !isFloat) {
-        throw new IllegalArgumentException(String.format("Vector elements must be either DOUBLE or FLOAT, found: %s", primitiveType));
-      }
 
-      for (int i = 0; i < vectorSize; i++) {
-        Group listGroup = vectorGroup.getGroup(0, i);
-        vector[i] = isDouble ? (float) listGroup.getDouble("element", 0) : listGroup.getFloat("element", 0);
+      if (primitiveType.equals(PrimitiveType.PrimitiveTypeName.DOUBLE)) {
+        for (int i = 0; i < vectorSize; i++) {
+          vector[i] = (float) vectorGroup.getGroup(0, i).getDouble("element", 0);
+        }
+      } else if (primitiveType.equals(PrimitiveType.PrimitiveTypeName.FLOAT)) {
+        for (int i = 0; i < vectorSize; i++) {
+          vector[i] = vectorGroup.getGroup(0, i).getFloat("element", 0);
+        }
+      } else if (primitiveType.equals(PrimitiveType.PrimitiveTypeName.FIXED_LEN_BYTE_ARRAY) && quantization.equals("float16")) {
+        for (int i = 0; i < vectorSize; i++) {
+          // Parquet FLOAT16 values are little-endian IEEE half-precision floats
+          byte[] bytes = vectorGroup.getGroup(0, i).getBinary("element", 0).getBytes();
+          vector[i] = Float.float16ToFloat((short) ((bytes[0] & 0xff) | (bytes[1] << 8)));
+        }
+      } else if (primitiveType.equals(PrimitiveType.PrimitiveTypeName.INT32) && quantization.equals("int8")) {
+        if (vectorSize != scale.length) {
+          throw new IllegalArgumentException(String.format("Vector of document %s has %d dimensions, int8 quantization metadata has %d",
+              docid, vectorSize, scale.length));
+        }
+        // Stored as round((x - offset) / scale) - 128
+        for (int i = 0; i < vectorSize; i++) {
+          vector[i] = (vectorGroup.getGroup(0, i).getInteger("element", 0) + 128) * scale[i] + offset[i];
+        }
+      } else {
+        throw new IllegalArgumentException(String.format(
+            "Vector elements must be either DOUBLE or FLOAT, or float16 or int8 with %s metadata, found: %s (quantization %s)",
+            QUANTIZATION_METADATA_KEY, primitiveType, quantization));
       }
-      
 
       if (this.normalizeVectors) {
         vector = normalizeVector(vector);
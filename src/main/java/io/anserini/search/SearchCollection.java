@@ -982,6 +982,7 @@ public final class SearchCollection<K extends Comparable<K>> implements Runnable
 
   private final Args args;
   private final IndexReader reader;
+  private final boolean ownsReader;
   private final Analyzer analyzer;
   private final Class<? extends DocumentCollection<?>> collectionClass;
   private final List<TaggedSimilarity> similarities;
@@ -991,14 +992,28 @@ public final class SearchCollection<K extends Comparable<K>> implements Runnable
   private Map<String, ScoredDocs> qrels;
   private Set<String> queriesWithRel;
 
-  @SuppressWarnings("unchecked")
   public SearchCollection(Args args) throws IOException {
+    this(args, null);
+  }
+
+  /**
+   * Creates a searcher over an index reader that is already open, e.g., shared by the searches of
+   * {@link SearchCollectionServer}. The reader is left open when the searcher is closed. If the reader is null, the
+   * index of the arguments is opened, and closed with the searcher.
+   *
+   * @param args search arguments
+   * @param reader open reader of the index of the arguments, or null
+   * @throws IOException if the index cannot be opened
+   */
+  @SuppressWarnings("unchecked")
+  public SearchCollection(Args args, IndexReader reader) throws IOException {
     this.args = args;
     Path indexPath = IndexReaderUtils.getIndex(args.index);
 
     LOG.info("============ Initializing Searcher ============");
     LOG.info("Index: {}", indexPath);
-    this.reader = DirectoryReader.open(FSDirectory.open(indexPath));
+    this.ownsReader = reader == null;
+    this.reader = reader == null ? DirectoryReader.open(FSDirectory.open(indexPath)) : reader;
 
     LOG.info("Threads: {}", args.threads);
     LOG.info("Fields: {}", Arrays.toString(args.fields));
@@ -1049,7 +1064,9 @@ public final class SearchCollection<K extends Comparable<K>> implements Runnable
 
   @Override
   public void close() throws IOException {
-    reader.close();
+    if (ownsReader) {
+      reader.close();
+    }
   }
 
   private List<TaggedSimilarity> constructSimilarities() {
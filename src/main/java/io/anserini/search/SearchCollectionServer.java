@@ -0,0 +1,205 @@
+/*
+ * Anserini: A Lucene toolkit for reproducible information retrieval research
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ * http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+package io.anserini.search;
+
+import java.io.BufferedReader;
+import java.io.Closeable;
+import java.io.IOException;
+import java.io.InputStreamReader;
+import java.io.OutputStreamWriter;
+import java.io.UncheckedIOException;
+import java.io.Writer;
+import java.net.InetAddress;
+import java.net.ServerSocket;
+import java.net.Socket;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Path;
+import java.util.LinkedHashMap;
+import java.util.List;
+import java.util.Map;
+import java.util.concurrent.ConcurrentHashMap;
+import java.util.concurrent.ExecutorService;
+import java.util.concurrent.Executors;
+import java.util.concurrent.TimeUnit;
+
+import org.apache.logging.log4j.Level;
+import org.apache.logging.log4j.LogManager;
+import org.apache.logging.log4j.Logger;
+import org.apache.logging.log4j.core.config.Configurator;
+import org.apache.lucene.index.DirectoryReader;
+import org.apache.lucene.index.IndexReader;
+import org.apache.lucene.store.FSDirectory;
+import org.kohsuke.args4j.CmdLineException;
+import org.kohsuke.args4j.CmdLineParser;
+import org.kohsuke.args4j.Option;
+import org.kohsuke.args4j.ParserProperties;
+
+import com.fasterxml.jackson.core.type.TypeReference;
+import com.fasterxml.jackson.databind.ObjectMapper;
+
+import io.anserini.index.IndexReaderUtils;
+import io.anserini.util.LoggingBootstrap;
+
+/**
+ * Long-lived {@link SearchCollection} worker for batch retrieval drivers. Instead of launching a JVM per run, drivers
+ * connect to this server over a local socket and submit {@link SearchCollection} jobs, one JSON object per line of the
+ * form <code>{"args": ["-index", ..., "-topics", ..., "-output", ...]}</code>, with exactly the arguments of the
+ * command line. Each job is answered with one JSON line, <code>{"status": "ok", "millis": ...}</code> or
+ * <code>{"status": "error", "error": ...}</code>. Index readers are opened on first use and shared by all the jobs,
+ * so a parameter sweep pays JVM warm-up and index opening only once. Connections are served concurrently, and the
+ * jobs of a connection in order.
+ */
+public final class SearchCollectionServer implements Closeable {
+  private static final Logger LOG = LogManager.getLogger(SearchCollectionServer.class);
+  private static final ObjectMapper JSON_MAPPER = new ObjectMapper();
+
+  public static class Args {
+    @Option(name = "-host", metaVar = "[address]", usage = "address to bind server to")
+    public String host = "127.0.0.1";
+
+    @Option(name = "-port", metaVar = "[number]", usage = "port to bind server to, 0 for any free port")
+    public int port = 0;
+
+    @Option(name = "-connections", metaVar = "[number]", usage = "number of connections served concurrently")
+    public int connections = 4;
+
+    @Option(name = "-quiet", usage = "only report errors of the searches")
+    public boolean quiet = false;
+  }
+
+  private final ServerSocket serverSocket;
+  private final ExecutorService executor;
+  private final ConcurrentHashMap<Path, IndexReader> readers = new ConcurrentHashMap<>();
+
+  public SearchCollectionServer(Args args) throws IOException {
+    this.serverSocket = new ServerSocket(args.port, 50, InetAddress.getByName(args.host));
+    this.executor = Executors.newFixedThreadPool(args.connections);
+  }
+
+  public int getPort() {
+    return serverSocket.getLocalPort();
+  }
+
+  /**
+   * Accepts connections until the server is closed.
+   */
+  public void serve() {
+    while (!serverSocket.isClosed()) {
+      try {
+        Socket socket = serverSocket.accept();
+        executor.submit(() -> handle(socket));
+      } catch (IOException e) {
+        if (!serverSocket.isClosed()) {
+          LOG.error("Error accepting connection: {}", e.getMessage());
+        }
+      }
+    }
+  }
+
+  private void handle(Socket socket) {
+    try (socket;
+         BufferedReader in = new BufferedReader(new InputStreamReader(socket.getInputStream(), StandardCharsets.UTF_8));
+         Writer out = new OutputStreamWriter(socket.getOutputStream(), StandardCharsets.UTF_8)) {
+      String line;
+      while ((line = in.readLine()) != null) {
+        if (line.isBlank()) {
+          continue;
+        }
+        out.write(JSON_MAPPER.writeValueAsString(search(line)));
+        out.write('\n');
+        out.flush();
+      }
+    } catch (IOException e) {
+      LOG.error("Error serving connection: {}", e.getMessage());
+    }
+  }
+
+  private Map<String, Object> search(String request) {
+    Map<String, Object> response = new LinkedHashMap<>();
+    final long start = System.nanoTime();
+    try {
+      Map<String, List<String>> job = JSON_MAPPER.readValue(request, new TypeReference<>() {});
+      SearchCollection.Args searchArgs = new SearchCollection.Args();
+      new CmdLineParser(searchArgs).parseArgument(job.get("args"));
+
+      try (SearchCollection<?> searcher = new SearchCollection<>(searchArgs, getReader(searchArgs.index))) {
+        searcher.run();
+      }
+      response.put("status", "ok");
+      response.put("millis", TimeUnit.MILLISECONDS.convert(System.nanoTime() - start, TimeUnit.NANOSECONDS));
+    } catch (Exception e) {
+      response.put("status", "error");
+      response.put("error", String.valueOf(e.getMessage()));
+    }
+    return response;
+  }
+
+  private IndexReader getReader(String index) throws IOException {
+    try {
+      return readers.computeIfAbsent(IndexReaderUtils.getIndex(index), indexPath -> {
+        try {
+          LOG.info("Opening index {}", indexPath);
+          return DirectoryReader.open(FSDirectory.open(indexPath));
+        } catch (IOException e) {
+          throw new UncheckedIOException(e);
+        }
+      });
+    } catch (UncheckedIOException e) {
+      throw e.getCause();
+    }
+  }
+
+  @Override
+  public void close() throws IOException {
+    serverSocket.close();
+    executor.shutdownNow();
+    for (IndexReader reader : readers.values()) {
+      reader.close();
+    }
+  }
+
+  public static void main(String[] args) throws Exception {
+    LoggingBootstrap.installJulToSlf4jBridge();
+
+    Args serverArgs = new Args();
+    CmdLineParser parser = new CmdLineParser(serverArgs, ParserProperties.defaults().withUsageWidth(120));
+
+    try {
+      parser.parseArgument(args);
+    } catch (CmdLineException e) {
+      System.err.printf("Error: %s\n", e.getMessage());
+      parser.printUsage(System.err);
+      return;
+    }
+
+    if (serverArgs.quiet) {
+      Configurator.setRootLevel(Level.ERROR);
+    }
+
+    SearchCollectionServer server = new SearchCollectionServer(serverArgs);
+    Runtime.getRuntime().addShutdownHook(new Thread(() -> {
+      try {
+        server.close();
+      } catch (IOException ignored) {
+        // Ignore shutdown exceptions.
+      }
+    }));
+    System.out.printf("SearchCollectionServer listening on %s:%d%n", serverArgs.host, server.getPort());
+    System.out.flush();
+    server.serve();
+  }
+}
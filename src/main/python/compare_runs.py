@@ -18,12 +18,20 @@
 
 Takes as arguments a base run, a comparison run, a qrels file, and a
 metric: performs per-topic analysis of differences and computes
-statistical significance of differences. Makes an external call to
-trec_eval for the actual computation of metrics.
+statistical significance of differences. Metrics are computed in-process
+by trec_eval_vectorized, which loads the qrels once and evaluates both
+runs with array operations.
+
+Alternatively, takes a directory or glob of runs (--runs): evaluates each
+run once and reports the full pairwise matrix of mean differences with
+paired t-test, randomized permutation test, or bootstrap p-values,
+optionally corrected for multiple comparisons.
 """
 
 import argparse
+import glob
 import os
+import sys
 import numpy as np
 import scipy.stats
 import statistics
@@ -34,22 +42,10 @@ from operator import itemgetter
 plt.style.use('ggplot')
 
 from msmarco_compare import compute_metrics_from_files 
+from trec_eval_vectorized import Qrels, evaluate, load_run, metric_key, evaluate_run
 
-def load_metrics(file):
-    metrics = {}
-    with open(file, 'r') as f:
-        for line in f:
-            metric, qid, score = line.split('\t')
-            metric = metric.strip()
-            qid = qid.strip()
-            score = score.strip()
-            if qid == 'all':
-                continue
-            if metric not in metrics:
-                metrics[metric] = {}
-            metrics[metric][qid] = float(score)
-
-    return metrics
+SIGNIFICANCE_TESTS = ['t-test', 'permutation', 'bootstrap']
+CORRECTIONS = ['none', 'bonferroni', 'holm', 'fdr_bh']
 
 
 def plot(all_results, ymin=-1, ymax=1, output_path="."):
@@ -68,17 +64,173 @@ def plot(all_results, ymin=-1, ymax=1, output_path="."):
     output_fn = os.path.join(output_path, 'per_query_{}.pdf'.format(metric))
     plt.savefig(output_fn, bbox_inches='tight', format='pdf')
 
+def find_runs(pattern):
+    """Expands a directory (all files in it) or a glob pattern into a sorted list of run files."""
+    if os.path.isdir(pattern):
+        paths = [os.path.join(pattern, f) for f in os.listdir(pattern)]
+    else:
+        paths = glob.glob(pattern)
+    return sorted(p for p in paths if os.path.isfile(p))
+
+
+def load_score_matrix(qrels_path, run_paths, metric, depth=1000):
+    """Evaluates every run once and returns a (runs x topics) matrix of per-topic scores,
+    restricted to the topics retrieved by all runs, and the list of those topics."""
+    qrels = Qrels(qrels_path)
+    scores = []
+    common = np.ones(qrels.num_topics, dtype=bool)
+    for path in run_paths:
+        run = load_run(path, qrels, depth)
+        common &= run.retrieved
+        scores.append(evaluate(qrels, run, [metric], complete=True).scores[metric_key(metric)])
+    return np.vstack(scores)[:, common], list(qrels.topics[common])
+
+
+def pairwise_differences(scores):
+    """Returns the (i, j) index pairs with i < j and the per-topic differences scores[j] - scores[i]."""
+    i, j = np.triu_indices(scores.shape[0], k=1)
+    return i, j, scores[j] - scores[i]
+
+
+def ttest_pvalues(diffs):
+    """Paired t-test for every row of per-topic differences, equivalent to scipy.stats.ttest_rel."""
+    n = diffs.shape[1]
+    std = diffs.std(axis=1, ddof=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tstat = diffs.mean(axis=1) / (std / np.sqrt(n))
+    pvalues = 2 * scipy.stats.t.sf(np.abs(tstat), n - 1)
+    # Identical runs have no variance and no evidence of a difference
+    return np.where(std > 0, pvalues, 1.0)
+
+
+def permutation_pvalues(diffs, trials=10000, seed=0, batch_size=1000):
+    """Randomized (sign-flip) permutation test for every row of per-topic differences. All pairs
+    share the same random sign matrices, so each batch of trials is a single matrix product."""
+    rng = np.random.default_rng(seed)
+    n = diffs.shape[1]
+    observed = np.abs(diffs.mean(axis=1))
+    count = np.zeros(diffs.shape[0])
+    for start in range(0, trials, batch_size):
+        signs = rng.choice([-1.0, 1.0], size=(min(batch_size, trials - start), n))
+        permuted = np.abs(diffs @ signs.T) / n
+        count += (permuted >= observed[:, None] - 1e-12).sum(axis=1)
+    return (count + 1) / (trials + 1)
+
+
+def bootstrap_pvalues(diffs, trials=10000, seed=0, batch_size=1000):
+    """Paired bootstrap test for every row of per-topic differences: the fraction of resampled
+    mean differences, centered on the observed mean, at least as extreme as the observed mean.
+    Topic resamples are shared across pairs and applied as a matrix of resampling counts."""
+    rng = np.random.default_rng(seed)
+    n = diffs.shape[1]
+    observed = diffs.mean(axis=1)
+    count = np.zeros(diffs.shape[0])
+    for start in range(0, trials, batch_size):
+        size = min(batch_size, trials - start)
+        samples = rng.integers(0, n, size=(size, n))
+        counts = np.zeros((size, n))
+        np.add.at(counts, (np.repeat(np.arange(size), n), samples.ravel()), 1)
+        resampled = diffs @ counts.T / n
+        count += (np.abs(resampled - observed[:, None]) >= np.abs(observed)[:, None] - 1e-12).sum(axis=1)
+    return (count + 1) / (trials + 1)
+
+
+def correct_pvalues(pvalues, method='none'):
+    """Adjusts p-values for multiple comparisons (Bonferroni, Holm, or Benjamini-Hochberg FDR)."""
+    m = len(pvalues)
+    if method == 'none' or m == 0:
+        return pvalues
+    if method == 'bonferroni':
+        return np.minimum(pvalues * m, 1.0)
+    order = np.argsort(pvalues)
+    sorted_p = pvalues[order]
+    if method == 'holm':
+        adjusted = np.maximum.accumulate(sorted_p * (m - np.arange(m)))
+    elif method == 'fdr_bh':
+        adjusted = np.minimum.accumulate((sorted_p * m / np.arange(1, m + 1))[::-1])[::-1]
+    else:
+        raise ValueError(f'Unknown correction {method}, expected one of {CORRECTIONS}')
+    corrected = np.empty(m)
+    corrected[order] = np.minimum(adjusted, 1.0)
+    return corrected
+
+
+def compare_many(qrels_path, run_paths, metric, test='t-test', correction='none', trials=10000,
+                 alpha=0.05, depth=1000, output=None):
+    """Compares all pairs of runs and prints the matrix of mean differences, marking pairs
+    that are significant after correction. Optionally writes every pair to a TSV file."""
+    scores, topics = load_score_matrix(qrels_path, run_paths, metric, depth)
+    names = [os.path.basename(p) for p in run_paths]
+    i, j, diffs = pairwise_differences(scores)
+
+    if test == 't-test':
+        pvalues = ttest_pvalues(diffs)
+    elif test == 'permutation':
+        pvalues = permutation_pvalues(diffs, trials)
+    else:
+        pvalues = bootstrap_pvalues(diffs, trials)
+    corrected = correct_pvalues(pvalues, correction)
+    deltas = diffs.mean(axis=1)
+
+    means = scores.mean(axis=1)
+    print(f'{len(run_paths)} runs, {len(topics)} common topics, metric {metric}, {test} test, '
+          f'{correction} correction')
+    for name, mean in zip(names, means):
+        print(f'{name}\t{mean:.4f}')
+
+    # Row r, column c holds mean(score[c] - score[r]); '*' marks significant differences
+    delta_matrix = np.zeros((len(names), len(names)))
+    pvalue_matrix = np.ones((len(names), len(names)))
+    delta_matrix[i, j], delta_matrix[j, i] = deltas, -deltas
+    pvalue_matrix[i, j] = pvalue_matrix[j, i] = corrected
+    width = max(len(n) for n in names)
+    print()
+    print(' ' * width + '\t' + '\t'.join(f'{c:>8}' for c in range(len(names))))
+    for r, name in enumerate(names):
+        cells = [f'{delta_matrix[r, c]:+.4f}' + ('*' if pvalue_matrix[r, c] < alpha else ' ')
+                 for c in range(len(names))]
+        print(f'{name:<{width}}\t' + '\t'.join(cells))
+
+    if output:
+        with open(output, 'w') as f:
+            f.write('run_a\trun_b\tmean_a\tmean_b\tdelta\tpvalue\tcorrected_pvalue\n')
+            for a, b, delta, p, cp in zip(i, j, deltas, pvalues, corrected):
+                f.write(f'{names[a]}\t{names[b]}\t{means[a]:.6f}\t{means[b]:.6f}\t'
+                        f'{delta:.6f}\t{p:.6g}\t{cp:.6g}\n')
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument("--base", type=str, help='base run', required=True)
-    parser.add_argument("--comparison", type=str, help='comparison run', required=True)
+    parser.add_argument("--base", type=str, help='base run')
+    parser.add_argument("--comparison", type=str, help='comparison run')
+    parser.add_argument("--runs", type=str, help='directory or glob of runs to compare pairwise')
     parser.add_argument("--qrels", type=str, help='qrels', required=True)
     parser.add_argument("--metric", type=str, help='metric', default="map")
     parser.add_argument("--msmarco", action='store_true', default=False, help='whether to use masarco eval script')
     parser.add_argument("--ymin", type=float, help='min value of the y axis', default=-1)
     parser.add_argument("--ymax", type=float, help='max value of the y axis', default=1)
+    parser.add_argument("--test", type=str, choices=SIGNIFICANCE_TESTS, default='t-test',
+                        help='significance test for --runs')
+    parser.add_argument("--correction", type=str, choices=CORRECTIONS, default='none',
+                        help='multiple-comparison correction for --runs')
+    parser.add_argument("--trials", type=int, default=10000,
+                        help='number of permutation or bootstrap trials for --runs')
+    parser.add_argument("--alpha", type=float, default=0.05, help='significance level for --runs')
+    parser.add_argument("--output", type=str, help='TSV file for all pairwise results of --runs')
 
     args = parser.parse_args()
+    if args.runs:
+        if args.msmarco:
+            parser.error('--msmarco is not supported with --runs')
+        run_paths = find_runs(args.runs)
+        if len(run_paths) < 2:
+            parser.error(f'--runs must match at least two runs, found {len(run_paths)}')
+        compare_many(args.qrels, run_paths, args.metric, args.test, args.correction, args.trials,
+                     args.alpha, output=args.output)
+        sys.exit()
+    if not args.base or not args.comparison:
+        parser.error('either --runs or both --base and --comparison are required')
+
     base = args.base
     comp = args.comparison
     qrels = args.qrels
@@ -88,11 +240,9 @@ if __name__ == '__main__':
         base_all, base_metrics = compute_metrics_from_files(qrels, base, per_query_score=True) 
         comp_all, comp_metrics = compute_metrics_from_files(qrels, comp, per_query_score=True) 
     else:
-        os.system(f'eval/trec_eval.9.0.4/trec_eval -q -M1000 -m {metric} {qrels} {base} > eval.base')
-        os.system(f'eval/trec_eval.9.0.4/trec_eval -q -M1000 -m {metric} {qrels} {comp} > eval.comp')
-
-        base_metrics = load_metrics('eval.base')
-        comp_metrics = load_metrics('eval.comp')
+        judgments = Qrels(qrels)
+        base_metrics = evaluate_run(judgments, base, [metric], depth=1000).to_dict()
+        comp_metrics = evaluate_run(judgments, comp, [metric], depth=1000).to_dict()
 
     # trec_eval expects something like 'P.10' on the command line but outputs 'P_10'
     if "." in metric:
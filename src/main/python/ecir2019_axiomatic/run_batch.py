@@ -16,6 +16,7 @@
 
 import os
 import subprocess
+import sys
 import argparse
 from multiprocessing import Pool
 import json
@@ -28,6 +29,9 @@ from evaluation import Evaluation
 from effectiveness import Effectiveness
 from coverage import Coverage
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from search_server import SearchServer, search_args
+
 logger = logging.getLogger('ecir2019_axiomatic')
 logger.setLevel(logging.INFO)
 # create console handler with a higher log level
@@ -56,7 +60,7 @@ def get_index_path(yaml_data):
             break
     return index_path
 
-def batch_retrieval(collection_yaml, models_yaml, output_root, random = False, dry_run = False):
+def batch_retrieval(collection_yaml, models_yaml, output_root, random = False, dry_run = False, server = None):
     all_params = []
     program = os.path.join(collection_yaml['anserini_root'], 'target/appassembler/bin', 'SearchCollection')
     index_path = get_index_path(collection_yaml)
@@ -88,6 +92,8 @@ def batch_retrieval(collection_yaml, models_yaml, output_root, random = False, d
     if dry_run:
         for params in all_params:
             logger.info(' '.join(params))
+    elif server is not None:
+        server.search_all([search_args(' '.join(params)) for params in all_params], parallelism)
     else:
         batch_everything(all_params, atom_retrieval)
 
@@ -216,6 +222,7 @@ if __name__ == '__main__':
     parser.add_argument('--n', dest='parallelism', type=int, default=16, help='number of parallel threads for retrieval/eval')
     parser.add_argument('--output_root', default='ecir2019_axiomatic', help='output directory of all results')
     parser.add_argument('--dry_run', action='store_true', help='dry run the commands without actually running them')
+    parser.add_argument('--server', action='store_true', help='submit the retrievals to a single warm SearchCollectionServer instead of launching a JVM for each one')
     parser.add_argument('--cal_coverage', action='store_true', help='calculate the qrels coverage')
     parser.add_argument('--per_topic_analysis', action='store_true', help='plot the per-topic analysis figures')
 
@@ -248,7 +255,11 @@ if __name__ == '__main__':
     models_yaml['models'] = args.models
 
     if args.run:
-        batch_retrieval(collection_yaml, models_yaml, args.output_root, args.random, args.dry_run)
+        if args.server and not args.dry_run:
+            with SearchServer(args.anserini_root, parallelism) as server:
+                batch_retrieval(collection_yaml, models_yaml, args.output_root, args.random, args.dry_run, server)
+        else:
+            batch_retrieval(collection_yaml, models_yaml, args.output_root, args.random, args.dry_run)
         batch_eval(collection_yaml, models_yaml, args.output_root, args.dry_run)
         batch_output_effectiveness(collection_yaml, models_yaml, args.output_root, args.random)
 
@@ -2,14 +2,13 @@ import argparse
 import json
 import logging
 import os
-import pickle
+import sys
 import time
 
 import scipy.sparse
-import sklearn.preprocessing
-import numpy as np
 
-import utils
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import tfidf_rerank
 
 
 def dump_docvectors(config):
@@ -32,56 +31,23 @@ def build_docid_idx_dict(config):
         for line in f:
             topic, _, docid, _, _, _ = line.split(' ')
             if topic in config['topics'] and docid not in docid_idx_dict:
-                # docid_idx_dict and vocab_idx_dict actually store two different mappings:
-                # both docid (vocab) -> idx and idx -> docid (vocab).
-                #
-                # The docid -> idx mapping is to transform the docid to the row number of the matrix, and
-                # the idx -> docid mapping is to generate the final submission from the index.
-                # The vocab -> mapping is to transform the word into the column number of the matrix, and
-                # the idx -> vocab mapping is easy for us to check the importance of features.
-                #
-                # The docid and vocab are in string format and indices are integers, so there won't be any conflict.
-                # However, this isn't a good design, and should probably be refactored later.
+                # The docid -> idx mapping transforms the docid to the row number of the matrix. It is written
+                # as a string store, which also maps the row number back to the docid, as the vocabulary store
+                # maps the column number back to the word for checking the importance of features.
                 docid_idx_dict[docid] = cur_idx
-                docid_idx_dict[cur_idx] = docid
                 cur_idx += 1
     return docid_idx_dict
 
 
-def build_tfidf_matrix(config, docid_idx_dict, vocab_idx_dict):
-    num_docs, num_vocabs = len(docid_idx_dict) // 2, len(vocab_idx_dict) // 2
+def build_tfidf_matrix(config, docid_idx_dict, vocab_idx_dict, workers):
+    num_docs, num_vocabs = len(docid_idx_dict), len(vocab_idx_dict)
     logging.info(f'Building tf.idf sparse matrix with {num_docs} docs and {num_vocabs} features...')
 
-    tfidf_dict = {}
-    count = 0
-
     source_name = config['target']['name']
     tfidf_raw = os.path.join(working_directory, f'docids.{source_name}.docvector.TF_IDF.tar.gz')
-    reader = utils.TfidfTgzReader(tfidf_raw)
-    while reader.hasnextdoc():
-        docid = reader.getnextdoc().strip()
-        count += 1
-        if count % 100000 == 0:
-            logging.info(f'{count} documents processed...')
-
-        if docid not in docid_idx_dict:
-            reader.skipdoc()
-            continue
-
-        doc_idx = docid_idx_dict[docid]
-        while reader.hasnexttfidf():
-            word, tfidf = reader.getnexttfidf()
-            if word in vocab_idx_dict:
-                vocab_idx = vocab_idx_dict[word]
-                tfidf_dict[(doc_idx, vocab_idx)] = float(tfidf)
-
-    logging.info(f'Finished building tf.idf dict, {count} documents in total.')
-
-    indices = tuple(zip(*tfidf_dict.keys()))
-    values = list(tfidf_dict.values())
-    tfidf_sp = scipy.sparse.csr_matrix((values, indices), shape=(num_docs, num_vocabs), dtype=np.float32)
+    tfidf_sp, _ = tfidf_rerank.build_tfidf_matrix([tfidf_raw], docid_idx_dict, vocab_idx_dict, workers=workers)
     logging.info(f'Finished building tf.idf sparse matrix.')
-    return sklearn.preprocessing.normalize(tfidf_sp, norm='l2')
+    return tfidf_sp
 
 
 def _safe_mkdir(path):
@@ -95,6 +61,8 @@ if __name__ == '__main__':
 
     parser = argparse.ArgumentParser()
     parser.add_argument("--config", type=str, help='config file', required=True)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help='number of processes parsing the tf.idf docvectors')
     args = parser.parse_args()
     config_file = args.config
 
@@ -105,23 +73,21 @@ if __name__ == '__main__':
     working_directory = config['working_directory']
     assert os.path.isdir(working_directory)
 
-    out_docid_idx_file = os.path.join(working_directory, 'test_docid_idx_dict.pkl')
+    out_docid_idx_file = os.path.join(working_directory, 'test_docid_idx.strings')
     out_feature_file = os.path.join(working_directory, 'test.npz')
 
     _safe_mkdir(working_directory)
 
     logging.info(f'Preparing test data...')
     logging.info("Loading vocabulary...")
-    with open(os.path.join(working_directory, 'vocab_idx_dict.pkl'), 'rb') as f:
-        vocab_dict = pickle.load(f)
+    vocab_dict = tfidf_rerank.StringStore(os.path.join(working_directory, 'vocab_idx.strings'))
 
     dump_docvectors(config)
     docid_idx_dict = build_docid_idx_dict(config)
-    tfidf_sp = build_tfidf_matrix(config, docid_idx_dict, vocab_dict)
+    tfidf_sp = build_tfidf_matrix(config, docid_idx_dict, vocab_dict, args.workers)
 
     logging.info(f'Writing docid_idx_dict to {out_docid_idx_file}')
-    with open(out_docid_idx_file, 'wb') as f:
-        pickle.dump(docid_idx_dict, f)
+    tfidf_rerank.write_string_store(out_docid_idx_file, list(docid_idx_dict))
 
     logging.info(f'Writing test data to {out_feature_file}...')
     scipy.sparse.save_npz(out_feature_file, tfidf_sp)
@@ -2,14 +2,14 @@ import argparse
 import json
 import logging
 import os
-import pickle
+import sys
 import time
 
 import numpy as np
 import scipy.sparse
-import sklearn.preprocessing
 
-import utils
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import tfidf_rerank
 
 
 def dump_docvectors(config):
@@ -41,7 +41,6 @@ def build_docid_idx_and_label(config):
                     if docid not in docid_idx_dict:
                         # Build docid_idx_dict: the idx is the row index for that document in the sparse matrix
                         docid_idx_dict[docid] = cur_idx
-                        docid_idx_dict[cur_idx] = docid
                         cur_idx += 1
 
                     # The "label" in this case is relevant/not-relevant
@@ -52,49 +51,14 @@ def build_docid_idx_and_label(config):
     return docid_idx_dict, topic_docid_label
 
 
-def build_vocab_tfidf_dict(config, docid_idx_dict, is_alpha):
-    logging.info('Building tf.idf dict for all sources...')
-    vocab_idx_dict, tfidf_dict = {}, {}
-    cur_idx = 0
-
-    for source in config['sources']:
-        source_name = source['name']
-        tfidf_raw = os.path.join(config['working_directory'], f'docids.{source_name}.docvector.TF_IDF.tar.gz')
-        logging.info(f'Building tf.idf dict for {tfidf_raw}')
-        count = 0
-
-        reader = utils.TfidfTgzReader(tfidf_raw)
-        while reader.hasnextdoc():
-            docid = reader.getnextdoc().strip()
-            count += 1
-            if count % 100000 == 0:
-                logging.info(f'{count} docs processed...')
-
-            if docid not in docid_idx_dict:
-                continue
-
-            doc_idx = docid_idx_dict[docid]
-            while reader.hasnexttfidf():
-                word, tfidf = reader.getnexttfidf()
-                if not is_alpha or word.isalpha():
-                    if word not in vocab_idx_dict:
-                        vocab_idx_dict[word] = cur_idx
-                        vocab_idx_dict[cur_idx] = word
-                        cur_idx += 1
-                    tfidf_dict[(doc_idx, vocab_idx_dict[word])] = float(tfidf)
-
-    logging.info(f'Finished building tf.idf dict, {cur_idx} unique words in total.')
-    return vocab_idx_dict, tfidf_dict
-
-
-def to_sparse(tfidf_dict, docid_idx_dict, vocab_idx_dict):
-    logging.info('Converting tf.idf dict into a sparse matrix...')
-    num_docs, num_vocabs = len(docid_idx_dict) // 2, len(vocab_idx_dict) // 2
-    indices = tuple(zip(*tfidf_dict.keys()))
-    values = list(tfidf_dict.values())
-    tfidf_sp = scipy.sparse.csr_matrix((values, indices), shape=(num_docs, num_vocabs), dtype=np.float32)
-
-    return sklearn.preprocessing.normalize(tfidf_sp, norm='l2')
+def build_vocab_tfidf_matrix(config, docid_idx_dict, is_alpha, workers):
+    logging.info('Building vocabulary and tf.idf matrix for all sources...')
+    tfidf_files = [os.path.join(config['working_directory'], f'docids.{source["name"]}.docvector.TF_IDF.tar.gz')
+                   for source in config['sources']]
+    tfidf_sp, vocab_idx_dict = tfidf_rerank.build_tfidf_matrix(tfidf_files, docid_idx_dict, is_alpha=is_alpha,
+                                                               workers=workers)
+    logging.info(f'Finished building tf.idf matrix, {len(vocab_idx_dict)} unique words in total.')
+    return vocab_idx_dict, tfidf_sp
 
 
 def write_train_feature(topic_docid_label: dict, feature_matrix: scipy.sparse.csr_matrix, out_path: str):
@@ -121,6 +85,8 @@ if __name__ == '__main__':
     parser.add_argument("--config", type=str, help='config file', required=True)
     parser.add_argument("--only-alpha", '-a', type=bool, default=False,
                         help='whether to only keep alpha words')
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help='number of processes parsing the tf.idf docvectors')
 
     args = parser.parse_args()
     is_alpha = args.only_alpha
@@ -140,19 +106,17 @@ if __name__ == '__main__':
 
     dump_docvectors(config)
     docid_idx_dict, topic_docid_label = build_docid_idx_and_label(config)
-    vocab_idx_dict, tfidf_dict = build_vocab_tfidf_dict(config, docid_idx_dict, is_alpha)
+    vocab_idx_dict, tfidf_sp = build_vocab_tfidf_matrix(config, docid_idx_dict, is_alpha, args.workers)
 
-    out_docid_idx_file = os.path.join(config['working_directory'], 'train_docid_idx_dict.pkl')
+    # Dict keys are in index order, so they are written as the strings of the stores
+    out_docid_idx_file = os.path.join(config['working_directory'], 'train_docid_idx.strings')
     logging.info(f"Writing docid_idx_dict to {out_docid_idx_file}...")
-    with open(out_docid_idx_file, 'wb') as f:
-        pickle.dump(docid_idx_dict, f)
+    tfidf_rerank.write_string_store(out_docid_idx_file, list(docid_idx_dict))
 
-    out_vocab_idx_file = os.path.join(config['working_directory'], 'vocab_idx_dict.pkl')
+    out_vocab_idx_file = os.path.join(config['working_directory'], 'vocab_idx.strings')
     logging.info(f"Writing vocab_idx_dict to {out_vocab_idx_file}...")
-    with open(out_vocab_idx_file, 'wb') as f:
-        pickle.dump(vocab_idx_dict, f)
+    tfidf_rerank.write_string_store(out_vocab_idx_file, list(vocab_idx_dict))
 
-    tfidf_sp = to_sparse(tfidf_dict, docid_idx_dict, vocab_idx_dict)
     write_train_feature(topic_docid_label, tfidf_sp, out_path=features_folder)
 
     logging.info(f'Finished in {time.time() - start_time} seconds')
@@ -2,7 +2,8 @@ import argparse
 import json
 import logging
 import os
-import pickle
+import sys
+import tempfile
 import time
 
 import lightgbm as lgb
@@ -11,6 +12,9 @@ import sklearn.linear_model
 import sklearn.svm
 import scipy.sparse
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import tfidf_rerank
+
 
 def load_train(topic, path):
     X = scipy.sparse.load_npz(os.path.join(path, f'{topic}.npz'))
@@ -52,31 +56,9 @@ def load_base_run(topics, rank_file, docid_idx_dict):
     return score_dict
 
 
-def rerank(test_doc_score, alpha, output, limit, tag):
-    def interpolate(old_score, new_score):
-        s_min, s_max = min(old_score), max(old_score)
-        old_score = (old_score - s_min) / (s_max - s_min)
-
-        s_min, s_max = min(new_score), max(new_score)
-        new_score = (new_score - s_min) / (s_max - s_min)
-
-        score = old_score * (1 - alpha) + new_score * alpha
-        return score
-
-    filename = f'rerank_{alpha}.txt'
-    with open(os.path.join(output, filename), 'w') as f:
-        logging.info(f'Writing output for alpha = {alpha}')
-        for topic in test_doc_score:
-            docid, _, old_score, new_score = test_doc_score[topic]
-            score = interpolate(np.array(old_score), new_score)
-            sorted_score = sorted(list(zip(docid, score)), key=lambda x: -x[1])
-
-            rank = 1
-            for docid, score in sorted_score:
-                f.write(f'{topic} Q0 {docid} {rank} {score} h2oloo_{tag}\n')
-                rank += 1
-                if rank > limit:
-                    break
+def rerank(test_doc_score, alphas, output, limit, tag):
+    logging.info(f'Writing output for alpha = {", ".join(str(alpha) for alpha in alphas)}')
+    tfidf_rerank.write_reranked_runs(test_doc_score, alphas, output, limit, tag)
 
 
 def evaluate_topic(X_train, y_train, X_test, classifier):
@@ -107,22 +89,36 @@ def evaluate_topic(X_train, y_train, X_test, classifier):
         return y_test
 
 
-def run_classifier(config, classifier, output_folder):
-    start_time = time.time()
-    logging.info(f'Begin training/inference using {classifier} classifier...')
+def _init_topic_worker(test_buffers_folder, feature_folder):
+    global worker_test_data, worker_train_feature_folder
+    worker_test_data = tfidf_rerank.load_csr_buffers(test_buffers_folder)
+    worker_train_feature_folder = feature_folder
 
-    for topic in config['topics']:
-        X_train, y_train = load_train(topic, train_feature_folder)
-        _, doc_idx, _ = test_doc_score[topic]
-        X_test = test_data[doc_idx]
 
-        logging.info(f'Processing topic {topic}')
-        y_test = evaluate_topic(X_train, y_train, X_test, classifier)
+def classify_topic(topic, doc_idx, classifier):
+    X_train, y_train = load_train(topic, worker_train_feature_folder)
+    X_test = worker_test_data[doc_idx]
+    return evaluate_topic(X_train, y_train, X_test, classifier)
 
+
+def run_classifier(config, classifier, output_folder, workers):
+    start_time = time.time()
+    logging.info(f'Begin training/inference using {classifier} classifier with {workers} workers...')
+
+    # The test matrix is memory-mapped by the workers rather than copied into each of them
+    with tempfile.TemporaryDirectory(dir=working_directory) as test_buffers_folder:
+        tfidf_rerank.save_csr_buffers(test_data, test_buffers_folder)
+        tasks = [(topic, (test_doc_score[topic][1], classifier)) for topic in config['topics']]
+        y_tests, timings = tfidf_rerank.map_topics(classify_topic, tasks, workers, _init_topic_worker,
+                                                   (test_buffers_folder, train_feature_folder))
+
+    for topic, y_test in zip(config['topics'], y_tests):
         test_doc_score[topic].append(y_test)
 
-    for alpha in [0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0]:
-        rerank(test_doc_score, alpha, output_folder, 10000, classifier)
+    with open(os.path.join(output_folder, 'topic_times.json'), 'w') as f:
+        json.dump(timings, f, indent=2)
+
+    rerank(test_doc_score, [0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0], output_folder, 10000, classifier)
 
     logging.info(f'Finished with {classifier} in {time.time() - start_time} seconds')
 
@@ -137,6 +133,8 @@ if __name__ == '__main__':
 
     parser = argparse.ArgumentParser()
     parser.add_argument("--config", type=str, help='config file', required=True)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help='number of topics trained and scored concurrently')
     args = parser.parse_args()
     config_file = args.config
 
@@ -149,7 +147,7 @@ if __name__ == '__main__':
 
     train_feature_folder = os.path.join(working_directory, 'features')
     test_feature_path = os.path.join(working_directory, 'test.npz')
-    test_docid_idx_path = os.path.join(working_directory, 'test_docid_idx_dict.pkl')
+    test_docid_idx_path = os.path.join(working_directory, 'test_docid_idx.strings')
     models_folder = os.path.join(working_directory, 'models')
 
     # sanity check
@@ -160,8 +158,7 @@ if __name__ == '__main__':
     for classifier in config['classifiers']:
         logging.info(f'Applying {classifier}...')
         logging.info('Loading docid_idx dict...')
-        with open(test_docid_idx_path, 'rb') as f:
-            test_docid_idx_dict = pickle.load(f)
+        test_docid_idx_dict = tfidf_rerank.StringStore(test_docid_idx_path)
 
         test_doc_score = load_base_run(config['topics'], config['target']['run'], test_docid_idx_dict)
         test_data = load_test(test_feature_path)
@@ -170,4 +167,4 @@ if __name__ == '__main__':
         _safe_mkdir(model_folder)
 
         # There's some use of global variables above that needs to be undone in refactoring...
-        run_classifier(config, classifier, model_folder)
+        run_classifier(config, classifier, model_folder, args.workers)
@@ -81,4 +81,4 @@ class TfidfTgzReader(object):
         return True
 
     def getnexttfidf(self):
-        return self._curtfidf
\ No newline at end of file
+        return self._curtfidf
@@ -14,52 +14,153 @@
 # limitations under the License.
 #
 
+import argparse
+import gzip
 import json
 import os
-import argparse
+import time
+from multiprocessing import Pool
 """
 The name of this file is a bit misleading since the original FEVER dataset is
 also in JSONL format. This script converts them into a JSONL format compatible
 with anserini.
+
+Each wiki-pages file is converted by its own worker process into its own
+shards, docs{file index}_{shard index}.json(.gz). Documents get either global
+integer ids, numbered in the order of the sorted input files from per-file
+offsets computed in a first counting pass, or stable ids taken from the
+collection: the page id for paragraphs and (page id)_(sentence id) for
+sentences, which needs no counting pass.
 """
 
+# json.dumps escapes strings with this function, so the output is the same
+encode_string = json.encoder.encode_basestring_ascii
+
+
+def parse_docs(line, granularity):
+    """
+    Returns the (id suffix, contents) of the documents of a wiki-pages line
+    """
+    line_json = json.loads(line)
+    if granularity == 'sentence':
+        # each li in "lines" is of the format: (sentence id)\t(sentence)[\t(tag)\t...\t(tag)]
+        docs = []
+        for i, li in enumerate(line_json['lines'].split('\n')):
+            if li == '':  # don't split by tabs if "lines" is empty
+                docs.append((f'{line_json["id"]}_{i}', li))
+            else:
+                fields = li.split('\t')
+                docs.append((f'{line_json["id"]}_{fields[0]}', fields[1]))
+        return docs
+    else:  # granularity == 'paragraph'
+        return [(line_json['id'], line_json['text'])]
+
+
+def count_docs(params):
+    path, granularity = params
+    count = 0
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if granularity == 'sentence':
+                count += json.loads(line)['lines'].count('\n') + 1
+            else:
+                count += 1
+    return count
+
+
+class ShardWriter:
+    """
+    Writes jsonl lines to numbered shards of at most max_docs documents each, buffering
+    lines and optionally compressing the shards with gzip.
+    """
+    def __init__(self, output_folder, prefix, max_docs, compress=False, buffer_docs=10000):
+        self.output_folder = output_folder
+        self.prefix = prefix
+        self.max_docs = max_docs
+        self.compress = compress
+        self.buffer_docs = buffer_docs
+        self.buffer = []
+        self.shard = None
+        self.shard_index = 0
+        self.shard_docs = 0
+        self.num_docs = 0
+
+    def _open(self):
+        name = f'{self.prefix}_{self.shard_index:02d}.json'
+        if self.compress:
+            self.shard = gzip.open(os.path.join(self.output_folder, name + '.gz'), 'wb', compresslevel=6)
+        else:
+            self.shard = open(os.path.join(self.output_folder, name), 'wb')
+        self.shard_index += 1
+        self.shard_docs = 0
+
+    def _flush(self):
+        if self.buffer:
+            self.shard.write(''.join(self.buffer).encode('utf-8'))
+            self.buffer = []
+
+    def write(self, line):
+        if self.shard is None or self.shard_docs == self.max_docs:
+            self._flush()
+            if self.shard is not None:
+                self.shard.close()
+            self._open()
+        self.buffer.append(line)
+        self.shard_docs += 1
+        self.num_docs += 1
+        if len(self.buffer) == self.buffer_docs:
+            self._flush()
+
+    def close(self):
+        if self.shard is not None:
+            self._flush()
+            self.shard.close()
+            self.shard = None
+
+
+def convert_file(params):
+    file_index, path, offset, args = params
+    start = time.time()
+    writer = ShardWriter(args.output_folder, f'docs{file_index:02d}', args.max_docs_per_file, args.compress)
+    doc_index = offset
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            for stable_id, doc in parse_docs(line, args.granularity):
+                if offset is None:
+                    doc_id = encode_string(stable_id)
+                else:
+                    doc_id = doc_index
+                    doc_index += 1
+                writer.write(f'{{"id": {doc_id}, "contents": {encode_string(doc)}}}\n')
+    writer.close()
+    return path, writer.shard_index, writer.num_docs, time.time() - start
+
+
 def convert_collection(args):
     print('Converting collection...')
+    start = time.time()
 
-    files = os.listdir(args.collection_folder)
-    file_index = 0
-    doc_index = 0
-    for file in files:
-        with open(os.path.join(args.collection_folder, file), 'r', encoding='utf-8') as f:
-            for line in f:
-                line_json = json.loads(line.strip())
-                if args.granularity == 'sentence':
-                    # each li in "lines" is of the format: (sentence id)\t(sentence)[\t(tag)\t...\t(tag)]
-                    docs = []
-                    for li in line_json['lines'].split('\n'):
-                        if li == '':  # don't split by tabs if "lines" is empty
-                            docs.append(li)
-                        else:
-                            docs.append(li.split('\t')[1])
-                else:  # args.granularity == 'paragraph'
-                    docs = [line_json['text']]
-
-                for doc in docs:
-                    if doc_index % args.max_docs_per_file == 0:
-                        if doc_index > 0:
-                            output_jsonl_file.close()
-                        output_path = os.path.join(args.output_folder, f'docs{file_index:02d}.json')
-                        output_jsonl_file = open(output_path, 'w', encoding='utf-8', newline='\n')
-                        file_index += 1
-
-                    output_dict = {'id': doc_index, 'contents': doc}
-                    output_jsonl_file.write(json.dumps(output_dict) + '\n')
-                    doc_index += 1
+    files = [os.path.join(args.collection_folder, file) for file in sorted(os.listdir(args.collection_folder))]
+    with Pool(args.workers) as pool:
+        if args.ids == 'global':
+            # global ids are numbered from the offset of each file, i.e., the number of docs before it
+            counts = pool.map(count_docs, [(path, args.granularity) for path in files])
+            offsets = [sum(counts[:i]) for i in range(len(files))]
+        else:
+            offsets = [None] * len(files)
 
-                    if doc_index % 100000 == 0:
-                        print('Converted {} docs in {} files'.format(doc_index, file_index))
+        total_docs = 0
+        total_shards = 0
+        for path, num_shards, num_docs, seconds in pool.imap_unordered(
+                convert_file, [(i, path, offset, args) for i, (path, offset) in enumerate(zip(files, offsets))]):
+            total_docs += num_docs
+            total_shards += num_shards
+            print(f'Converted {num_docs} docs from {os.path.basename(path)} in {seconds:.1f}s '
+                  f'({num_docs / max(seconds, 1e-9):.0f} docs/sec)')
 
-    output_jsonl_file.close()
+    seconds = time.time() - start
+    print(f'Converted {total_docs} docs in {total_shards} files in {seconds:.1f}s '
+          f'({total_docs / max(seconds, 1e-9):.0f} docs/sec with {args.workers} workers)')
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Converts FEVER jsonl wikipedia dump to anserini jsonl files.')
@@ -73,6 +174,18 @@ if __name__ == '__main__':
                         required=True,
                         choices=['paragraph', 'sentence'],
                         help='The granularity of the source documents to index. Either "paragraph" or "sentence".')
+    parser.add_argument('--ids',
+                        default='global',
+                        choices=['global', 'stable'],
+                        help='Either global integer ids, or stable ids from the collection: (page id) for '
+                             'paragraphs and (page id)_(sentence id) for sentences.')
+    parser.add_argument('--workers',
+                        default=os.cpu_count(),
+                        type=int,
+                        help='Number of processes converting the wiki-pages files.')
+    parser.add_argument('--compress',
+                        action='store_true',
+                        help='Compress the jsonl files with gzip.')
     args = parser.parse_args()
 
     if not os.path.exists(args.output_folder):
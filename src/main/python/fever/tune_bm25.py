@@ -16,32 +16,84 @@
 
 import argparse
 import os
+import random
 import re
 import subprocess
+import sys
 
-def grid_search(args):
-    for k1 in [0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9]:
-        for b in [0.1, 0.2, 0.3, 0.4, 0.5, 0.6]:
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'fine_tuning'))
+from adaptive_search import STRATEGIES, IncrementalRetrieval, read_topics
+from search_server import SearchServer, search_args
+from trec_eval_vectorized import Qrels, evaluate_run
+
+K1_VALUES = [0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9]
+B_VALUES = [0.1, 0.2, 0.3, 0.4, 0.5, 0.6]
+
+def grid_search(args, server=None):
+    commands = []
+    for k1 in K1_VALUES:
+        for b in B_VALUES:
             print(f'Retrieving with k1 = {k1}, b = {b}...')
             run_file = os.path.join(args.runs_folder, f'run.fever.bm25.k1_{k1}.b_{b}.txt')
             if os.path.isfile(run_file):
                 print('Run already exists, skipping!')
             else:
-                subprocess.call(f'sh target/appassembler/bin/SearchCollection '
-                                f'-index {args.index_folder} '
-                                f'-topics {args.queries_file} '
-                                '-topicreader TsvInt '
-                                f'-output {run_file} '
-                                '-bm25 '
-                                f'-bm25.k1 {k1} '
-                                f'-bm25.b {b}',
-                                shell=True)
+                command = (f'sh target/appassembler/bin/SearchCollection '
+                           f'-index {args.index_folder} '
+                           f'-topics {args.queries_file} '
+                           '-topicreader TsvInt '
+                           f'-output {run_file} '
+                           '-bm25 '
+                           f'-bm25.k1 {k1} '
+                           f'-bm25.b {b}')
+                if server is None:
+                    subprocess.call(command, shell=True)
+                else:
+                    commands.append(search_args(command))
+    if server is not None:
+        server.search_all(commands, args.parallelism)
+
+def adaptive_search(args, server=None):
+    # retrieve and evaluate the k1/b grid on growing subsets of the queries, pruning the
+    # worst settings at each step; only the runs of the surviving settings are kept
+    topics = read_topics(args.queries_file)
+    qrels = Qrels(args.qrels_file)
+    qids = sorted(qid for qid in topics[1] if qid in qrels.topic_index)
+    random.Random(0).shuffle(qids)
+    settings = {f'k1_{k1}.b_{b}': (k1, b) for k1 in K1_VALUES for b in B_VALUES}
+
+    def command(setting):
+        k1, b = settings[setting]
+        return (f'sh target/appassembler/bin/SearchCollection '
+                f'-index {args.index_folder} '
+                '-topicreader TsvInt '
+                '-bm25 '
+                f'-bm25.k1 {k1} '
+                f'-bm25.b {b}')
+
+    def evaluate(run_file):
+        # maximize R@100
+        results = evaluate_run(qrels, run_file, ['recall.100'])
+        return dict(zip(results.topics, results.scores['recall_100'].tolist()))
+
+    retrieval = IncrementalRetrieval(topics, os.path.join(args.runs_folder, 'adaptive'), command, evaluate,
+                                     args.parallelism, server)
+    strategy = STRATEGIES[args.search](eta=args.eta, min_topics=args.min_topics)
+    for setting, recall in strategy.search(list(settings), qids, retrieval.score):
+        print(f'k1 = {settings[setting][0]}, b = {settings[setting][1]}: R@100 = {recall:.4f}')
+        retrieval.merge(setting, os.path.join(args.runs_folder, f'run.fever.bm25.{setting}.txt'))
+    retrieval_time, full_time, fraction = retrieval.report(len(settings), len(qids))
+    print(f'Retrieved {fraction:.1%} of the grid in {retrieval_time:.1f}s, '
+          f'the full grid would take about {full_time:.1f}s')
 
 def evaluate_runs(args):
     max_recall = 0
     max_file = ''
     for file in os.listdir(args.runs_folder):
         run_file = os.path.join(args.runs_folder, file)
+        if not os.path.isfile(run_file):
+            continue
         # evaluate with trec_eval
         results = subprocess.check_output(['tools/eval/trec_eval.9.0.4/trec_eval',
                                            '-mrecall.100',
@@ -68,12 +120,31 @@ if __name__ == '__main__':
     parser.add_argument('--index_folder', required=True, help='Lucene index to use.')
     parser.add_argument('--queries_file', required=True, help='Queries file.')
     parser.add_argument('--qrels_file', required=True, help='Qrels file.')
+    parser.add_argument('--search', default='grid', choices=['grid'] + list(STRATEGIES),
+                        help='Retrieve the full k1/b grid, or search it adaptively on subsets of the queries.')
+    parser.add_argument('--eta', type=int, default=3,
+                        help='Keep the best 1/eta settings at each step of the adaptive search.')
+    parser.add_argument('--min_topics', type=int, default=1000,
+                        help='Minimum number of queries of the first step of the adaptive search.')
+    parser.add_argument('--parallelism', type=int, default=1,
+                        help='Number of retrievals to run in parallel in the adaptive search or with --server.')
+    parser.add_argument('--server', action='store_true',
+                        help='Submit the retrievals to a single warm SearchCollectionServer instead of launching '
+                             'a JVM for each one.')
     args = parser.parse_args()
 
     if not os.path.exists(args.runs_folder):
         os.makedirs(args.runs_folder)
 
-    grid_search(args)
+    server = SearchServer(connections=args.parallelism).start() if args.server else None
+    try:
+        if args.search == 'grid':
+            grid_search(args, server)
+        else:
+            adaptive_search(args, server)
+    finally:
+        if server is not None:
+            server.close()
     evaluate_runs(args)
 
     print('Done!')
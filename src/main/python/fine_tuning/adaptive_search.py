@@ -0,0 +1,249 @@
+#
+# Anserini: A Lucene toolkit for reproducible information retrieval research
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import logging
+import math
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import time
+from multiprocessing import Pool
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from search_server import search_args
+
+logging.basicConfig()
+
+TOPIC_BLOCK = re.compile(r'<top>.*?</top>\s*|<topic\b.*?</topic>\s*', re.S)
+TOPIC_ID = re.compile(r'<num>\s*(?:Number:)?\s*([^\s<]+)|number="([^"]+)"')
+
+
+def read_topics(topic_file):
+    """
+    Split a topic file into the text of each topic, so that subsets of the topics can be
+    written in the same format and read with the same topic reader. SGML/XML topics
+    (<top> or <topic number=...> blocks) and one-topic-per-line TSV topics are supported.
+
+    @Return: (prefix, {qid: text}, suffix), or None if the format is not recognized
+    """
+    with open(topic_file) as f:
+        content = f.read()
+    if content.lstrip().startswith('<'):
+        blocks = list(TOPIC_BLOCK.finditer(content))
+        if not blocks:
+            return None
+        topics = {}
+        for block in blocks:
+            match = TOPIC_ID.search(block.group(0))
+            if match is None:
+                return None
+            topics[match.group(1) or match.group(2)] = block.group(0)
+        return content[:blocks[0].start()], topics, content[blocks[-1].end():]
+    topics = {}
+    for line in content.splitlines(True):
+        if line.strip():
+            topics[line.split('\t', 1)[0].strip()] = line if line.endswith('\n') else line + '\n'
+    return '', topics, ''
+
+
+def write_topics(topics, qids, output_path):
+    prefix, texts, suffix = topics
+    with open(output_path, 'w') as f:
+        f.write(prefix)
+        for qid in qids:
+            f.write(texts[qid])
+        f.write(suffix)
+
+
+class SuccessiveHalving(object):
+    """
+    Successive halving over a fixed set of configurations: all of them are evaluated on a
+    small subset of the topics, the best 1/eta are kept and evaluated on eta times as many
+    topics, and so on until the survivors are evaluated on all the topics. Topic subsets are
+    nested, so a configuration is only ever retrieved once per topic.
+    """
+    def __init__(self, eta=3, min_topics=10):
+        self.logger = logging.getLogger('adaptive_search.SuccessiveHalving')
+        self.eta = eta
+        self.min_topics = min_topics
+
+    def rungs(self, num_configs, num_topics, num_rungs=None):
+        """
+        @Return: the (number of configurations, number of topics) of each rung
+        """
+        if num_rungs is None:
+            num_rungs = 0
+            while num_configs // self.eta ** (num_rungs + 1) >= 1 and \
+                    num_topics / self.eta ** (num_rungs + 1) >= self.min_topics:
+                num_rungs += 1
+        rungs = []
+        for i in range(num_rungs + 1):
+            configs = max(1, num_configs // self.eta ** i) if i > 0 else num_configs
+            topics = num_topics if i == num_rungs else max(1, math.ceil(num_topics / self.eta ** (num_rungs - i)))
+            rungs.append((configs, topics))
+        return rungs
+
+    def search(self, configs, topics, score, num_rungs=None):
+        """
+        score(configs, topics) returns the score of each configuration on the topics
+
+        @Return: the surviving configurations ordered from best to worst, with their scores
+        on all the topics
+        """
+        survivors = list(configs)
+        for i, (num_configs, num_topics) in enumerate(self.rungs(len(configs), len(topics), num_rungs)):
+            survivors = survivors[:num_configs]
+            scores = score(survivors, topics[:num_topics])
+            ranked = sorted(zip(scores, survivors), key=lambda x: -x[0])
+            self.logger.info('rung %d: %d configurations on %d topics, best %.4f (%s)'
+                             % (i, len(survivors), num_topics, ranked[0][0], ranked[0][1]))
+            survivors = [config for _, config in ranked]
+        return [(config, s) for s, config in ranked]
+
+
+class Hyperband(object):
+    """
+    Hyperband: successive halving brackets that trade the number of configurations for the
+    number of topics they are first evaluated on, from many configurations on few topics to
+    few configurations on all the topics. Each bracket samples its configurations from the grid.
+    """
+    def __init__(self, eta=3, min_topics=10, seed=0):
+        self.logger = logging.getLogger('adaptive_search.Hyperband')
+        self.eta = eta
+        self.min_topics = min_topics
+        self.seed = seed
+
+    def search(self, configs, topics, score):
+        successive_halving = SuccessiveHalving(self.eta, self.min_topics)
+        max_rungs = len(successive_halving.rungs(len(configs), len(topics))) - 1
+        rng = random.Random(self.seed)
+        results = {}
+        for num_rungs in range(max_rungs, -1, -1):
+            num_configs = min(len(configs), math.ceil((max_rungs + 1) / (num_rungs + 1) * self.eta ** num_rungs))
+            self.logger.info('bracket with %d rungs: %d configurations' % (num_rungs, num_configs))
+            bracket = rng.sample(configs, num_configs)
+            results.update(successive_halving.search(bracket, topics, score, num_rungs))
+        return sorted(results.items(), key=lambda x: -x[1])
+
+
+STRATEGIES = {
+    'successive_halving': SuccessiveHalving,
+    'hyperband': Hyperband
+}
+
+
+def atom_retrieval(command):
+    start = time.time()
+    subprocess.call(command, shell=True)
+    return time.time() - start
+
+
+class IncrementalRetrieval(object):
+    """
+    Retrieve and evaluate configurations on growing subsets of the topics. Each call only
+    retrieves the topics a configuration has not been retrieved on yet, into a segment run
+    file, and the per-topic scores of the segments are kept so that the score of any subset
+    of the retrieved topics comes for free.
+
+    topics are the topics as returned by read_topics, command(config) is the retrieval command
+    of a configuration without -topics and -output, and evaluate(run_file) returns the
+    per-topic scores {qid: value} of a run file. The retrievals are submitted to the search
+    server if one is given, instead of running the commands.
+    """
+    def __init__(self, topics, work_dir, command, evaluate, parallelism=4, server=None):
+        self.logger = logging.getLogger('adaptive_search.IncrementalRetrieval')
+        self.topics = topics
+        self.work_dir = work_dir
+        self.command = command
+        self.evaluate = evaluate
+        self.parallelism = parallelism
+        self.server = server
+        self.segments = {}
+        self.scores = {}
+        self.retrieval_time = 0.0
+        self.pairs = 0
+        if not os.path.exists(self.work_dir):
+            os.makedirs(self.work_dir)
+
+    def _segment_path(self, config, first, last):
+        return os.path.join(self.work_dir, '%s.%s-%s' % (config, first, last))
+
+    def score(self, configs, qids):
+        # Configurations needing the same topics share the same topic subset file
+        missing = {}
+        for config in configs:
+            self.scores.setdefault(config, {})
+            self.segments.setdefault(config, {'files': [], 'qids': set()})
+            todo = tuple(qid for qid in qids if qid not in self.segments[config]['qids'])
+            if todo:
+                missing.setdefault(todo, []).append(config)
+
+        commands, segments = [], []
+        for todo, todo_configs in missing.items():
+            topic_file = os.path.join(self.work_dir, 'topics.%s-%s' % (todo[0], todo[-1]))
+            write_topics(self.topics, todo, topic_file)
+            for config in todo_configs:
+                segment = self._segment_path(config, todo[0], todo[-1])
+                commands.append('%s -topics %s -output %s' % (self.command(config), topic_file, segment))
+                segments.append((config, todo, segment))
+
+        if commands:
+            start = time.time()
+            if self.server is not None:
+                self.server.search_all([search_args(command) for command in commands], self.parallelism)
+            else:
+                p = Pool(min(self.parallelism, len(commands)))
+                p.map(atom_retrieval, commands)
+                p.close()
+            self.retrieval_time += time.time() - start
+            self.pairs += sum(len(todo) for _, todo, _ in segments)
+
+        for config, todo, segment in segments:
+            self.segments[config]['files'].append(segment)
+            self.segments[config]['qids'].update(todo)
+            if os.path.exists(segment):
+                self.scores[config].update(self.evaluate(segment))
+
+        # Topics without any judged document retrieved score zero
+        return [sum(self.scores[config].get(qid, 0.0) for qid in qids) / len(qids) for config in configs]
+
+    def merge(self, config, output_path):
+        """
+        Concatenate the segments of a configuration into a single run file
+        """
+        with open(output_path, 'w') as fout:
+            for segment in self.segments[config]['files']:
+                if os.path.exists(segment):
+                    with open(segment) as fin:
+                        shutil.copyfileobj(fin, fout)
+
+    def report(self, num_configs, num_topics):
+        """
+        The wall-clock saved versus retrieving every configuration on all the topics, at
+        the measured retrieval time per configuration and topic
+
+        @Return: (retrieval time, estimated time of the full grid, fraction of the grid retrieved)
+        """
+        full_pairs = num_configs * num_topics
+        full_time = self.retrieval_time / self.pairs * full_pairs if self.pairs else 0.0
+        self.logger.info('retrieved %d of %d configuration-topic pairs (%.1f%%) in %.1fs, '
+                         'the full grid would take about %.1fs: %.1fs saved'
+                         % (self.pairs, full_pairs, 100.0 * self.pairs / full_pairs, self.retrieval_time,
+                            full_time, full_time - self.retrieval_time))
+        return self.retrieval_time, full_time, float(self.pairs) / full_pairs
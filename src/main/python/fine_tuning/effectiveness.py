@@ -21,6 +21,10 @@ import os
 from inspect import currentframe, getframeinfo
 from operator import itemgetter
 
+import numpy as np
+
+from eval_cache import EvalCache
+
 logging.basicConfig()
 
 
@@ -78,6 +82,41 @@ class Effectiveness(object):
         with open(output_fn, 'w') as o:
             json.dump(all_best_results, o, indent=2, sort_keys=True)
 
+    def output_effectiveness_from_cache(self, output_root):
+        """
+        Same as output_effectiveness for every model and eval, but reading the per-topic values
+        of all the parameters at once from the eval cache of the collection. Ties are broken in
+        favor of the run listed first in the cache.
+        """
+        if not os.path.exists(os.path.join(output_root, self.effectiveness_root)):
+            os.makedirs(os.path.join(output_root, self.effectiveness_root))
+        cache = EvalCache.load(output_root)
+        models, _ = cache.split_runs()
+        # As in read_eval_file, the parameters are the second part of the run file name
+        paras = [run.split('_')[1] for run in cache.runs]
+        models, paras = np.array(models), np.array(paras)
+
+        for model in sorted(set(models.tolist())):
+            rows = np.flatnonzero(models == model)
+            for group in sorted(set(cache.groups)):
+                all_best_results = {}
+                for col, metric in enumerate(cache.metrics):
+                    if cache.groups[col] != group:
+                        continue
+                    values = cache.values[rows, :, col]
+                    evaluated = ~np.isnan(values)
+                    if not evaluated.any():
+                        continue
+                    best = np.argmax(np.where(evaluated, values, -np.inf), axis=0)
+                    all_best_results[metric] = {
+                        cache.topics[t]: {'value': float(values[best[t], t]), 'para': str(paras[rows[best[t]]])}
+                        for t in np.flatnonzero(evaluated.any(axis=0))
+                    }
+                if all_best_results:
+                    output_fn = os.path.join(output_root, self.effectiveness_root, model + '_' + group)
+                    with open(output_fn, 'w') as o:
+                        json.dump(all_best_results, o, indent=2, sort_keys=True)
+
     def read_eval_file(self, fn):
         """
         return {qid: {metric: [(value, para), ...]}}
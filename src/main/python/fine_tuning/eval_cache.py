@@ -0,0 +1,116 @@
+#
+# Anserini: A Lucene toolkit for reproducible information retrieval research
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import logging
+import os
+
+import numpy as np
+
+logging.basicConfig()
+
+
+class EvalCache(object):
+    """
+    Per-topic evaluation results of all the run files of a collection, stored column-wise
+    in a single NPZ file: a (run x topic x metric) array of values, NaN where a run has
+    no value, along with the names of the runs, the topics ('all' for the average) and
+    the metrics. Each metric belongs to the group of the eval that produced it (the
+    'metric' of the eval in collections.yaml, e.g. ndcg20 for both ndcg20 and err20).
+    """
+    cache_file = 'eval_cache.npz'
+
+    def __init__(self, runs=(), topics=(), metrics=(), groups=(), values=None):
+        self.logger = logging.getLogger('eval_cache.EvalCache')
+        self.runs = list(runs)
+        self.topics = list(topics)
+        self.metrics = list(metrics)
+        self.groups = list(groups)
+        if values is None:
+            values = np.full((len(self.runs), len(self.topics), len(self.metrics)), np.nan)
+        self.values = values
+
+    @classmethod
+    def path(cls, output_root):
+        return os.path.join(output_root, cls.cache_file)
+
+    @classmethod
+    def exists(cls, output_root):
+        return os.path.exists(cls.path(output_root))
+
+    @classmethod
+    def load(cls, output_root):
+        """
+        Loads the cache of a collection output root, or returns an empty one
+        """
+        if not cls.exists(output_root):
+            return cls()
+        with np.load(cls.path(output_root), allow_pickle=False) as data:
+            return cls(data['runs'].tolist(), data['topics'].tolist(), data['metrics'].tolist(),
+                       data['groups'].tolist(), data['values'])
+
+    def save(self, output_root):
+        # np.savez appends .npz to names without it, so the temporary file keeps the extension
+        tmp_path = self.path(output_root)[:-len('.npz')] + '.tmp.npz'
+        np.savez(tmp_path, runs=np.array(self.runs, dtype=str), topics=np.array(self.topics, dtype=str),
+                 metrics=np.array(self.metrics, dtype=str), groups=np.array(self.groups, dtype=str),
+                 values=self.values)
+        os.replace(tmp_path, self.path(output_root))
+
+    def has(self, run, group):
+        """
+        Whether the run was already evaluated for the metrics of a group
+        """
+        if run not in self.runs:
+            return False
+        columns = [i for i, g in enumerate(self.groups) if g == group]
+        return len(columns) > 0 and not np.isnan(self.values[self.runs.index(run)][:, columns]).all()
+
+    def update(self, results):
+        """
+        Adds evaluation results, a list of (run, {group: {metric: {qid: value}}})
+        """
+        runs, topics, metrics = list(self.runs), list(self.topics), list(self.metrics)
+        groups = list(self.groups)
+        for run, run_results in results:
+            if run not in runs:
+                runs.append(run)
+            for group, group_results in run_results.items():
+                for metric, per_topic in group_results.items():
+                    if metric not in metrics:
+                        metrics.append(metric)
+                        groups.append(group)
+                    for qid in per_topic:
+                        if qid not in topics:
+                            topics.append(qid)
+
+        values = np.full((len(runs), len(topics), len(metrics)), np.nan)
+        values[:len(self.runs), :len(self.topics), :len(self.metrics)] = self.values
+        run_index = {run: i for i, run in enumerate(runs)}
+        topic_index = {qid: i for i, qid in enumerate(topics)}
+        metric_index = {metric: i for i, metric in enumerate(metrics)}
+        for run, run_results in results:
+            for group_results in run_results.values():
+                for metric, per_topic in group_results.items():
+                    row = values[run_index[run], :, metric_index[metric]]
+                    row[[topic_index[qid] for qid in per_topic]] = list(per_topic.values())
+
+        self.runs, self.topics, self.metrics, self.groups, self.values = runs, topics, metrics, groups, values
+
+    def split_runs(self):
+        """
+        Splits the run file names into models and parameters, as in model_params
+        """
+        return [run.split('_', 1)[0] for run in self.runs], [run.split('_', 1)[1] for run in self.runs]
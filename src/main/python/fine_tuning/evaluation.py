@@ -16,9 +16,13 @@
 
 import logging
 import os
+import sys
 from inspect import currentframe, getframeinfo
 from subprocess import Popen, PIPE
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from trec_eval_vectorized import Qrels, evaluate, load_run, metric_key, parse_metric
+
 logging.basicConfig()
 
 
@@ -69,16 +73,121 @@ class Evaluation(object):
                     if 'trec_eval' in qrel_program:
                         o.write(stdout.decode("utf-8"))
                     elif 'gdeval' in qrel_program:
-                        for line in stdout.decode("utf-8").split('\n')[1:-1]:
-                            line = line.strip()
-                            if line:
-                                row = line.split(',')
-                                qid = row[-3]
-                                ndcg20 = row[-2]
-                                err20 = row[-1]
-                                o.write('ndcg20\t%s\t%s\n' % (qid if qid != 'amean' else 'all', ndcg20))
-                                o.write('err20\t%s\t%s\n' % (qid if qid != 'amean' else 'all', err20))
+                        for metric, qid, value in self.parse_gdeval_output(stdout):
+                            o.write('%s\t%s\t%s\n' % (metric, qid, value))
                 finally:
                     o.close()
             else:
                 self.logger.error('ERROR when running the evaluation for:' + result_file_path)
+
+    @staticmethod
+    def parse_gdeval_output(stdout):
+        """
+        Parse the ndcg20 and err20 of each topic from gdeval output, naming the average 'all'
+
+        @Return: a list of (metric, qid, value) tuples
+        """
+        rows = []
+        for line in stdout.decode("utf-8").split('\n')[1:-1]:
+            line = line.strip()
+            if line:
+                row = line.split(',')
+                qid = row[-3] if row[-3] != 'amean' else 'all'
+                rows.append(('ndcg20', qid, row[-2]))
+                rows.append(('err20', qid, row[-1]))
+        return rows
+
+    @staticmethod
+    def parse_trec_eval_output(stdout):
+        """
+        Parse the values of each topic from trec_eval -q output, skipping non-numeric ones such as runid
+
+        @Return: a list of (metric, qid, value) tuples
+        """
+        rows = []
+        for line in stdout.decode("utf-8").split('\n'):
+            row = line.split()
+            if len(row) == 3:
+                try:
+                    float(row[2])
+                except ValueError:
+                    continue
+                rows.append((row[0], row[1], row[2]))
+        return rows
+
+    @staticmethod
+    def trec_eval_metrics(eval):
+        """
+        The metrics of an eval that can be computed in-process, i.e., a trec_eval command
+        with only -m and -q options whose measures trec_eval_vectorized supports
+
+        @Return: a list of metrics, or None if the eval has to run its command
+        """
+        if 'trec_eval' not in eval['command']:
+            return None
+        metrics = []
+        options = eval['params'].split()
+        for i, option in enumerate(options):
+            if option == '-m' and i + 1 < len(options):
+                metrics.append(options[i + 1])
+            elif option != '-q' and (i == 0 or options[i - 1] != '-m'):
+                return None
+        try:
+            for metric in metrics:
+                parse_metric(metric)
+        except ValueError:
+            return None
+        return metrics if metrics else None
+
+    @classmethod
+    def evaluate_in_process(cls, evals, qrels, qrel_file_path, result_file_path, anserini_root=''):
+        """
+        Evaluate a run file for each eval of the collection. The run file is loaded once and
+        scored in-process against the already loaded qrels for the trec_eval measures, and
+        values are rounded to the precision of the eval, as printed by the command. Other evals
+        still run their command, whose output is parsed as trec_eval or gdeval output.
+
+        @Return: a dict {eval metric: {metric: {qid: value}}}
+        """
+        results = {}
+        run = None
+        for eval in evals:
+            metrics = cls.trec_eval_metrics(eval)
+            precision = eval.get('metric_precision', 4)
+            if metrics is not None:
+                if run is None:
+                    run = load_run(result_file_path, qrels)
+                evaluation = evaluate(qrels, run, metrics)
+                group_results = {}
+                for metric in metrics:
+                    key = metric_key(metric)
+                    values = ['%.*f' % (precision, value) for value in evaluation.scores[key]]
+                    values.append('%.*f' % (precision, evaluation.mean(metric)))
+                    group_results[key] = dict(zip(list(evaluation.topics) + ['all'], map(float, values)))
+                results[eval['metric']] = group_results
+            else:
+                qrel_program = os.path.join(anserini_root, eval['command'] + ' ' + eval['params'])
+                process = Popen(' '.join([qrel_program, qrel_file_path, result_file_path]), shell=True, stdout=PIPE)
+                stdout, stderr = process.communicate()
+                if process.returncode != 0:
+                    logging.getLogger('evalation.Evaluation').error('ERROR when running the evaluation for:' + result_file_path)
+                    continue
+                if 'trec_eval' in eval['command']:
+                    rows = cls.parse_trec_eval_output(stdout)
+                elif 'gdeval' in eval['command']:
+                    rows = cls.parse_gdeval_output(stdout)
+                else:
+                    logging.getLogger('evalation.Evaluation').error('Cannot parse the output of ' + eval['command'])
+                    continue
+                group_results = {}
+                for metric, qid, value in rows:
+                    group_results.setdefault(metric, {})[qid] = float(value)
+                results[eval['metric']] = group_results
+        return results
+
+    @staticmethod
+    def load_qrels(qrel_file_path):
+        """
+        Load qrels for evaluate_in_process, once per process
+        """
+        return Qrels(qrel_file_path)
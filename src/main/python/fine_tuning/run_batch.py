@@ -18,16 +18,23 @@ import argparse
 import json
 import logging
 import os
+import random
 import subprocess
+import sys
 from multiprocessing import Pool
 
 import yaml
 
+from adaptive_search import STRATEGIES, IncrementalRetrieval, read_topics
 from effectiveness import Effectiveness
+from eval_cache import EvalCache
 from evaluation import Evaluation
 from search import Search
 from xfold import XFoldValidate
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from search_server import SearchServer, search_args
+
 logger = logging.getLogger('fine_tuning')
 logger.setLevel(logging.INFO)
 
@@ -56,7 +63,7 @@ def get_index_path(yaml_data):
     return index_path
 
 
-def batch_retrieval(collection_yaml, models_yaml, output_root):
+def batch_retrieval(collection_yaml, models_yaml, output_root, server=None):
     all_params = []
     program = os.path.join(collection_yaml['anserini_root'], 'bin/run.sh') + ' io.anserini.search.SearchCollection'
     index_path = get_index_path(collection_yaml)
@@ -74,13 +81,61 @@ def batch_retrieval(collection_yaml, models_yaml, output_root):
         )
         all_params.append(this_para)
     logger.info('='*10+'Starting Batch Retrieval'+'='*10)
-    batch_everything(all_params, atom_retrieval)
+    if server is not None:
+        server.search_all([search_args(' '.join(para)) for para in all_params], parallelism)
+    else:
+        batch_everything(all_params, atom_retrieval)
 
 
 def atom_retrieval(para):
     subprocess.call(' '.join(para), shell=True)
 
 
+def adaptive_retrieval(collection_yaml, models_yaml, output_root, strategy, search_metric, server=None):
+    """
+    Search the parameters of the model with an adaptive strategy instead of the full grid:
+    configurations are retrieved and evaluated on growing subsets of the topics, and only
+    the complete runs of the surviving configurations are written to the run files
+    """
+    program = os.path.join(collection_yaml['anserini_root'], 'bin/run.sh') + ' io.anserini.search.SearchCollection'
+    index_path = get_index_path(collection_yaml)
+    this_output_root = os.path.join(output_root, collection_yaml['name'])
+    topic_file = os.path.join(collection_yaml['anserini_root'], collection_yaml['topic_root'], collection_yaml['topic'])
+    qrel_file_path = os.path.join(collection_yaml['anserini_root'], collection_yaml['qrels_root'], collection_yaml['qrel'])
+    evals = [eval for eval in collection_yaml['evals'] if eval['metric'] == search_metric]
+    if not evals:
+        logger.error('Unknown search metric %s for collection %s' % (search_metric, collection_yaml['name']))
+        return
+    topics = read_topics(topic_file)
+    if topics is None:
+        logger.error('Cannot split the topics in %s, use the grid search instead' % topic_file)
+        return
+
+    model_params = dict(Search(index_path).gen_param_grid(models_yaml))
+    qrels = Evaluation.load_qrels(qrel_file_path)
+    # Judged topics only, in a fixed random order so that the topic subsets are reproducible
+    qids = sorted(qid for qid in topics[1] if qid in qrels.topic_index)
+    random.Random(0).shuffle(qids)
+
+    def command(fn):
+        return ' '.join([program, '-topicReader', collection_yaml['topic_reader'], '-index', index_path, model_params[fn]])
+
+    def evaluate(run_file_path):
+        results = Evaluation.evaluate_in_process(evals, qrels, qrel_file_path, run_file_path, collection_yaml['anserini_root'])
+        per_topic = list(results.get(search_metric, {}).values())
+        return {qid: value for qid, value in per_topic[0].items() if qid != 'all'} if per_topic else {}
+
+    if not os.path.exists(os.path.join(this_output_root, 'run_files')):
+        os.makedirs(os.path.join(this_output_root, 'run_files'))
+    retrieval = IncrementalRetrieval(topics, os.path.join(this_output_root, 'adaptive_files'), command, evaluate, parallelism, server)
+    logger.info('='*10+'Starting Adaptive Retrieval'+'='*10)
+    results = strategy.search(list(model_params), qids, retrieval.score)
+    for fn, score in results:
+        logger.info('%s: %s %.4f' % (fn, search_metric, score))
+        retrieval.merge(fn, os.path.join(this_output_root, 'run_files', fn))
+    retrieval.report(len(model_params), len(qids))
+
+
 def batch_eval(collection_yaml, output_root):
     all_params = []
     index_path = get_index_path(collection_yaml)
@@ -104,10 +159,46 @@ def atom_eval(params):
     Evaluation.output_all_evaluations(*params)
 
 
+def batch_eval_in_process(collection_yaml, output_root):
+    this_output_root = os.path.join(output_root, collection_yaml['name'])
+    qrel_file_path = os.path.join(collection_yaml['anserini_root'], collection_yaml['qrels_root'], collection_yaml['qrel'])
+    run_files_root = os.path.join(this_output_root, 'run_files')
+    cache = EvalCache.load(this_output_root)
+    all_params = []
+    for fn in sorted(os.listdir(run_files_root)):
+        evals = [eval for eval in collection_yaml['evals'] if not cache.has(fn, eval['metric'])]
+        if evals:
+            all_params.append((os.path.join(run_files_root, fn), evals, qrel_file_path, collection_yaml['anserini_root']))
+    logger.info('='*10+'Starting Batch Evaluation'+'='*10)
+    if len(all_params) == 0:
+        return
+    # Each worker loads the qrels once and evaluates its run files in-process
+    p = Pool(min(parallelism, len(all_params)), initializer=init_eval_worker, initargs=(qrel_file_path,))
+    results = p.map(atom_eval_in_process, all_params)
+    p.close()
+    cache.update(results)
+    cache.save(this_output_root)
+
+
+def init_eval_worker(qrel_file_path):
+    global worker_qrels
+    worker_qrels = Evaluation.load_qrels(qrel_file_path)
+
+
+def atom_eval_in_process(params):
+    run_file_path, evals, qrel_file_path, anserini_root = params
+    results = Evaluation.evaluate_in_process(evals, worker_qrels, qrel_file_path, run_file_path, anserini_root)
+    return os.path.basename(run_file_path), results
+
+
 def batch_output_effectiveness(collection_yaml, output_root):
     all_params = []
     index_path = get_index_path(collection_yaml)
     this_output_root = os.path.join(output_root, collection_yaml['name'])
+    if EvalCache.exists(this_output_root):
+        logger.info('='*10+'Starting Output Effectiveness'+'='*10)
+        Effectiveness(index_path).output_effectiveness_from_cache(this_output_root)
+        return
     all_params.extend(Effectiveness(index_path).gen_output_effectiveness_params(this_output_root))
     logger.info('='*10+'Starting Output Effectiveness'+'='*10)
     batch_everything(all_params, atom_output_effectiveness)
@@ -197,6 +288,12 @@ if __name__ == '__main__':
     parser.add_argument('--fold_settings', default='', help='JSON file holding fold definitions, see src/main/resources/fine_tuning/robust04-paper1-folds.json for an example')
     parser.add_argument('--verbose', action='store_true', help='if specified print out model parameters and per fold scores')
     parser.add_argument('--metrics', nargs='+', default=['map'], help='inputs: [metrics]. For example, --metrics map ndcg20')
+    parser.add_argument('--eval_files', action='store_true', help='evaluate by running the eval commands and writing eval files, instead of evaluating in-process into the eval cache')
+    parser.add_argument('--search', default='grid', choices=['grid'] + list(STRATEGIES), help='retrieve the full parameter grid, or search it adaptively on subsets of the topics')
+    parser.add_argument('--search_metric', default='map', help='the eval metric in yaml the adaptive search optimizes')
+    parser.add_argument('--eta', type=int, default=3, help='only the best 1/eta configurations of each rung of the adaptive search are kept')
+    parser.add_argument('--min_topics', type=int, default=10, help='minimum number of topics of the first rung of the adaptive search')
+    parser.add_argument('--server', action='store_true', help='submit the retrievals to a single warm SearchCollectionServer instead of launching a JVM for each one')
 
     args = parser.parse_args()
     parallelism = args.parallelism
@@ -213,7 +310,19 @@ if __name__ == '__main__':
         os.makedirs(os.path.join(args.output_root, collection_yaml['name']))
 
     if args.run:
-        batch_retrieval(collection_yaml, models_yaml, args.output_root)
-        batch_eval(collection_yaml, args.output_root)
+        server = SearchServer(args.anserini_root, parallelism).start() if args.server else None
+        try:
+            if args.search == 'grid':
+                batch_retrieval(collection_yaml, models_yaml, args.output_root, server)
+            else:
+                strategy = STRATEGIES[args.search](eta=args.eta, min_topics=args.min_topics)
+                adaptive_retrieval(collection_yaml, models_yaml, args.output_root, strategy, args.search_metric, server)
+        finally:
+            if server is not None:
+                server.close()
+        if args.eval_files:
+            batch_eval(collection_yaml, args.output_root)
+        else:
+            batch_eval_in_process(collection_yaml, args.output_root)
         batch_output_effectiveness(collection_yaml, args.output_root)
     verify_effectiveness(collection_yaml, models_yaml, args.output_root, args.fold_settings, args.verbose)
@@ -14,6 +14,7 @@
 # limitations under the License.
 #
 
+import itertools
 import logging
 import os
 from inspect import currentframe, getframeinfo
@@ -52,3 +53,23 @@ class Search(object):
         all_params.append( (para_str, results_fn) )
 
         return all_params
+
+    def gen_param_grid(self, model_yaml):
+        """
+        Every combination of the model parameters, as in the single batch retrieval of
+        gen_batch_retrieval_params, so that each one can be retrieved on its own
+
+        @Return: a list of (run file name, parameter string) tuples
+        """
+        names, values = [], []
+        for param_name, params in model_yaml['params'].items():
+            is_float = True if params['type'] == 'float' else False
+            names.append(param_name)
+            values.append(['%.2f' % (p) if is_float else '%d' % (p)
+                           for p in self.drange(params['lower'], params['upper']+1e-8, params['pace'])])
+        all_params = []
+        for combination in itertools.product(*values):
+            fn = '%s_%s' % (model_yaml['name'], ','.join('%s:%s' % (n, v) for n, v in zip(names, combination)))
+            para_str = '%s %s' % (model_yaml['fixed_params'], ' '.join('-%s %s' % (n, v) for n, v in zip(names, combination)))
+            all_params.append((fn, para_str))
+        return all_params
@@ -0,0 +1,86 @@
+#
+# Anserini: A Lucene toolkit for reproducible information retrieval research
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import random
+import tempfile
+import unittest
+
+from xfold import XFoldValidate
+
+
+def loop_tune(eval_dir, fold):
+    """
+    Cross validation as computed by the loops XFoldValidate used before it was vectorized:
+    each fold average is the sum of its scores in eval file order, rounded to four decimals.
+    """
+    avg_performances = {}
+    for fn in os.listdir(eval_dir):
+        model, param = fn.split('_', 1)
+        per_fold = {fold_id: [] for fold_id in range(fold)}
+        with open(os.path.join(eval_dir, fn)) as f:
+            for line in f:
+                metric, qid, value = line.split()
+                if qid != 'all':
+                    per_fold[int(qid) % fold].append(float(value))
+        for fold_id, values in per_fold.items():
+            avg_performances.setdefault(model, {}).setdefault(metric, {}).setdefault(fold_id, {})[param] = \
+                round(sum(values) / len(values), 4)
+
+    res = {}
+    for model in avg_performances:
+        res[model] = {}
+        for metric in avg_performances[model]:
+            metric_fold_performances = []
+            for test_idx in range(fold):
+                training_data = {}
+                for train_idx in range(fold):
+                    if train_idx == test_idx:
+                        continue
+                    for param, performance in avg_performances[model][metric][train_idx].items():
+                        training_data[param] = training_data.get(param, .0) + performance
+                best_param = sorted(training_data.items(), key=lambda x: (x[1], x[0]), reverse=True)[0][0]
+                metric_fold_performances.append(avg_performances[model][metric][test_idx][best_param])
+            res[model][metric] = round(sum(metric_fold_performances) / len(metric_fold_performances), 4)
+    return res
+
+
+class TestXFoldValidate(unittest.TestCase):
+    def write_eval_files(self, root, rng, num_topics, num_params):
+        # Four-decimal scores, as written by trec_eval, so that many fold averages fall
+        # exactly on a rounding boundary and are rounded depending on the order of the sum
+        eval_dir = os.path.join(root, 'robust04', 'eval_files', 'map')
+        os.makedirs(eval_dir)
+        # One topic ending in each digit, so that every fold of 2 or 5 has topics
+        topics = [str(qid) for qid in rng.sample(range(310, 320), 10) + rng.sample(range(320, 451), num_topics)]
+        for i in range(num_params):
+            with open(os.path.join(eval_dir, f'bm25_k1:{i / 10:.1f},b:0.4'), 'w') as f:
+                for qid in topics:
+                    f.write(f'map\t{qid}\t{rng.randint(0, 10000) / 10000:.4f}\n')
+                f.write('map\tall\t0.5000\n')
+        return eval_dir
+
+    def test_tune_matches_loops(self):
+        rng = random.Random(0)
+        for _ in range(30):
+            with tempfile.TemporaryDirectory() as root:
+                eval_dir = self.write_eval_files(root, rng, rng.randint(10, 60), rng.randint(2, 8))
+                for fold in [2, 5]:
+                    self.assertEqual(XFoldValidate(root, 'robust04', fold).tune(False), loop_tune(eval_dir, fold))
+
+
+if __name__ == '__main__':
+    unittest.main()
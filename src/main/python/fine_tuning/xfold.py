@@ -19,6 +19,10 @@ import json
 import logging
 import os
 
+import numpy as np
+
+from eval_cache import EvalCache
+
 logging.basicConfig()
 
 
@@ -38,36 +42,81 @@ class XFoldValidate(object):
         self.fold = fold
         self.fold_mapping = fold_mapping
 
-    def _get_param_average(self):
-        # For each parameter set, get its 
-        # average performances in each fold,
-        # metric, reranking model, and base 
-        # ranking model
-        avg_performances = {}
-        eval_root_dir = os.path.join(self.output_root, self.collection,self.eval_files_root)
-
-        # do x-fold cv for the collection
-        for metric in os.listdir(eval_root_dir):
-            eval_dir = os.path.join(eval_root_dir,metric)
+    def _load_scores(self):
+        # Load the per-topic scores of every parameter
+        # set once, as a (params x topics) array for
+        # each reranking model and metric, NaN where a
+        # run has no score for a topic
+        collection_root = os.path.join(self.output_root, self.collection)
+        if EvalCache.exists(collection_root):
+            return self._load_scores_from_cache(collection_root)
+
+        per_run = {}
+        eval_root_dir = os.path.join(collection_root, self.eval_files_root)
+        for metric_dir in os.listdir(eval_root_dir):
+            eval_dir = os.path.join(eval_root_dir, metric_dir)
             if os.path.isfile(eval_dir):
                 continue
-            # if it is a directory containing effectiveness
-            # for a metric, do x-fold cv for the metric
             for fn in os.listdir(eval_dir):
                 model, param = fn.split('_', 1)
-                if model not in avg_performances:
-                    avg_performances[model] = {}
-
-                param_avg_performances = self._get_param_avg_performances(os.path.join(eval_dir,fn))
-                for metric in param_avg_performances:
-                    if metric not in avg_performances[model]:
-                        avg_performances[model][metric] = {}
-                    for fold_id in param_avg_performances[metric]:
-                        if fold_id not in avg_performances[model][metric]:
-                            avg_performances[model][metric][fold_id] = {}
-                        avg_performances[model][metric][fold_id][param] = param_avg_performances[metric][fold_id]
-
-        return avg_performances
+                for metric, per_topic in self._read_eval_file(os.path.join(eval_dir, fn)).items():
+                    per_run.setdefault(model, {}).setdefault(metric, {})[param] = per_topic
+
+        scores = {}
+        for model in per_run:
+            scores[model] = {}
+            for metric, param_scores in per_run[model].items():
+                params = sorted(param_scores)
+                # Topics in the order of the eval files, which is the order the fold sums add them in
+                topics = list(dict.fromkeys(qid for param in params for qid in param_scores[param]))
+                topic_index = {qid: i for i, qid in enumerate(topics)}
+                values = np.full((len(params), len(topics)), np.nan)
+                for i, param in enumerate(params):
+                    per_topic = param_scores[param]
+                    values[i, [topic_index[qid] for qid in per_topic]] = list(per_topic.values())
+                scores[model][metric] = (params, topics, values)
+        return scores
+
+    def _load_scores_from_cache(self, collection_root):
+        cache = EvalCache.load(collection_root)
+        models, params = cache.split_runs()
+        topics = [t for t, qid in enumerate(cache.topics) if qid != 'all']
+        topic_names = [cache.topics[t] for t in topics]
+
+        scores = {}
+        for model in set(models):
+            rows = [row for row, m in enumerate(models) if m == model]
+            scores[model] = {}
+            for col, metric in enumerate(cache.metrics):
+                values = cache.values[rows][:, topics, col]
+                evaluated = ~np.isnan(values).all(axis=1)
+                if evaluated.any():
+                    scores[model][metric] = ([params[row] for row in np.array(rows)[evaluated]],
+                                             topic_names, values[evaluated])
+        return scores
+
+    def _read_eval_file(self, file_path):
+        # Given a file, return the score of each
+        # topic for each metric
+        per_topic = {}
+        with open(file_path) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    row = line.split()
+                    metric = row[0]
+                    if metric not in per_topic:
+                        per_topic[metric] = {}
+                    qid = row[1]
+                    try:
+                        value = float(row[2])
+                    except:
+                        self.logger.error('Cannot parse %s' %(row[2]))
+                        continue
+                    else:
+                        if qid != 'all':
+                            per_topic[metric][qid] = value
+        return per_topic
 
     def _compute_fold_id(self,qid):
         # compute fold id
@@ -78,77 +127,91 @@ class XFoldValidate(object):
             # compute the fold id based on qid
             return int(qid) % self.fold
 
+    @staticmethod
+    def _fold_averages(values, fold_ids, num_folds):
+        # Average score of each parameter set in each
+        # fold, rounded to four decimal places as in
+        # the eval files: (params x folds). Scores are
+        # added one topic at a time, in topic order, so
+        # that sums and thus rounding are exactly those
+        # of a sum over the scores of each fold
+        evaluated = ~np.isnan(values)
+        sums = np.zeros((len(values), num_folds))
+        counts = np.zeros((len(values), num_folds))
+        for topic, fold_id in enumerate(fold_ids):
+            sums[:, fold_id] += np.where(evaluated[:, topic], values[:, topic], 0.0)
+            counts[:, fold_id] += evaluated[:, topic]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            averages = sums / counts
+        return np.frompyfunc(round, 2, 1)(averages, 4).astype(np.float64)
+
+    @staticmethod
+    def _select_best(fold_averages, params):
+        # For each test fold, the parameter set with the
+        # best sum of average scores over the training
+        # folds: (folds,) indices into params. Ties are
+        # broken by the largest parameter string
+        num_folds = fold_averages.shape[1]
+        # Folds are added in order so sums are exactly those of a loop over training folds
+        training = np.zeros((num_folds, len(params)))
+        for train_idx in range(num_folds):
+            training += np.where(np.arange(num_folds)[:, None] != train_idx, fold_averages[:, train_idx], 0.0)
+        by_param_desc = np.argsort(np.array(params, dtype=object))[::-1]
+        return by_param_desc[np.argmax(training[:, by_param_desc], axis=1)]
+
+    def _fold_ids(self, topics):
+        return np.array([self._compute_fold_id(qid) for qid in topics], dtype=np.int64)
+
     def tune(self,verbose):
         # Tune parameter with x-fold. Use x-1 fold
         # for training and 1 fold for testing. Do
         # it for each fold and report average
-        avg_performances = self._get_param_average()
+        scores = self._load_scores()
 
         res = {}
-        for model in avg_performances:
+        for model in scores:
             res[model] = {}
-            for metric in avg_performances[model]:
+            for metric, (params, topics, values) in scores[model].items():
                 if verbose:
                     print('model: {}, metric: {}'.format(model, metric))
-                metric_fold_performances = []
-                for test_idx in range(self.fold):
-                    test_fold_performances = avg_performances[model][metric][test_idx]
-                    training_data = {}
-                    for train_idx in range(self.fold):
-                        if train_idx == test_idx:
-                            continue
-                        fold_performance = avg_performances[model][metric][train_idx]
-                        for param in fold_performance:
-                            if param not in training_data:
-                                training_data[param] = .0
-                            training_data[param] += fold_performance[param]
-                    # sort in descending order based on performance first, then use filenames(x[0]) to break ties
-                    sorted_training_performance = sorted(training_data.items(),
-                                                         key=lambda x:(x[1], x[0]),
-                                                         reverse=True)
-                    best_param = sorted_training_performance[0][0]
-                    if verbose:
+                fold_averages = self._fold_averages(values, self._fold_ids(topics), self.fold)
+                best = self._select_best(fold_averages, params)
+                metric_fold_performances = [fold_averages[best[test_idx], test_idx] for test_idx in range(self.fold)]
+                if verbose:
+                    for test_idx in range(self.fold):
                         print('\tFold: {}'.format(test_idx))
-                        print('\t\tBest param: {}'.format(best_param))
-                        print('\t\ttest performance: {0:.4f}'.format(test_fold_performances[best_param]))
-
-                    metric_fold_performances.append(test_fold_performances[best_param])
-                res[model][metric] = round(sum(metric_fold_performances) / len(metric_fold_performances), 4)
+                        print('\t\tBest param: {}'.format(params[best[test_idx]]))
+                        print('\t\ttest performance: {0:.4f}'.format(metric_fold_performances[test_idx]))
+                res[model][metric] = round(float(sum(metric_fold_performances) / len(metric_fold_performances)), 4)
         return res
 
-    def _get_param_avg_performances(self,file_path):
-        # Given a file, return its average effectiveness
-        # for each metric in each fold
-        param_performance_list = {}
-        for fold_id in range(self.fold):
-            param_performance_list[fold_id] = {}
-        with open(file_path) as f:
-            for line in f:
-                line = line.strip()
-                if line:
-                    row = line.split()
-                    metric = row[0]
-                    if metric not in param_performance_list[0]:
-                        for fold_id in param_performance_list:
-                            param_performance_list[fold_id][metric] = []
-                    qid = row[1]
-                    try:
-                        value = float(row[2])
-                    except:
-                        self.logger.error('Cannot parse %s' %(row[2]))
-                        continue
-                    else:
-                        if qid != 'all':
-                            # compute fold id base on qid
-                            fold_id = self._compute_fold_id(qid)
-                            param_performance_list[fold_id][metric].append(value)
-        param_avg_performances = {}
+    def tune_repeated(self, repeats, seed=0, verbose=False):
+        # Repeated x-fold cross validation: topics are
+        # randomly split into x folds for each repeat,
+        # ignoring any fold mapping, and the mean and
+        # standard deviation over repeats are reported
+        scores = self._load_scores()
+        rng = np.random.default_rng(seed)
 
-        for metric in param_performance_list[0].keys():
-            param_avg_performances[metric] = {}
-            for fold_id in param_performance_list:
-                param_avg_performances[metric][fold_id] = round(sum(param_performance_list[fold_id][metric])/len(param_performance_list[fold_id][metric]), 4)
-        return param_avg_performances
+        res = {}
+        for model in scores:
+            res[model] = {}
+            for metric, (params, topics, values) in scores[model].items():
+                repeat_performances = []
+                for _ in range(repeats):
+                    fold_ids = rng.permutation(len(topics)) % self.fold
+                    fold_averages = self._fold_averages(values, fold_ids, self.fold)
+                    best = self._select_best(fold_averages, params)
+                    repeat_performances.append(fold_averages[best, np.arange(self.fold)].mean())
+                res[model][metric] = {
+                    'mean': round(float(np.mean(repeat_performances)), 4),
+                    'std': round(float(np.std(repeat_performances)), 4),
+                    'repeats': repeats
+                }
+                if verbose:
+                    print('model: {}, metric: {}, mean: {:.4f}, std: {:.4f}'.format(
+                        model, metric, res[model][metric]['mean'], res[model][metric]['std']))
+        return res
 
 
 if __name__ == '__main__':
@@ -158,11 +221,17 @@ if __name__ == '__main__':
     parser.add_argument('--verbose', '-v', action='store_true', help='output in verbose mode')
     parser.add_argument('--collection', required=True, help='the collection key in yaml')
     parser.add_argument('--fold_dir', help='directory of drr fold files')
+    parser.add_argument('--repeats', type=int, default=0, help='number of random fold splits for repeated cross validation')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the repeated cross validation splits')
     args=parser.parse_args()
 
     fold_mapping = {}
     if args.fold_dir:
         from run_batch import load_drr_fold_mapping
         fold_mapping = load_drr_fold_mapping(args.fold_dir)
-    print(json.dumps(XFoldValidate(args.output_root, args.collection, args.fold, fold_mapping).tune(args.verbose), sort_keys=True, indent=2))
+    x_fold = XFoldValidate(args.output_root, args.collection, args.fold, fold_mapping)
+    if args.repeats > 0:
+        print(json.dumps(x_fold.tune_repeated(args.repeats, args.seed, args.verbose), sort_keys=True, indent=2))
+    else:
+        print(json.dumps(x_fold.tune(args.verbose), sort_keys=True, indent=2))
 
@@ -7,140 +7,128 @@ Creation Date : 06/12/2018
 Last Modified : 1/21/2019
 Authors : Daniel Campos <dacamp@microsoft.com>, Rutger van Haasteren <ruvanh@microsoft.com>
 """
-import sys
-import statistics
+import json
+import math
+import argparse
 
-from collections import Counter
+from collections import namedtuple
+
+import numpy as np
 
 MaxMRRRank = 10
 
+# Columnar candidate rankings: one entry per (query, passage, rank) line of the candidate file
+Candidates = namedtuple('Candidates', ['qids', 'pids', 'ranks'])
+
+# Columnar reference: one entry per relevant (query, passage) pair
+References = namedtuple('References', ['qids', 'pids'])
+
+# Metrics supported by the streaming evaluator, each followed by '@' and a cutoff, e.g. 'MRR@100'
+StreamingMetrics = ['MRR', 'Recall', 'nDCG', 'P']
+
 def load_reference_from_stream(f):
     """Load Reference reference relevant passages
     Args:f (stream): stream to load.
-    Returns:qids_to_relevant_passageids (dict): dictionary mapping from query_id (int) to relevant passages (list of ints). 
+    Returns:references (References): int64 arrays of query ids and relevant passage ids, one entry per line.
     """
-    qids_to_relevant_passageids = {}
+    qids = []
+    pids = []
     for l in f:
         try:
             l = l.strip().split('\t')
-            qid = int(l[0])
-            if qid in qids_to_relevant_passageids:
-                pass
-            else:
-                qids_to_relevant_passageids[qid] = []
-            qids_to_relevant_passageids[qid].append(int(l[2]))
+            qids.append(int(l[0]))
+            pids.append(int(l[2]))
         except:
             raise IOError('\"%s\" is not valid format' % l)
-    return qids_to_relevant_passageids
+    return References(np.array(qids, dtype=np.int64), np.array(pids, dtype=np.int64))
 
 def load_reference(path_to_reference):
     """Load Reference reference relevant passages
     Args:path_to_reference (str): path to a file to load.
-    Returns:qids_to_relevant_passageids (dict): dictionary mapping from query_id (int) to relevant passages (list of ints). 
+    Returns:references (References): int64 arrays of query ids and relevant passage ids, one entry per line.
     """
     with open(path_to_reference,'r') as f:
-        qids_to_relevant_passageids = load_reference_from_stream(f)
-    return qids_to_relevant_passageids
+        references = load_reference_from_stream(f)
+    return references
 
 def load_candidate_from_stream(f):
     """Load candidate data from a stream.
     Args:f (stream): stream to load.
-    Returns:qid_to_ranked_candidate_passages (dict): dictionary mapping from query_id (int) to a list of 1000 passage ids(int) ranked by relevance and importance
+    Returns:candidates (Candidates): int64 arrays of query ids, passage ids and ranks, one entry per line.
     """
-    qid_to_ranked_candidate_passages = {}
-    for l in f:
-        try:
-            l = l.strip().split('\t')
-            qid = int(l[0])
-            pid = int(l[1])
-            rank = int(l[2])
-            if qid in qid_to_ranked_candidate_passages:
-                pass    
-            else:
-                # By default, all PIDs in the list of 1000 are 0. Only override those that are given
-                tmp = [0] * 1000
-                qid_to_ranked_candidate_passages[qid] = tmp
-            qid_to_ranked_candidate_passages[qid][rank-1]=pid
-        except:
-            raise IOError('\"%s\" is not valid format' % l)
-    return qid_to_ranked_candidate_passages
+    try:
+        data = np.loadtxt(f, dtype=np.int64, delimiter='\t', usecols=(0, 1, 2), ndmin=2)
+    except ValueError as e:
+        raise IOError('Candidate file is not valid format: %s' % e)
+    return Candidates(data[:, 0].copy(), data[:, 1].copy(), data[:, 2].copy())
                 
 def load_candidate(path_to_candidate):
     """Load candidate data from a file.
     Args:path_to_candidate (str): path to file to load.
-    Returns:qid_to_ranked_candidate_passages (dict): dictionary mapping from query_id (int) to a list of 1000 passage ids(int) ranked by relevance and importance
+    Returns:candidates (Candidates): int64 arrays of query ids, passage ids and ranks, one entry per line.
     """
     
     with open(path_to_candidate,'r') as f:
-        qid_to_ranked_candidate_passages = load_candidate_from_stream(f)
-    return qid_to_ranked_candidate_passages
+        candidates = load_candidate_from_stream(f)
+    return candidates
+
+def _pair_keys(qids, pids, num_pids):
+    """Encode (qid, pid) pairs as single int64 keys so they can be matched with sorted-array operations."""
+    return qids * num_pids + pids
 
-def quality_checks_qids(qids_to_relevant_passageids, qids_to_ranked_candidate_passages):
-    """Perform quality checks on the dictionaries
+def quality_checks_qids(references, candidates):
+    """Perform quality checks on the candidates
 
     Args:
-    p_qids_to_relevant_passageids (dict): dictionary of query-passage mapping
-        Dict as read in with load_reference or load_reference_from_stream
-    p_qids_to_ranked_candidate_passages (dict): dictionary of query-passage candidates
+    references (References): relevant passages as read in with load_reference or load_reference_from_stream
+    candidates (Candidates): ranked candidates as read in with load_candidate or load_candidate_from_stream
     Returns:
         bool,str: Boolean whether allowed, message to be shown in case of a problem
     """
     message = ''
     allowed = True
 
-    # Create sets of the QIDs for the submitted and reference queries
-    candidate_set = set(qids_to_ranked_candidate_passages.keys())
-    ref_set = set(qids_to_relevant_passageids.keys())
-
-    # Check that we do not have multiple passages per query
-    for qid in qids_to_ranked_candidate_passages:
-        # Remove all zeros from the candidates
-        duplicate_pids = set([item for item, count in Counter(qids_to_ranked_candidate_passages[qid]).items() if count > 1])
-
-        if len(duplicate_pids-set([0])) > 0:
-            message = "Cannot rank a passage multiple times for a single query. QID={qid}, PID={pid}".format(
-                    qid=qid, pid=list(duplicate_pids)[0])
-            allowed = False
+    # Check that we do not have multiple passages per query, ignoring placeholder zero PIDs
+    mask = candidates.pids != 0
+    num_pids = int(candidates.pids.max(initial=0)) + 1
+    keys = np.sort(_pair_keys(candidates.qids[mask], candidates.pids[mask], num_pids))
+    duplicates = keys[1:][keys[1:] == keys[:-1]]
+    if len(duplicates) > 0:
+        message = "Cannot rank a passage multiple times for a single query. QID={qid}, PID={pid}".format(
+                qid=int(duplicates[0] // num_pids), pid=int(duplicates[0] % num_pids))
+        allowed = False
 
     return allowed, message
 
-def compute_metrics(qids_to_relevant_passageids, qids_to_ranked_candidate_passages, per_query_score=False):
+def compute_metrics(references, candidates, per_query_score=False, max_rank=MaxMRRRank):
     """Compute MRR metric
     Args:    
-    p_qids_to_relevant_passageids (dict): dictionary of query-passage mapping
-        Dict as read in with load_reference or load_reference_from_stream
-    p_qids_to_ranked_candidate_passages (dict): dictionary of query-passage candidates
+    references (References): relevant passages as read in with load_reference or load_reference_from_stream
+    candidates (Candidates): ranked candidates as read in with load_candidate or load_candidate_from_stream
     Returns:
         dict: dictionary of metrics {'MRR': <MRR Score>}
     """
     all_scores = {}
-    MRR = 0
-    qids_with_relevant_passages = 0
-    ranking = []
-    qid2score = {}
-    for qid in qids_to_ranked_candidate_passages:
-        MRR_i = 0.0
-        if qid in qids_to_relevant_passageids:
-            ranking.append(0)
-            target_pid = qids_to_relevant_passageids[qid]
-            candidate_pid = qids_to_ranked_candidate_passages[qid]
-            for i in range(0,MaxMRRRank):
-                if candidate_pid[i] in target_pid:
-                    MRR += 1/(i + 1)
-                    MRR_i += 1/(i + 1)
-                    ranking.pop()
-                    ranking.append(i+1)
-                    break
-        qid2score[qid] = MRR_i
-    if len(ranking) == 0:
+    ref_qids = np.unique(references.qids)
+    cand_qids, cand_qid_idx = np.unique(candidates.qids, return_inverse=True)
+    if not np.isin(cand_qids, ref_qids).any():
         raise IOError("No matching QIDs found. Are you sure you are scoring the evaluation set?")
-    
-    MRR = MRR/len(qids_to_relevant_passageids)
+
+    # Rank of the first relevant passage within the cutoff, per candidate query
+    num_pids = int(max(candidates.pids.max(initial=0), references.pids.max(initial=0))) + 1
+    relevant = np.isin(_pair_keys(candidates.qids, candidates.pids, num_pids),
+                       _pair_keys(references.qids, references.pids, num_pids))
+    hits = relevant & (candidates.ranks >= 1) & (candidates.ranks <= max_rank)
+    first_rank = np.full(len(cand_qids), np.inf)
+    np.minimum.at(first_rank, cand_qid_idx[hits], candidates.ranks[hits])
+    qid_scores = 1.0 / first_rank
+
+    MRR = float(qid_scores.sum()) / len(ref_qids)
     all_scores['MRR @10'] = MRR
-    all_scores['QueriesRanked'] = len(qids_to_ranked_candidate_passages)
+    all_scores['QueriesRanked'] = len(cand_qids)
     
     if per_query_score:
-        per_query_scores = {"MRR@10": qid2score}
+        per_query_scores = {"MRR@10": dict(zip(cand_qids.tolist(), qid_scores.tolist()))}
         return all_scores, per_query_scores
     return all_scores
                 
@@ -169,23 +157,169 @@ def compute_metrics_from_files(path_to_reference, path_to_candidate, perform_che
 
     return compute_metrics(qids_to_relevant_passageids, qids_to_ranked_candidate_passages, per_query_score=per_query_score)
 
+def parse_metric(metric):
+    """Split a metric such as 'MRR@100' into its name and cutoff."""
+    name, _, cutoff = metric.partition('@')
+    if name not in StreamingMetrics or not cutoff.isdigit():
+        raise ValueError('Unsupported metric %s, expected one of %s followed by @<cutoff>' % (metric, StreamingMetrics))
+    return name, int(cutoff)
+
+def load_graded_reference(path_to_reference):
+    """Load the reference as a dict mapping each query id (int) to a dict of relevant passage ids (int) to
+    their relevance grade, which is 1 when the reference file has no grade column. Queries judged with no
+    relevant passage are kept with an empty dict, so that they count towards averages like in compute_metrics.
+    """
+    qids_to_relevance = {}
+    with open(path_to_reference, 'r') as f:
+        for l in f:
+            try:
+                l = l.strip().split('\t')
+                rel = int(l[3]) if len(l) > 3 else 1
+                relevance = qids_to_relevance.setdefault(int(l[0]), {})
+                if rel > 0:
+                    relevance[int(l[2])] = rel
+            except:
+                raise IOError('\"%s\" is not valid format' % l)
+    return qids_to_relevance
+
+def iter_candidate_queries(path_to_candidate):
+    """Scan a candidate file once, yielding (qid, [(rank, pid), ...]) for each query in rank order.
+    Lines of a query must be contiguous, which holds for runs written one query at a time. To detect
+    queries that are not, the ids of the queries already scanned are kept, one int per query.
+    """
+    seen = set()
+    current_qid = None
+    ranked = []
+    with open(path_to_candidate, 'r') as f:
+        for l in f:
+            try:
+                fields = l.strip().split('\t')
+                qid, pid, rank = int(fields[0]), int(fields[1]), int(fields[2])
+            except:
+                raise IOError('\"%s\" is not valid format' % l.strip())
+            if qid != current_qid:
+                if current_qid is not None:
+                    yield current_qid, sorted(ranked)
+                if qid in seen:
+                    raise IOError('Lines of QID=%d are not contiguous in %s; sort the candidate file by query first'
+                                  % (qid, path_to_candidate))
+                seen.add(qid)
+                current_qid = qid
+                ranked = []
+            ranked.append((rank, pid))
+    if current_qid is not None:
+        yield current_qid, sorted(ranked)
+
+def score_query(ranked, relevance, metrics):
+    """Compute the given (name, cutoff) metrics for one query from its (rank, pid) list in rank order and
+    the relevance grades of its relevant passages.
+    """
+    scores = []
+    num_relevant = len(relevance)
+    ideal = sorted(relevance.values(), reverse=True)
+    for name, cutoff in metrics:
+        top = [(rank, relevance.get(pid, 0)) for rank, pid in ranked if 1 <= rank <= cutoff]
+        if name == 'MRR':
+            score = next((1 / rank for rank, rel in top if rel > 0), 0.0)
+        elif name == 'Recall':
+            score = sum(1 for _, rel in top if rel > 0) / num_relevant if num_relevant else 0.0
+        elif name == 'P':
+            score = sum(1 for _, rel in top if rel > 0) / cutoff
+        else:
+            dcg = sum(rel / math.log2(rank + 1) for rank, rel in top)
+            idcg = sum(rel / math.log2(i + 2) for i, rel in enumerate(ideal[:cutoff]))
+            score = dcg / idcg if idcg > 0 else 0.0
+        scores.append(score)
+    return scores
+
+def open_per_query_sink(path, metrics):
+    """Open a per-query output file, writing JSON lines if its name ends with .jsonl and TSV otherwise.
+    Returns the file and a function writing one query's scores to it.
+    """
+    f = open(path, 'w')
+    if path.endswith('.jsonl'):
+        def write(qid, scores):
+            f.write(json.dumps(dict([('qid', qid)] + list(zip(metrics, scores)))) + '\n')
+    else:
+        f.write('\t'.join(['qid'] + metrics) + '\n')
+        def write(qid, scores):
+            f.write('\t'.join([str(qid)] + ['%.6f' % score for score in scores]) + '\n')
+    return f, write
+
+def compute_metrics_streaming(path_to_reference, path_to_candidate, metrics=('MRR@10',), path_to_per_query=None,
+                              perform_checks=True):
+    """Compute several metrics at several cutoffs in a single scan over the candidate file
+    Args:
+    path_to_reference (str): path to reference file, as for compute_metrics_from_files.
+    path_to_candidate (str): path to candidate file, as for compute_metrics_from_files, with the lines of
+        each query contiguous.
+    metrics (list): metrics such as 'MRR@10', 'MRR@100', 'Recall@1000' or 'nDCG@10'.
+    path_to_per_query (str): optional TSV or JSONL (.jsonl) file to which per-query scores are streamed.
+    Returns:
+        dict: dictionary of metrics, e.g. {'MRR @10': <MRR Score>, 'Recall @1000': <Recall Score>}, averaged
+        over the queries of the reference like the MRR of compute_metrics.
+    Only the reference, one query of candidates and the ids of the queries scanned are held in memory.
+    """
+    metrics = list(metrics)
+    parsed = [parse_metric(metric) for metric in metrics]
+    qids_to_relevance = load_graded_reference(path_to_reference)
+
+    totals = [0.0] * len(metrics)
+    queries_ranked = 0
+    queries_matched = 0
+    sink, write = open_per_query_sink(path_to_per_query, metrics) if path_to_per_query else (None, None)
+    try:
+        for qid, ranked in iter_candidate_queries(path_to_candidate):
+            queries_ranked += 1
+            if perform_checks:
+                pids = [pid for _, pid in ranked if pid != 0]
+                if len(set(pids)) != len(pids):
+                    print("Cannot rank a passage multiple times for a single query. QID={qid}".format(qid=qid))
+            relevance = qids_to_relevance.get(qid)
+            if relevance is None:
+                scores = [0.0] * len(metrics)
+            else:
+                queries_matched += 1
+                scores = score_query(ranked, relevance, parsed)
+                totals = [total + score for total, score in zip(totals, scores)]
+            if write is not None:
+                write(qid, scores)
+    finally:
+        if sink is not None:
+            sink.close()
+
+    if queries_matched == 0:
+        raise IOError("No matching QIDs found. Are you sure you are scoring the evaluation set?")
+
+    all_scores = {'%s @%d' % (name, cutoff): total / len(qids_to_relevance)
+                  for (name, cutoff), total in zip(parsed, totals)}
+    all_scores['QueriesRanked'] = queries_ranked
+    return all_scores
+
 def main():
     """Command line:
     python msmarco_eval_ranking.py <path_to_reference_file> <path_to_candidate_file>
+        [--metrics MRR@10 MRR@100 Recall@1000 nDCG@10] [--per-query <path>]
     """
 
-    if len(sys.argv) == 3:
-        path_to_reference = sys.argv[1]
-        path_to_candidate = sys.argv[2]
-        metrics = compute_metrics_from_files(path_to_reference, path_to_candidate)
-        print('#####################')
-        for metric in sorted(metrics):
-            print('{}: {}'.format(metric, metrics[metric]))
-        print('#####################')
+    parser = argparse.ArgumentParser(usage='msmarco_eval_ranking.py <reference ranking> <candidate ranking>')
+    parser.add_argument('reference', help='reference ranking')
+    parser.add_argument('candidate', help='candidate ranking')
+    parser.add_argument('--metrics', nargs='+', default=None,
+                        help='metrics to compute in a single streaming pass, e.g. MRR@10 MRR@100 Recall@1000 nDCG@10')
+    parser.add_argument('--per-query', default=None,
+                        help='TSV (or JSONL, if the name ends with .jsonl) file for per-query scores')
+    args = parser.parse_args()
 
+    if args.metrics or args.per_query:
+        metrics = compute_metrics_streaming(args.reference, args.candidate, args.metrics or ['MRR@10'],
+                                            args.per_query)
     else:
-        print('Usage: msmarco_eval_ranking.py <reference ranking> <candidate ranking>')
-        exit()
+        metrics = compute_metrics_from_files(args.reference, args.candidate)
+    print('#####################')
+    for metric in sorted(metrics):
+        print('{}: {}'.format(metric, metrics[metric]))
+    print('#####################')
     
 if __name__ == '__main__':
     main()
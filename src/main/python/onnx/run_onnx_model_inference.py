@@ -2,20 +2,37 @@ import onnxruntime
 from transformers import AutoTokenizer
 import numpy as np
 import argparse
+import json
+import time
+
+def create_session(model_path, intra_op_threads=0, inter_op_threads=0, parallel=False, optimization_level="all"):
+    """Creates an inference session; 0 threads lets onnxruntime pick the number of cores."""
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = intra_op_threads
+    options.inter_op_num_threads = inter_op_threads
+    options.execution_mode = (onnxruntime.ExecutionMode.ORT_PARALLEL if parallel
+                              else onnxruntime.ExecutionMode.ORT_SEQUENTIAL)
+    options.graph_optimization_level = {
+        "disable": onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL,
+        "basic": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+        "extended": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+        "all": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL,
+    }[optimization_level]
+    return onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+
+def prepare_inputs(model, inputs):
+    if 'token_type_ids' not in inputs and any('token_type_ids' in input.name for input in model.get_inputs()):
+        inputs['token_type_ids'] = np.zeros_like(inputs['input_ids'])
+
+    model_input_names = {input.name for input in model.get_inputs()}
+    return {name: inputs[name] for name in inputs if name in model_input_names}
 
 def run_onnx_inference(model_path, model_name, text, threshold):
     model = onnxruntime.InferenceSession(model_path)
     tokenizer = AutoTokenizer.from_pretrained(model_name)
     inputs = tokenizer(text, return_tensors="np")
-    
-    if 'token_type_ids' not in inputs and any('token_type_ids' in input.name for input in model.get_inputs()):
-        inputs['token_type_ids'] = np.zeros_like(inputs['input_ids'])
 
-    model_input_names = {input.name for input in model.get_inputs()}
-    outputs = model.run(
-        None,
-        {name: inputs[name] for name in inputs if name in model_input_names}
-    )
+    outputs = model.run(None, prepare_inputs(model, inputs))
 
     sparse_vector = outputs[0]
     sparse_vector[sparse_vector < threshold] = float(0.0)
@@ -24,12 +41,173 @@ def run_onnx_inference(model_path, model_name, text, threshold):
     print(f"Non-zero elements after thresholding: {np.count_nonzero(sparse_vector)}")
     print(f"Sparse vector output after thresholding: {sparse_vector}")
 
+def read_corpus(corpus_path, id_field="id", text_field="contents", limit=None):
+    """Yields (docid, text) pairs from a JSONL corpus."""
+    with open(corpus_path, "r", encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            if limit is not None and i >= limit:
+                break
+            doc = json.loads(line)
+            yield doc[id_field], doc[text_field]
+
+def iter_length_bucketed_batches(docs, tokenizer, batch_size, max_length, bucket_batches=16):
+    """
+    Reads bucket_batches * batch_size documents at a time, tokenizes them, sorts them by length and
+    splits them into batches, so that each batch is padded only to the length of its longest document.
+    Yields the documents of each bucket in input order, with their batches:
+    (docids, texts, [(positions in the bucket, padded inputs), ...]).
+    """
+    bucket = []
+    for doc in docs:
+        bucket.append(doc)
+        if len(bucket) == batch_size * bucket_batches:
+            yield make_bucket(bucket, tokenizer, batch_size, max_length)
+            bucket = []
+    if bucket:
+        yield make_bucket(bucket, tokenizer, batch_size, max_length)
+
+def make_bucket(bucket, tokenizer, batch_size, max_length):
+    docids = [docid for docid, _ in bucket]
+    texts = [text for _, text in bucket]
+    encoded = tokenizer(texts, truncation=True, max_length=max_length)
+    order = np.argsort([len(ids) for ids in encoded["input_ids"]], kind="stable")
+    batches = []
+    for start in range(0, len(order), batch_size):
+        positions = order[start:start + batch_size]
+        features = [{key: encoded[key][i] for key in encoded.keys()} for i in positions]
+        batches.append((positions, tokenizer.pad(features, return_tensors="np")))
+    return docids, texts, batches
+
+def runs_single_documents(model):
+    """
+    Whether the model only supports one unpadded document per run: its inputs have a batch dimension
+    fixed to 1, or it outputs sparse 1-D (ids, weights), such as the models from splade_to_onnx.py.
+    """
+    if any(input.shape and input.shape[0] == 1 for input in model.get_inputs()):
+        return True
+    return any(len(output.shape) == 1 for output in model.get_outputs())
+
+def encode_batch(model, inputs, threshold):
+    """
+    Runs a batch through the model and returns one (token ids, weights) pair per document. Models that
+    output vocabulary weights (batch, vocab) are used as is; masked language model logits
+    (batch, seq, vocab) are max-pooled SPLADE-style. Models that only support one document per run are
+    given the documents of the batch one at a time, without their padding.
+    """
+    # The tokenizer's mask, which the model may not take as an input
+    attention_mask = inputs["attention_mask"] if "attention_mask" in inputs else np.ones_like(inputs["input_ids"])
+    inputs = prepare_inputs(model, dict(inputs))
+    if len(inputs["input_ids"]) > 1 and runs_single_documents(model):
+        results = []
+        for i in range(len(inputs["input_ids"])):
+            tokens = attention_mask[i].astype(bool)
+            single = {name: value[i:i + 1, tokens] for name, value in inputs.items()}
+            results.extend(encode_batch(model, single, threshold))
+        return results
+    outputs = model.run(None, inputs)
+    weights = outputs[0]
+    if weights.ndim == 1:
+        ids, values = outputs[0], outputs[1]
+        keep = values >= threshold
+        return [(ids[keep], values[keep])]
+    if weights.ndim == 3:
+        mask = attention_mask[:, :, None]
+        weights = np.max(np.log1p(np.maximum(weights, 0)) * mask, axis=1)
+    results = []
+    for row in weights:
+        ids = np.nonzero(row >= threshold)[0]
+        results.append((ids, row[ids]))
+    return results
+
+def to_json_vector(docid, text, ids, values, vocab, quantization_factor):
+    """Formats a document in the Anserini JsonVectorCollection format, with integer term weights."""
+    quantized = np.rint(values * quantization_factor).astype(np.int64)
+    vector = {vocab[i]: int(w) for i, w in zip(ids.tolist(), quantized.tolist()) if w > 0}
+    return json.dumps({"id": docid, "contents": text, "vector": vector}, ensure_ascii=False)
+
+def encode_corpus(model, tokenizer, docs, output_path, batch_size=32, max_length=512, threshold=1e-4,
+                  quantization_factor=100, report_every=100):
+    """
+    Encodes a corpus in length-bucketed batches and writes JsonVectorCollection JSONL. Returns the number
+    of documents encoded and the elapsed time in seconds.
+    """
+    vocab = tokenizer.convert_ids_to_tokens(list(range(len(tokenizer))))
+    num_docs = 0
+    num_batches = 0
+    start = time.time()
+    with open(output_path, "w", encoding="utf-8") as out:
+        for docids, texts, batches in iter_length_bucketed_batches(docs, tokenizer, batch_size, max_length):
+            encoded = [None] * len(docids)
+            for positions, inputs in batches:
+                for position, result in zip(positions, encode_batch(model, inputs, threshold)):
+                    encoded[position] = result
+                num_docs += len(positions)
+                num_batches += 1
+                if report_every and num_batches % report_every == 0:
+                    elapsed = time.time() - start
+                    print(f"{num_docs} docs, {num_docs / elapsed:.1f} docs/sec")
+            for docid, text, (ids, values) in zip(docids, texts, encoded):
+                out.write(to_json_vector(docid, text, ids, values, vocab, quantization_factor) + "\n")
+    return num_docs, time.time() - start
+
+def run_batch_encoding(args):
+    model = create_session(args.model_path, args.intra_op_threads, args.inter_op_threads,
+                           args.parallel_execution, args.graph_optimization)
+    tokenizer = AutoTokenizer.from_pretrained(args.model_name)
+    docs = read_corpus(args.corpus, args.id_field, args.text_field)
+    num_docs, elapsed = encode_corpus(model, tokenizer, docs, args.output, args.batch_size, args.max_length,
+                                      args.threshold, args.quantization_factor)
+    print(f"Encoded {num_docs} docs in {elapsed:.1f}s ({num_docs / elapsed:.1f} docs/sec), "
+          f"batch size {args.batch_size}, {args.intra_op_threads} intra-op threads")
+
+def run_benchmark(args):
+    """Encodes the first benchmark_docs documents with every batch size and thread count combination."""
+    tokenizer = AutoTokenizer.from_pretrained(args.model_name)
+    docs = list(read_corpus(args.corpus, args.id_field, args.text_field, args.benchmark_docs))
+    print(f"{'threads':>8} {'batch':>6} {'docs/sec':>10}")
+    for threads in args.benchmark_threads:
+        model = create_session(args.model_path, threads, args.inter_op_threads,
+                               args.parallel_execution, args.graph_optimization)
+        for batch_size in args.benchmark_batch_sizes:
+            num_docs, elapsed = encode_corpus(model, tokenizer, iter(docs), args.output, batch_size,
+                                              args.max_length, args.threshold, args.quantization_factor,
+                                              report_every=0)
+            print(f"{threads:>8} {batch_size:>6} {num_docs / elapsed:>10.1f}")
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run ONNX model inference")
     parser.add_argument("--model_path", type=str, help="Path to the ONNX model", required=True)
     parser.add_argument("--model_name", type=str, help="Name of the Hugging Face model", required=True)
     parser.add_argument("--text", type=str, default="what is AI?", help="Input text for inference")
     parser.add_argument("--threshold", type=float, default=1e-4, help="Threshold for sparse vector")
+    parser.add_argument("--corpus", type=str, help="JSONL corpus to encode in batches instead of --text")
+    parser.add_argument("--output", type=str, help="Output JsonVectorCollection JSONL file for --corpus")
+    parser.add_argument("--id_field", type=str, default="id", help="Docid field of the corpus")
+    parser.add_argument("--text_field", type=str, default="contents", help="Text field of the corpus")
+    parser.add_argument("--batch_size", type=int, default=32, help="Number of documents per batch")
+    parser.add_argument("--max_length", type=int, default=512, help="Maximum number of tokens per document")
+    parser.add_argument("--quantization_factor", type=int, default=100,
+                        help="Factor applied to term weights before rounding them to integers")
+    parser.add_argument("--intra_op_threads", type=int, default=0,
+                        help="Threads used within an operator (0 lets onnxruntime decide)")
+    parser.add_argument("--inter_op_threads", type=int, default=0,
+                        help="Threads used across operators with --parallel_execution (0 lets onnxruntime decide)")
+    parser.add_argument("--parallel_execution", action="store_true", help="Run independent operators in parallel")
+    parser.add_argument("--graph_optimization", type=str, default="all",
+                        choices=["disable", "basic", "extended", "all"], help="Graph optimization level")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="Report docs/sec on --corpus for each batch size and thread count")
+    parser.add_argument("--benchmark_batch_sizes", type=int, nargs="+", default=[1, 8, 32, 64])
+    parser.add_argument("--benchmark_threads", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--benchmark_docs", type=int, default=1000)
     args = parser.parse_args()
 
-    run_onnx_inference(args.model_path, args.model_name, args.text, args.threshold)
+    if args.corpus:
+        if not args.output:
+            parser.error("--output is required with --corpus")
+        if args.benchmark:
+            run_benchmark(args)
+        else:
+            run_batch_encoding(args)
+    else:
+        run_onnx_inference(args.model_path, args.model_name, args.text, args.threshold)
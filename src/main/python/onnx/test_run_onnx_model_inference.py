@@ -0,0 +1,100 @@
+import unittest
+
+import numpy as np
+import onnxruntime
+from onnx import TensorProto, helper
+
+from run_onnx_model_inference import encode_batch, runs_single_documents
+
+def make_single_document_model():
+    """
+    A model with the signature of the splade_to_onnx.py exports: inputs with a batch dimension fixed to 1
+    and 1-D (ids, weights) outputs. Every input token is output with a weight of 1 + its attention mask,
+    so that padding tokens would show up in the output.
+    """
+    inputs = [helper.make_tensor_value_info(name, TensorProto.INT64, [1, "seq_len"])
+              for name in ["input_ids", "attention_mask", "token_type_ids"]]
+    outputs = [helper.make_tensor_value_info("output_idx", TensorProto.INT64, ["sparse_len"]),
+               helper.make_tensor_value_info("output_weights", TensorProto.FLOAT, ["sparse_len"])]
+    nodes = [
+        helper.make_node("Constant", [], ["flat"], value=helper.make_tensor("flat", TensorProto.INT64, [1], [-1])),
+        helper.make_node("Constant", [], ["one"], value=helper.make_tensor("one", TensorProto.FLOAT, [], [1.0])),
+        helper.make_node("Reshape", ["input_ids", "flat"], ["output_idx"]),
+        helper.make_node("Cast", ["attention_mask"], ["mask"], to=TensorProto.FLOAT),
+        helper.make_node("Reshape", ["mask", "flat"], ["flat_mask"]),
+        helper.make_node("Add", ["flat_mask", "one"], ["output_weights"]),
+    ]
+    graph = helper.make_graph(nodes, "single_document", inputs, outputs)
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 14)], ir_version=8)
+    return onnxruntime.InferenceSession(model.SerializeToString(), providers=["CPUExecutionProvider"])
+
+def make_input_ids_only_model():
+    """A single document model without an attention_mask input, outputting every input token with a weight of 1."""
+    inputs = [helper.make_tensor_value_info("input_ids", TensorProto.INT64, [1, "seq_len"])]
+    outputs = [helper.make_tensor_value_info("output_idx", TensorProto.INT64, ["sparse_len"]),
+               helper.make_tensor_value_info("output_weights", TensorProto.FLOAT, ["sparse_len"])]
+    nodes = [
+        helper.make_node("Constant", [], ["flat"], value=helper.make_tensor("flat", TensorProto.INT64, [1], [-1])),
+        helper.make_node("Reshape", ["input_ids", "flat"], ["output_idx"]),
+        helper.make_node("Cast", ["output_idx"], ["ids"], to=TensorProto.FLOAT),
+        helper.make_node("Constant", [], ["zero"], value=helper.make_tensor("zero", TensorProto.FLOAT, [], [0.0])),
+        helper.make_node("Mul", ["ids", "zero"], ["zeros"]),
+        helper.make_node("Constant", [], ["one"], value=helper.make_tensor("one", TensorProto.FLOAT, [], [1.0])),
+        helper.make_node("Add", ["zeros", "one"], ["output_weights"]),
+    ]
+    graph = helper.make_graph(nodes, "input_ids_only", inputs, outputs)
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 14)], ir_version=8)
+    return onnxruntime.InferenceSession(model.SerializeToString(), providers=["CPUExecutionProvider"])
+
+def make_batch_model(vocab_size=8):
+    """A model with a dynamic batch dimension, outputting the one-hot weights of the first token of each document."""
+    inputs = [helper.make_tensor_value_info(name, TensorProto.INT64, ["batch", "seq_len"])
+              for name in ["input_ids", "attention_mask"]]
+    outputs = [helper.make_tensor_value_info("weights", TensorProto.FLOAT, ["batch", vocab_size])]
+    nodes = [
+        helper.make_node("Constant", [], ["first"], value=helper.make_tensor("first", TensorProto.INT64, [], [0])),
+        helper.make_node("Gather", ["input_ids", "first"], ["ids"], axis=1),
+        helper.make_node("Constant", [], ["depth"], value=helper.make_tensor("depth", TensorProto.INT64, [], [vocab_size])),
+        helper.make_node("Constant", [], ["values"], value=helper.make_tensor("values", TensorProto.FLOAT, [2], [0.0, 1.0])),
+        helper.make_node("OneHot", ["ids", "depth", "values"], ["weights"]),
+    ]
+    graph = helper.make_graph(nodes, "batch", inputs, outputs)
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 14)], ir_version=8)
+    return onnxruntime.InferenceSession(model.SerializeToString(), providers=["CPUExecutionProvider"])
+
+def pad(documents, left=False):
+    length = max(len(ids) for ids in documents)
+    padding = [[0] * (length - len(ids)) for ids in documents]
+    input_ids = [pad + ids if left else ids + pad for ids, pad in zip(documents, padding)]
+    attention_mask = [[0] * len(pad) + [1] * len(ids) if left else [1] * len(ids) + [0] * len(pad)
+                      for ids, pad in zip(documents, padding)]
+    return {"input_ids": np.array(input_ids, dtype=np.int64),
+            "attention_mask": np.array(attention_mask, dtype=np.int64)}
+
+class TestEncodeBatch(unittest.TestCase):
+    documents = [[101, 7, 5, 102], [101, 3, 102], [101, 4, 4, 6, 9, 102]]
+
+    def test_single_document_model_is_detected(self):
+        self.assertTrue(runs_single_documents(make_single_document_model()))
+        self.assertFalse(runs_single_documents(make_batch_model()))
+
+    def test_batch_through_single_document_model(self):
+        model = make_single_document_model()
+        for left in [False, True]:
+            results = encode_batch(model, pad(self.documents, left), threshold=1e-4)
+            self.assertEqual(len(results), len(self.documents))
+            for ids, (output_ids, output_weights) in zip(self.documents, results):
+                self.assertEqual(output_ids.tolist(), ids)
+                self.assertEqual(output_weights.tolist(), [2.0] * len(ids))
+
+    def test_batch_through_model_without_attention_mask(self):
+        results = encode_batch(make_input_ids_only_model(), pad(self.documents), threshold=1e-4)
+        self.assertEqual([ids.tolist() for ids, _ in results], self.documents)
+
+    def test_batch_through_batch_model(self):
+        documents = [[1, 2], [3], [5, 6, 7]]
+        results = encode_batch(make_batch_model(), pad(documents), threshold=1e-4)
+        self.assertEqual([ids.tolist() for ids, _ in results], [[1], [3], [5]])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,54 +1,120 @@
 import argparse
+import collections
 import gzip
 import json
 import os
 import time
+from multiprocessing import Pool
 
 
 def clean(text):
   return text.replace('\n', ' ').replace('\t', ' ')
 
 
-def get_id_years(file_paths, train_fraction):
+def convert_shard(task):
+  """Converts one corpus file in a single pass: its papers with a publication
+  year are written to its own jsonl files, and two side outputs are recorded
+  for the generation of queries and qrels, which needs the whole corpus:
+  the ids and years of the papers (ids/idsNN.tsv), and the candidate queries
+  with their citations (ids/queriesNN.jsonl). The position of a paper among
+  the papers of the same year, which decides its set, is recorded as well.
+
+  Returns the number of papers of each year in the file.
+  """
+  file_index, file_path, args = task
+  start_time = time.time()
+  year_counts = collections.Counter()
+  n_docs = 0
+  output_jsonl_file = None
+  ids_file = open(os.path.join(
+      args.output_folder, 'ids', 'ids{:02d}.tsv'.format(file_index)), 'w')
+  candidates_file = open(os.path.join(
+      args.output_folder, 'ids', 'queries{:02d}.jsonl'.format(file_index)), 'w')
+  with gzip.open(file_path) as f:
+    for line in f:
+      obj = json.loads(line.strip())
+      doc_id = obj['id']
+      if 'year' not in obj:
+        continue
+      year = int(obj['year'])
+      rank = year_counts[year]
+      year_counts[year] += 1
+      ids_file.write('{}\t{}\n'.format(doc_id, year))
+
+      if n_docs % args.max_docs_per_file == 0:
+        if n_docs > 0:
+          output_jsonl_file.close()
+        output_path = os.path.join(
+            args.output_folder, 'corpus/docs{:02d}_{:02d}.json'.format(
+                file_index, n_docs // args.max_docs_per_file))
+        output_jsonl_file = open(output_path, 'w')
+
+      doc_text = '[Title]: {} [Abstract]: {}'.format(
+          obj['title'], obj['paperAbstract'])
+      doc_text = clean(doc_text)
+      output_dict = {'id': doc_id, 'contents': doc_text}
+      output_jsonl_file.write(json.dumps(output_dict) + '\n')
+      n_docs += 1
+
+      # Remove self citations. Citations not in the corpus or more recent than
+      # the paper can only be removed once the whole corpus is read.
+      out_citations = [
+          out_citation for out_citation in obj['outCitations']
+          if out_citation != doc_id
+      ]
+      if len(out_citations) == 0:
+        continue
+
+      doc_title = obj['title']
+      doc_title = clean(doc_title)
+      if args.use_abstract_in_query:
+        doc_abstract = clean(obj['paperAbstract'])
+        query = '[Title]: ' + doc_title + ' [Abstract]: ' + doc_abstract
+      else:
+        query = doc_title
+      candidates_file.write(
+          json.dumps([doc_id, year, rank, query, out_citations]) + '\n')
+
+  if output_jsonl_file is not None:
+    output_jsonl_file.close()
+  ids_file.close()
+  candidates_file.close()
+  print('Converted {} in {} secs: {} docs.'.format(
+      file_path, int(time.time() - start_time), n_docs))
+  return file_index, year_counts
+
+
+def create_queries_and_qrels(args, shard_year_counts):
+  """Splits the papers by year between training, dev, and test sets, and
+  writes the queries and qrels of each set from the side outputs of the
+  corpus files, in the order of the corpus.
+  """
   print('Collecting paper ids and their publication years...')
-  id_years = []
-  for file_num, file_path in enumerate(file_paths):
-    with gzip.open(file_path) as f:
-      for line_num, line in enumerate(f):
-        obj = json.loads(line.strip())
-        doc_id = obj['id']
-        if 'year' not in obj:
-          continue
-        year = int(obj['year'])
-
-        id_years.append((doc_id, year))
-        if line_num % 100000 == 0:
-          print('Processed {} lines. Collected {} docs.'.format(
-              line_num + 1, len(id_years)))
-
-  print('Sorting papers by year...')
-  id_years.sort(key = lambda x: x[1])
-
-  num_train = int(len(id_years) * train_fraction)
-  train_ids = id_years[:num_train]
-  num_dev = (len(id_years) - num_train) // 2
-  dev_ids = id_years[num_train:num_train + num_dev]
-  test_ids = id_years[num_train + num_dev:]
-
-  train_ids = set(id for id, _ in train_ids)
-  dev_ids = set(id for id, _ in dev_ids)
-  test_ids = set(id for id, _ in test_ids)
-  
+  id_years = {}
+  for file_index in range(len(shard_year_counts)):
+    with open(os.path.join(
+        args.output_folder, 'ids', 'ids{:02d}.tsv'.format(file_index))) as f:
+      for line in f:
+        doc_id, year = line.rstrip('\n').split('\t')
+        id_years[doc_id] = int(year)
+
+  # Papers are sorted by year, keeping the corpus order within a year: the
+  # position of a paper is the number of papers of earlier years, plus its
+  # position among the papers of its year.
+  year_counts = collections.Counter()
+  for counts in shard_year_counts:
+    year_counts.update(counts)
+  n_papers = sum(year_counts.values())
+  num_train = int(n_papers * args.train_fraction)
+  num_dev = (n_papers - num_train) // 2
   print('Collected {}, {}, {} papers for training, dev, and test sets.'.format(
-      len(train_ids), len(dev_ids), len(test_ids)))
-
-  id_years = {id: year for id, year in id_years}
-
-  return train_ids, dev_ids, test_ids, id_years
+      num_train, num_dev, n_papers - num_train - num_dev))
 
-
-def create_dataset(args):
-  print('Converting data...')
+  before_year = {}
+  total = 0
+  for year in sorted(year_counts):
+    before_year[year] = total
+    total += year_counts[year]
 
   queries_files = {}
   qrels_files = {}
@@ -59,113 +125,42 @@ def create_dataset(args):
       args.output_folder, 'qrels.{}'.format(set_name))
     queries_files[set_name] = open(queries_filepath, 'w')
     qrels_files[set_name] = open(qrels_filepath, 'w')
-  
-  file_names = os.listdir(args.collection_path)
-  file_paths = []
-  for file_name in file_names:
-    file_path = os.path.join(args.collection_path, file_name)
-    if not os.path.isfile(file_path):
-      continue
-    if not file_path.endswith('.gz'):
-      continue
-    file_paths.append(file_path)
-
-  print('{} files found'.format(len(file_paths)))
 
-  # We first need to collect papers by year, sort them, and split between 
-  # training, dev, and test sets.
-  train_ids, dev_ids, test_ids, id_years = get_id_years(
-      file_paths=file_paths, train_fraction=args.train_fraction)
-
-  doc_ids = train_ids | dev_ids | test_ids
-
-  n_docs = 0
-  file_index = 0
-  num_train = 0
-  num_dev = 0
-  num_test = 0
-  start_time = time.time()
-  for file_num, file_path in enumerate(file_paths):
-    with gzip.open(file_path) as f:
+  set_sizes = {'train': 0, 'dev': 0, 'test': 0}
+  earlier_shards = collections.Counter()
+  for file_index, counts in enumerate(shard_year_counts):
+    with open(os.path.join(
+        args.output_folder, 'ids', 'queries{:02d}.jsonl'.format(file_index))) as f:
       for line in f:
-        obj = json.loads(line.strip())
-        doc_id = obj['id']
-
-        if doc_id not in doc_ids:
-          continue
+        doc_id, year, rank, query, out_citations = json.loads(line)
 
-        if n_docs % args.max_docs_per_file == 0:
-          if n_docs > 0:
-            output_jsonl_file.close()
-          output_path = os.path.join(
-              args.output_folder, 'corpus/docs{:02d}.json'.format(file_index))
-          output_jsonl_file = open(output_path, 'w')
-          file_index += 1
-        
-        doc_text = '[Title]: {} [Abstract]: {}'.format(
-            obj['title'], obj['paperAbstract'])
-        doc_text = clean(doc_text)
-        output_dict = {'id': doc_id, 'contents': doc_text}
-        output_jsonl_file.write(json.dumps(output_dict) + '\n')
-        n_docs += 1
-
-        out_citations = obj['outCitations']
-
-        # Remove citations not in the corpus.
+        # Use only citations in the corpus that have an older publication year
+        # than the citing paper's.
         out_citations = [
-            out_citation for out_citation in out_citations 
-            if out_citation in doc_ids
+            out_citation for out_citation in out_citations
+            if out_citation in id_years and id_years[out_citation] <= year
         ]
 
-        # Remove self citations.
-        out_citations = [
-            out_citation for out_citation in out_citations 
-            if out_citation != doc_id
-        ]
-
-        # Use only citations that have an older publication year than the citing
-        # paper's or do not have an year.
-        out_citations2 = []
-        for out_citation in out_citations: 
-          if out_citation in id_years:
-            if id_years[out_citation] <= obj['year']:
-              out_citations2.append(out_citation)
-        out_citations = out_citations2
-
         # Skip papers with no out citations.
         if len(out_citations) == 0:
           continue
 
-        if doc_id in train_ids:
+        position = before_year[year] + earlier_shards[year] + rank
+        if position < num_train:
           set_name = 'train'
-          num_train += 1  
-        elif doc_id in dev_ids:
+        elif position < num_train + num_dev:
           set_name = 'dev'
-          num_dev += 1
-        elif doc_id in test_ids:
+        else:
           set_name = 'test'
-          num_test += 1
-
-        queries_file = queries_files[set_name]
-        qrels_file = qrels_files[set_name]
+        set_sizes[set_name] += 1
 
-        doc_title = obj['title']
-        doc_title = clean(doc_title)
-        if args.use_abstract_in_query:
-          doc_abstract = clean(obj['paperAbstract'])
-          query = '[Title]: ' + doc_title + ' [Abstract]: ' + doc_abstract
-        else:
-          query = doc_title
-        queries_file.write('{}\t{}\n'.format(doc_id, query))
+        queries_files[set_name].write('{}\t{}\n'.format(doc_id, query))
         for out_citation in out_citations:
-          qrels_file.write('{} 0 {} 1\n'.format(doc_id, out_citation))
+          qrels_files[set_name].write('{} 0 {} 1\n'.format(doc_id, out_citation))
+    earlier_shards.update(counts)
 
-        if n_docs % 100000 == 0:
-          print('Read {}/{} files. {} docs written in {} files in {} secs.'.format(
-              file_num, len(file_paths), n_docs, file_index, 
-              int(time.time() - start_time)))
-          print('Examples: {} train, {} valid, {} test'.format(
-              num_train, num_dev, num_test))
+  print('Examples: {} train, {} valid, {} test'.format(
+      set_sizes['train'], set_sizes['dev'], set_sizes['test']))
 
   # Close queries and qrels files.
   for queries_file in queries_files.values():
@@ -174,6 +169,36 @@ def create_dataset(args):
     qrels_file.close()
 
 
+def create_dataset(args):
+  print('Converting data...')
+
+  file_names = sorted(os.listdir(args.collection_path))
+  file_paths = []
+  for file_name in file_names:
+    file_path = os.path.join(args.collection_path, file_name)
+    if not os.path.isfile(file_path):
+      continue
+    if not file_path.endswith('.gz'):
+      continue
+    file_paths.append(file_path)
+
+  print('{} files found'.format(len(file_paths)))
+
+  # Each corpus file is read once, by one of the workers. Queries and qrels
+  # need papers of the whole corpus: they are generated from the side outputs.
+  start_time = time.time()
+  tasks = [(file_index, file_path, args)
+           for file_index, file_path in enumerate(file_paths)]
+  shard_year_counts = [None] * len(tasks)
+  with Pool(args.workers) as pool:
+    for file_index, year_counts in pool.imap_unordered(convert_shard, tasks):
+      shard_year_counts[file_index] = year_counts
+  print('Converted {} files in {} secs.'.format(
+      len(file_paths), int(time.time() - start_time)))
+
+  create_queries_and_qrels(args, shard_year_counts)
+
+
 if __name__ == '__main__':
   parser = argparse.ArgumentParser(
       description='Converts Open Research Corpus jsonl collection to '
@@ -191,12 +216,14 @@ if __name__ == '__main__':
   parser.add_argument('--use_abstract_in_query', action='store_true',
                       help='If True use title and a abstract as query. If '
                            'False, use only title.')
+  parser.add_argument('--workers', default=os.cpu_count(), type=int,
+                      help='Number of worker processes, each converting one '
+                           'corpus file at a time.')
 
   args = parser.parse_args()
 
-  if not os.path.exists(args.output_folder):
-      os.makedirs(args.output_folder)
-      os.makedirs(os.path.join(args.output_folder, 'corpus'))
+  os.makedirs(os.path.join(args.output_folder, 'corpus'), exist_ok=True)
+  os.makedirs(os.path.join(args.output_folder, 'ids'), exist_ok=True)
 
   create_dataset(args)
   print('Done!')
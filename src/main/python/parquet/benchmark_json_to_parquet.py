@@ -0,0 +1,104 @@
+import os
+import json
+import argparse
+import logging
+import random
+import tempfile
+import time
+
+from json_to_parquet import (
+    DEFAULT_BATCH_ROWS,
+    DECODERS,
+    EXECUTORS,
+    convert_jsonl_to_parquet,
+)
+
+
+def generate_synthetic_corpus(corpus_dir, num_shards, docs_per_shard, dimension, seed=42):
+    """
+    Writes num_shards JSONL files of random dense vectors in the Anserini JSONL vector format.
+    """
+    rng = random.Random(seed)
+    os.makedirs(corpus_dir, exist_ok=True)
+    for shard in range(num_shards):
+        shard_path = os.path.join(corpus_dir, f"shard{shard:02d}.jsonl")
+        with open(shard_path, "w", encoding="utf-8") as f:
+            for i in range(docs_per_shard):
+                doc = {
+                    "docid": f"{shard}-{i}",
+                    "vector": [rng.random() for _ in range(dimension)],
+                    "contents": "",
+                }
+                f.write(json.dumps(doc) + "\n")
+    logging.info(f"Wrote {num_shards} shards of {docs_per_shard} docs to {corpus_dir}")
+
+
+def benchmark(args):
+    """
+    Converts the same synthetic corpus once per worker count and reports docs/sec.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        corpus_dir = os.path.join(tmp_dir, "corpus")
+        generate_synthetic_corpus(
+            corpus_dir, args.shards, args.docs_per_shard, args.dimension
+        )
+
+        results = []
+        for workers in args.workers:
+            output_dir = os.path.join(tmp_dir, f"parquet-{workers}")
+            start = time.time()
+            total_rows = convert_jsonl_to_parquet(
+                corpus_dir,
+                output_dir,
+                overwrite=True,
+                streaming=args.streaming,
+                batch_rows=args.batch_rows,
+                workers=workers,
+                executor=args.executor,
+                decoder=args.decoder,
+            )
+            elapsed = time.time() - start
+            results.append((workers, total_rows, elapsed))
+
+    print(f"executor={args.executor} decoder={args.decoder} streaming={args.streaming}")
+    print(f"{'workers':>8} {'docs':>10} {'seconds':>10} {'docs/sec':>12}")
+    for workers, total_rows, elapsed in results:
+        print(f"{workers:>8} {total_rows:>10} {elapsed:>10.2f} {total_rows / elapsed:>12.0f}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        format="%(asctime)s - %(levelname)s - %(message)s", level=logging.WARNING
+    )
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark JSONL to Parquet conversion throughput on a synthetic corpus."
+    )
+    parser.add_argument("--shards", type=int, default=8, help="Number of synthetic shards.")
+    parser.add_argument(
+        "--docs-per-shard", type=int, default=10000, help="Number of documents per shard."
+    )
+    parser.add_argument("--dimension", type=int, default=768, help="Vector dimension.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4, 8],
+        help="Worker counts to benchmark.",
+    )
+    parser.add_argument(
+        "--executor", choices=list(EXECUTORS), default="process", help="Executor type."
+    )
+    parser.add_argument("--decoder", choices=DECODERS, default="auto", help="JSON decoder.")
+    parser.add_argument(
+        "--streaming", action="store_true", default=False, help="Use streaming conversion."
+    )
+    parser.add_argument(
+        "--batch-rows",
+        type=int,
+        default=DEFAULT_BATCH_ROWS,
+        help="Number of records per batch in streaming mode.",
+    )
+    args = parser.parse_args()
+
+    benchmark(args)
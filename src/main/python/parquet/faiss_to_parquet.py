@@ -2,8 +2,32 @@ import os
 import argparse
 import logging
 import shutil
+from itertools import islice
 import faiss
-import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from manifest import (
+    default_manifest_path,
+    fingerprint_sources,
+    is_shard_from_sources,
+    load_manifest,
+    record_shard,
+    save_manifest,
+)
+from quantization import (
+    ARROW_TYPES,
+    QUANTIZATION_TYPES,
+    fit_int8,
+    quantization_metadata,
+    quantized_vector_array,
+    read_quantization_metadata,
+    read_query_vectors,
+    recall_report,
+    update_min_max,
+    write_recall_report,
+)
 
 
 def setup_logging():
@@ -11,53 +35,134 @@ def setup_logging():
         format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO
     )
 
-def read_docid_file(docid_path):
+def iter_docid_batches(docid_file, num_rows, batch_size):
     """
-    Reads the docid file and returns a list of document IDs.
+    Reads the next num_rows document IDs from an open docid file, yielding lists of at most
+    batch_size document IDs.
     """
-    try:
-        with open(docid_path, 'r') as f:
-            docids = [line.strip() for line in f]
-        logging.info(f"Read {len(docids)} docids from {docid_path}")
-        return docids
-    except Exception as e:
-        logging.error(f"Failed to read docid file {docid_path}: {e}")
-        raise RuntimeError(f"Failed to read docid file {docid_path}: {e}")
+    while num_rows > 0:
+        batch = [line.strip() for line in islice(docid_file, min(batch_size, num_rows))]
+        if not batch:
+            break
+        num_rows -= len(batch)
+        yield batch
+
+
+def skip_docids(docid_file, num_rows):
+    """
+    Advances an open docid file past num_rows document IDs.
+    """
+    for _ in islice(docid_file, num_rows):
+        pass
 
 
 def read_faiss_index(index_path):
     """
-    Reads a FAISS index file and returns a numpy array of vectors.
+    Opens a FAISS index file without reconstructing its vectors, memory-mapping it when
+    the index type supports it.
     """
     try:
-        index = faiss.read_index(index_path)
-        vectors = index.reconstruct_n(0, index.ntotal)
-        logging.info(f"Read {vectors.shape[0]} vectors from {index_path}")
-        return vectors
+        try:
+            index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP)
+        except RuntimeError:
+            index = faiss.read_index(index_path)
+        logging.info(f"Opened FAISS index {index_path} with {index.ntotal} vectors of dimension {index.d}")
+        return index
     except Exception as e:
         logging.error(f"Failed to read FAISS index file {index_path}: {e}")
         raise RuntimeError(f"Failed to read FAISS index file {index_path}: {e}")
 
 
-def write_to_parquet_in_chunks(df, output_dir, rows_per_chunk=10**6):
+def count_docids(docid_path):
     """
-    Writes the DataFrame to Parquet files in chunks of specified size.
+    Counts the document IDs in the docid file without keeping them in memory.
     """
-    # Write DataFrame to Parquet in chunks
-    for i in range(0, len(df), rows_per_chunk):
-        chunk = df.iloc[i:i + rows_per_chunk]
-        chunk_file = os.path.join(output_dir, f'chunk_{i//rows_per_chunk}.parquet')
-        try:
-            chunk.to_parquet(chunk_file, index=False)
-            logging.info(f"Successfully wrote chunk to {chunk_file}")
-        except Exception as e:
-            logging.error(f"Failed to write chunk to Parquet file {chunk_file}: {e}")
-            raise RuntimeError(f"Failed to write chunk to Parquet file {chunk_file}: {e}")
+    try:
+        with open(docid_path, 'r') as f:
+            return sum(1 for _ in f)
+    except Exception as e:
+        logging.error(f"Failed to read docid file {docid_path}: {e}")
+        raise RuntimeError(f"Failed to read docid file {docid_path}: {e}")
+
+
+def compute_vector_stats(index, batch_size):
+    """
+    Computes per-dimension (minimum, maximum) over all vectors in the index, reconstructing
+    batch_size vectors at a time.
+    """
+    stats = None
+    for start in range(0, index.ntotal, batch_size):
+        stats = update_min_max(stats, index.reconstruct_n(start, min(batch_size, index.ntotal - start)))
+    return stats
+
+
+def vector_schema(dimension, quantization='none', scale=None, offset=None):
+    """
+    Returns the Arrow schema of the exported chunks, carrying the quantization parameters
+    in its metadata if the vectors are quantized.
+    """
+    return pa.schema(
+        [('docid', pa.string()), ('vector', pa.list_(ARROW_TYPES[quantization], dimension))],
+        metadata=quantization_metadata(quantization, dimension, scale, offset) if quantization != 'none' else None,
+    )
+
+
+def iter_record_batches(index, docid_file, start, num_rows, batch_size, schema,
+                        quantization='none', scale=None, offset=None):
+    """
+    Reconstructs num_rows vectors from the index, starting at start, in ranges of batch_size
+    and pairs each range with the matching docids, yielding Arrow record batches. Vectors are
+    stored as fixed-size lists sharing the reconstructed buffer, quantized first if requested.
+    """
+    for docids in iter_docid_batches(docid_file, num_rows, batch_size):
+        vectors = index.reconstruct_n(start, len(docids))
+        yield pa.RecordBatch.from_arrays(
+            [pa.array(docids, type=pa.string()), quantized_vector_array(vectors, quantization, scale, offset)],
+            schema=schema,
+        )
+        start += len(docids)
+
+
+def sample_vectors(index, sample_size, seed=42):
+    """
+    Reconstructs a uniform random sample of vectors from the index.
+    """
+    rng = np.random.default_rng(seed)
+    ids = np.sort(rng.choice(index.ntotal, min(sample_size, index.ntotal), replace=False))
+    return np.vstack([index.reconstruct(int(i)) for i in ids])
+
+
+def write_chunk(record_batches, chunk_file, schema):
+    """
+    Writes record batches to a single Parquet chunk file, one row group per record batch.
+    Returns the number of rows written.
+    """
+    num_rows = 0
+    try:
+        with pq.ParquetWriter(chunk_file, schema) as writer:
+            for batch in record_batches:
+                writer.write_batch(batch)
+                num_rows += batch.num_rows
+        logging.info(f"Successfully wrote chunk to {chunk_file}")
+        return num_rows
+    except Exception as e:
+        logging.error(f"Failed to write chunk to Parquet file {chunk_file}: {e}")
+        raise RuntimeError(f"Failed to write chunk to Parquet file {chunk_file}: {e}")
 
 
-def convert_faiss_to_parquet(input_dir, output_dir, overwrite):
+def convert_faiss_to_parquet(input_dir, output_dir, overwrite, rows_per_chunk=10**6, batch_size=10**5,
+                             quantization='none', report_path=None, queries_path=None,
+                             sample_size=10000, num_queries=100, k=10, manifest_path=None):
     """
     Converts FAISS index files in the input directory to Parquet files in the output directory.
+    Vectors are reconstructed batch_size at a time, so memory use is bounded by the batch size
+    rather than the size of the index. With float16 or int8 quantization, a report comparing
+    inner-product top-k results of the original and quantized vectors on a sample is written
+    to report_path (by default next to the output directory).
+
+    Each chunk is recorded in a manifest (by default next to the output directory) along
+    with the size, mtime and hash of the index and docid files, so an interrupted or
+    repeated conversion only writes the chunks that are missing or out of date.
     """
     # Ensure the input directory contains the necessary files
     docid_path = os.path.join(input_dir, 'docid')
@@ -66,33 +171,86 @@ def convert_faiss_to_parquet(input_dir, output_dir, overwrite):
     if not os.path.isfile(docid_path) or not os.path.isfile(index_path):
         raise FileNotFoundError("Both 'docid' and 'index' files must be present in the input directory.")
 
-    # Set up the output directory
+    if manifest_path is None:
+        manifest_path = default_manifest_path(output_dir)
+
+    # Set up the output directory, resuming a previous conversion if it left a manifest
     if os.path.exists(output_dir):
         if overwrite:
             shutil.rmtree(output_dir)
+            if os.path.exists(manifest_path):
+                os.remove(manifest_path)
             os.makedirs(output_dir)
-        else:
+        elif not os.path.isfile(manifest_path):
             raise FileExistsError(f"Output directory '{output_dir}' already exists. Use --overwrite to replace it.")
+        else:
+            logging.info(f"Resuming conversion recorded in {manifest_path}")
     else:
         os.makedirs(output_dir)
 
-    # Read docids and vectors
-    docids = read_docid_file(docid_path)
-    vectors = read_faiss_index(index_path)
+    index = read_faiss_index(index_path)
 
     # Check if the number of docids matches the number of vectors
-    if len(docids) != vectors.shape[0]:
+    if count_docids(docid_path) != index.ntotal:
         error_message = "The number of docids does not match the number of vectors."
         logging.error(error_message)
         raise ValueError(error_message)
 
-    df = pd.DataFrame({
-        'docid': docids,
-        'vector': vectors.tolist()  # Convert vectors to a list format
-    })
+    manifest = load_manifest(manifest_path, {'rows_per_chunk': rows_per_chunk, 'quantization': quantization})
+    source_paths = [os.path.abspath(index_path), os.path.abspath(docid_path)]
+    chunks = [
+        (f'chunk_{i}.parquet', start, min(rows_per_chunk, index.ntotal - start))
+        for i, start in enumerate(range(0, index.ntotal, rows_per_chunk))
+    ]
+    # Fingerprint the index and docids once, rather than once per chunk
+    sources = fingerprint_sources(manifest, source_paths)
+    pending = {key for key, _, _ in chunks if not is_shard_from_sources(manifest, key, sources)}
+
+    # Remove chunks left over from a conversion with more chunks
+    current_keys = {key for key, _, _ in chunks}
+    for key in list(manifest['shards']):
+        if key not in current_keys:
+            stale_output = manifest['shards'].pop(key)['output']
+            if os.path.isfile(stale_output):
+                os.remove(stale_output)
+    save_manifest(manifest, manifest_path)
+    if len(pending) < len(chunks):
+        logging.info(f"Skipping {len(chunks) - len(pending)} up-to-date chunks recorded in {manifest_path}")
+
+    batch_size = min(batch_size, rows_per_chunk)
+    scale, offset = None, None
+    if quantization == 'int8':
+        done = [key for key, _, _ in chunks if key not in pending]
+        if done:
+            # Reuse the parameters of the chunks already written so all chunks agree
+            _, scale, offset = read_quantization_metadata(manifest['shards'][done[0]]['output'])
+        else:
+            scale, offset = fit_int8(compute_vector_stats(index, batch_size))
+    schema = vector_schema(index.d, quantization, scale, offset)
+
+    # Stream docids and vector ranges into Parquet chunks, skipping up-to-date chunks
+    total_rows = 0
+    if pending:
+        with open(docid_path, 'r') as docid_file:
+            for key, start, num_rows in chunks:
+                if key not in pending:
+                    skip_docids(docid_file, num_rows)
+                    continue
+                chunk_file = os.path.join(output_dir, key)
+                record_batches = iter_record_batches(index, docid_file, start, num_rows, batch_size, schema,
+                                                     quantization, scale, offset)
+                total_rows += write_chunk(record_batches, chunk_file, schema)
+                record_shard(manifest, key, sources, num_rows, chunk_file)
+                save_manifest(manifest, manifest_path)
+    logging.info(f"Wrote {total_rows} vectors to {output_dir}")
 
-    # Write DataFrame to Parquet in chunks
-    write_to_parquet_in_chunks(df, output_dir)
+    if quantization != 'none':
+        queries = read_query_vectors(queries_path, num_queries) if queries_path else None
+        report = recall_report(sample_vectors(index, sample_size), quantization, scale, offset,
+                               queries=queries, num_queries=num_queries, k=k)
+        if report_path is None:
+            report_path = f"{output_dir.rstrip(os.sep)}.quantization.json"
+        write_recall_report(report, report_path)
 
 if __name__ == "__main__":
     setup_logging()
@@ -110,13 +268,66 @@ if __name__ == "__main__":
         "--overwrite",
         action="store_true",
         default=False,
-        help="Overwrite the output directory if it already exists.",
+        help="Overwrite the output directory if it already exists, instead of resuming from its manifest.",
+    )
+    parser.add_argument(
+        "--rows-per-chunk",
+        type=int,
+        default=10**6,
+        help="Number of vectors per output Parquet file.",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=10**5,
+        help="Number of vectors reconstructed from the index at a time (one Parquet row group).",
+    )
+    parser.add_argument(
+        "--quantization",
+        choices=QUANTIZATION_TYPES,
+        default="none",
+        help="Store vectors as float16 or as int8 with per-dimension scale/offset in the schema metadata.",
+    )
+    parser.add_argument(
+        "--quantization-report",
+        default=None,
+        help="Path of the quantization recall report (default: <output>.quantization.json).",
+    )
+    parser.add_argument(
+        "--quantization-queries",
+        default=None,
+        help="JSONL topics file of query vectors for the recall report (default: sampled document vectors).",
+    )
+    parser.add_argument(
+        "--quantization-sample-size",
+        type=int,
+        default=10000,
+        help="Number of sampled document vectors searched in the recall report.",
+    )
+    parser.add_argument(
+        "--quantization-k",
+        type=int,
+        default=10,
+        help="Cutoff for top-k agreement in the recall report.",
+    )
+    parser.add_argument(
+        "--manifest",
+        default=None,
+        help="Path of the per-chunk manifest used to resume conversions (default: <output>.manifest.json).",
     )
     args = parser.parse_args()
 
     try:
         # Convert FAISS index data to Parquet in chunks
-        convert_faiss_to_parquet(args.input, args.output, args.overwrite)
+        convert_faiss_to_parquet(
+            args.input, args.output, args.overwrite, args.rows_per_chunk, args.batch_size,
+            quantization=args.quantization,
+            report_path=args.quantization_report,
+            queries_path=args.quantization_queries,
+            sample_size=args.quantization_sample_size,
+            k=args.quantization_k,
+            manifest_path=args.manifest,
+        )
     except Exception as e:
         logging.error(f"Script failed: {e}")
 
@@ -5,9 +5,56 @@ import pandas as pd
 import argparse
 import shutil
 import logging
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from functools import partial
+import pyarrow as pa
+import pyarrow.json as pa_json
+import pyarrow.parquet as pq
 from tqdm import tqdm
 
+from manifest import (
+    default_manifest_path,
+    file_fingerprint,
+    is_shard_up_to_date,
+    load_manifest,
+    record_shard,
+    save_manifest,
+)
+from quantization import (
+    QUANTIZATION_TYPES,
+    fit_int8,
+    quantize_table,
+    read_quantization_metadata,
+    read_query_vectors,
+    recall_report,
+    update_min_max,
+    vector_column_to_numpy,
+    write_recall_report,
+)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Placeholder field in the Anserini JSONL dense vector format, dropped on conversion
+DROPPED_COLUMNS = ["contents"]
+
+VECTOR_COLUMN = "vector"
+
+DEFAULT_BATCH_ROWS = 100000
+
+# Rough ratio between the in-memory size of a parsed batch (Python dicts, then Arrow
+# buffers) and its size as raw JSON text; used to turn --max-memory into a batch size.
+MEMORY_EXPANSION_FACTOR = 8
+
+# "json" and "orjson" parse line by line in Python; "arrow" uses the columnar Arrow JSON
+# reader, which parses without holding the GIL. "auto" picks orjson when it is installed.
+DECODERS = ["auto", "json", "orjson", "arrow"]
+
+EXECUTORS = {"thread": ThreadPoolExecutor, "process": ProcessPoolExecutor}
+
 
 def setup_logging():
     logging.basicConfig(
@@ -15,32 +62,231 @@ def setup_logging():
     )
 
 
-def read_jsonl_file(file_path: str) -> list[dict]:
+def resolve_decoder(decoder: str) -> str:
+    """
+    Resolves the "auto" decoder and checks that the requested decoder is available.
+    """
+    if decoder == "auto":
+        return "orjson" if orjson is not None else "json"
+    if decoder == "orjson" and orjson is None:
+        raise ValueError("The orjson decoder was requested but orjson is not installed.")
+    if decoder not in DECODERS:
+        raise ValueError(f"Unknown decoder {decoder}, expected one of {DECODERS}")
+    return decoder
+
+
+def get_json_loads(decoder: str):
+    """
+    Returns the function used to parse a single JSON line for the given decoder.
+    """
+    return orjson.loads if decoder == "orjson" else json.loads
+
+
+def read_jsonl_file(file_path: str, decoder="json") -> list[dict]:
     """
     Reads a .jsonl or .jsonl.gz file and returns a list of dictionaries.
     """
+    loads = get_json_loads(decoder)
     data = []
     try:
         if file_path.endswith(".gz"):
             with gzip.open(file_path, "rt", encoding="utf-8") as f:
                 for line in f:
-                    data.append(json.loads(line))
+                    data.append(loads(line))
         else:
             with open(file_path, "r", encoding="utf-8") as f:
                 for line in f:
-                    data.append(json.loads(line))
+                    data.append(loads(line))
     except Exception as e:
         logging.error(f"Failed to read file {file_path}: {e}")
         raise RuntimeError(f"Failed to read file {file_path}: {e}")
     return data
 
 
-def convert_file_to_parquet(input_file_path: str, output_file_path: str) -> int:
+def open_jsonl_file(file_path: str):
+    """
+    Opens a .jsonl or .jsonl.gz file for reading text.
+    """
+    if file_path.endswith(".gz"):
+        return gzip.open(file_path, "rt", encoding="utf-8")
+    return open(file_path, "r", encoding="utf-8")
+
+
+def iter_jsonl_batches(file_path: str, batch_rows: int, decoder="json"):
+    """
+    Reads a .jsonl or .jsonl.gz file and yields lists of at most batch_rows dictionaries.
+    """
+    loads = get_json_loads(decoder)
+    batch = []
+    try:
+        with open_jsonl_file(file_path) as f:
+            for line in f:
+                batch.append(loads(line))
+                if len(batch) >= batch_rows:
+                    yield batch
+                    batch = []
+    except Exception as e:
+        logging.error(f"Failed to read file {file_path}: {e}")
+        raise RuntimeError(f"Failed to read file {file_path}: {e}")
+    if batch:
+        yield batch
+
+
+def iter_arrow_json_batches(file_path: str, batch_rows: int):
+    """
+    Reads a .jsonl or .jsonl.gz file with the streaming Arrow JSON reader and yields Arrow
+    tables of roughly batch_rows rows, built from the reader's blocks without copying.
+    """
+    batches = []
+    num_rows = 0
+    try:
+        reader = pa_json.open_json(file_path)
+        for record_batch in reader:
+            batches.append(record_batch)
+            num_rows += record_batch.num_rows
+            if num_rows >= batch_rows:
+                yield pa.Table.from_batches(batches)
+                batches = []
+                num_rows = 0
+    except Exception as e:
+        logging.error(f"Failed to read file {file_path}: {e}")
+        raise RuntimeError(f"Failed to read file {file_path}: {e}")
+    if batches:
+        yield pa.Table.from_batches(batches)
+
+
+def iter_table_batches(file_path: str, batch_rows: int, decoder="json"):
+    """
+    Reads a .jsonl or .jsonl.gz file and yields Arrow tables of about batch_rows rows
+    using the given decoder.
+    """
+    if decoder == "arrow":
+        yield from iter_arrow_json_batches(file_path, batch_rows)
+    else:
+        for batch in iter_jsonl_batches(file_path, batch_rows, decoder):
+            yield pa.Table.from_pylist(batch)
+
+
+def estimate_batch_rows(file_path: str, max_memory: int, workers: int, sample_lines=1000) -> int:
+    """
+    Estimates how many rows each of the concurrent workers can hold in a batch so that
+    the total stays under max_memory bytes, based on the average line size of the file.
+    """
+    total_bytes = 0
+    num_lines = 0
+    with open_jsonl_file(file_path) as f:
+        for line in f:
+            total_bytes += len(line)
+            num_lines += 1
+            if num_lines >= sample_lines:
+                break
+    if num_lines == 0:
+        return DEFAULT_BATCH_ROWS
+    bytes_per_row = (total_bytes / num_lines) * MEMORY_EXPANSION_FACTOR
+    return max(1, int(max_memory / (workers * bytes_per_row)))
+
+
+def normalize_table(table: pa.Table, schema: pa.Schema = None, quantize_fn=None) -> pa.Table:
+    """
+    Removes the dropped columns from a batch of parsed JSONL records and applies quantize_fn
+    to it, if given. If a schema is given, the table is reordered and cast to match it.
+    """
+    table = table.drop_columns([c for c in DROPPED_COLUMNS if c in table.column_names])
+    if quantize_fn is not None:
+        table = quantize_fn(table)
+    if schema is None:
+        return table
+    if set(table.column_names) != set(schema.names):
+        raise ValueError(
+            f"Schema mismatch between batches: {table.column_names} vs {schema.names}"
+        )
+    return table.select(schema.names).cast(schema)
+
+
+def compute_vector_stats(file_path: str, batch_rows: int, decoder="json"):
+    """
+    Computes per-dimension (minimum, maximum) of the vectors in a JSONL file, batch by batch.
+    """
+    stats = None
+    for table in iter_table_batches(file_path, batch_rows, decoder):
+        stats = update_min_max(stats, vector_column_to_numpy(table.column(VECTOR_COLUMN)))
+    return stats
+
+
+def convert_file_to_parquet_streaming(
+    input_file_path: str,
+    output_file_path: str,
+    batch_rows=DEFAULT_BATCH_ROWS,
+    decoder="json",
+    quantization="none",
+) -> tuple[int, list[str]]:
+    """
+    Converts a single JSONL file to Parquet format in a single pass, parsing batch_rows
+    records at a time and writing each batch as a Parquet row group. Returns the row count
+    and the column names written, for validation without re-reading the JSONL file.
+    Vectors are optionally stored as float16 or int8; int8 needs an extra pass over the
+    file to compute its per-dimension scale and offset.
+    """
+    writer = None
+    row_count = 0
+    quantize_fn = None
+    try:
+        if quantization == "int8":
+            scale, offset = fit_int8(compute_vector_stats(input_file_path, batch_rows, decoder))
+            quantize_fn = partial(
+                quantize_table, quantization=quantization, scale=scale, offset=offset, column=VECTOR_COLUMN
+            )
+        elif quantization != "none":
+            quantize_fn = partial(quantize_table, quantization=quantization, column=VECTOR_COLUMN)
+
+        for table in iter_table_batches(input_file_path, batch_rows, decoder):
+            table = normalize_table(table, writer.schema if writer else None, quantize_fn)
+            if writer is None:
+                writer = pq.ParquetWriter(output_file_path, table.schema)
+            writer.write_table(table, row_group_size=batch_rows)
+            row_count += table.num_rows
+        if writer is None:
+            raise ValueError(f"No records found in {input_file_path}")
+        return row_count, writer.schema.names
+    except Exception as e:
+        logging.error(f"Error converting {input_file_path} to Parquet: {e}")
+        raise RuntimeError(f"Error converting {input_file_path} to Parquet: {e}")
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def validate_parquet_metadata(
+    input_file_path: str, parquet_file_path: str, row_count: int, columns: list[str]
+) -> bool:
+    """
+    Validates a Parquet file against the row count and columns collected while converting,
+    reading only the Parquet footer.
+    """
+    metadata = pq.read_metadata(parquet_file_path)
+    parquet_columns = metadata.schema.to_arrow_schema().names
+
+    # Check schema consistency
+    if columns != parquet_columns:
+        error_message = f"Schema mismatch for {input_file_path}: JSONL columns {columns} vs Parquet columns {parquet_columns}"
+        logging.error(error_message)
+        raise ValueError(error_message)
+
+    # Check row count
+    if row_count != metadata.num_rows:
+        error_message = f"Row count mismatch for {input_file_path}: JSONL has {row_count} rows, Parquet has {metadata.num_rows} rows"
+        logging.error(error_message)
+        raise ValueError(error_message)
+
+    return True
+
+
+def convert_file_to_parquet(input_file_path: str, output_file_path: str, decoder="json") -> int:
     """
     Converts a single JSONL file to Parquet format.
     """
     try:
-        data = read_jsonl_file(input_file_path)
+        data = read_jsonl_file(input_file_path, decoder)
         df = pd.DataFrame(data)
         # contents is a placeholder field, can be dropped
         df.drop(columns=["contents"], inplace=True)
@@ -53,13 +299,15 @@ def convert_file_to_parquet(input_file_path: str, output_file_path: str) -> int:
         raise RuntimeError(f"Error converting {input_file_path} to Parquet: {e}")
 
 
-def validate_parquet_conversion(input_file_path: str, parquet_file_path: str) -> bool:
+def validate_parquet_conversion(
+    input_file_path: str, parquet_file_path: str, decoder="json"
+) -> bool:
     """
     Validates that the data in the Parquet file matches the data in the original JSONL file.
     """
     try:
         # Read original JSONL data
-        jsonl_data = read_jsonl_file(input_file_path)
+        jsonl_data = read_jsonl_file(input_file_path, decoder)
         jsonl_df = pd.DataFrame(jsonl_data)
         jsonl_df.drop(columns=["contents"], inplace=True)
 
@@ -84,23 +332,97 @@ def validate_parquet_conversion(input_file_path: str, parquet_file_path: str) ->
         raise e
 
 
-def convert_and_validate_file(input_file_path: str, output_file_path: str) -> int:
+def convert_and_validate_file(
+    input_file_path: str, output_file_path: str, decoder="json"
+) -> int:
     """
     Converts a single JSONL file to Parquet format and then validates it.
     """
-    row_count = convert_file_to_parquet(input_file_path, output_file_path)
-    validate_parquet_conversion(input_file_path, output_file_path)
+    # The Arrow reader only applies to streaming mode; fall back to line-by-line parsing
+    if decoder == "arrow":
+        decoder = "json"
+    row_count = convert_file_to_parquet(input_file_path, output_file_path, decoder)
+    validate_parquet_conversion(input_file_path, output_file_path, decoder)
     logging.info(f"Converted {input_file_path} to {output_file_path}")
     return row_count
 
 
-def convert_jsonl_to_parquet(input_dir: str, output_dir: str, overwrite=False) -> None:
+def stream_convert_and_validate_file(
+    input_file_path: str,
+    output_file_path: str,
+    batch_rows=DEFAULT_BATCH_ROWS,
+    decoder="json",
+    quantization="none",
+) -> int:
+    """
+    Converts a single JSONL file to Parquet format in streaming mode and validates it
+    against the counts and schema collected during conversion.
+    """
+    start = time.time()
+    row_count, columns = convert_file_to_parquet_streaming(
+        input_file_path, output_file_path, batch_rows, decoder, quantization
+    )
+    validate_parquet_metadata(input_file_path, output_file_path, row_count, columns)
+    elapsed = time.time() - start
+    logging.info(
+        f"Converted {input_file_path} to {output_file_path} "
+        f"({row_count} rows, {row_count / max(elapsed, 1e-9):.0f} rows/sec)"
+    )
+    return row_count
+
+
+def fingerprint_and_convert(input_file_path: str, output_file_path: str, convert_fn) -> tuple[int, dict]:
+    """
+    Fingerprints a source file and then converts it with convert_fn. The fingerprint is taken
+    first so that a source modified during conversion is picked up again on the next run.
+    """
+    fingerprint = file_fingerprint(input_file_path)
+    return convert_fn(input_file_path, output_file_path), fingerprint
+
+
+def convert_jsonl_to_parquet(
+    input_dir: str,
+    output_dir: str,
+    overwrite=False,
+    streaming=False,
+    batch_rows=DEFAULT_BATCH_ROWS,
+    max_memory=None,
+    workers=None,
+    executor="thread",
+    decoder="auto",
+    quantization="none",
+    report_path=None,
+    queries_path=None,
+    sample_size=10000,
+    num_queries=100,
+    k=10,
+    manifest_path=None,
+) -> int:
     """
     Converts all JSONL files in the input directory to Parquet format in the output directory.
+    In streaming mode, each file is converted in batches of batch_rows records; if max_memory
+    (in bytes) is given, the batch size is instead derived from it and the number of workers.
+    Files are converted concurrently by a pool of thread or process workers, and the total
+    number of rows converted is returned. Vectors can be quantized to float16 or int8 (which
+    implies streaming mode), in which case a recall report comparing inner-product top-k
+    results on a sample of the first file is written to report_path.
+
+    Converted shards are recorded in a manifest (by default next to the output directory)
+    with the size, mtime and hash of their source. Unless overwrite is set, shards whose
+    source is unchanged are skipped, and outputs of sources that no longer exist are removed.
     """
+    if executor not in EXECUTORS:
+        raise ValueError(f"Unknown executor {executor}, expected one of {list(EXECUTORS)}")
+    decoder = resolve_decoder(decoder)
+
+    if manifest_path is None:
+        manifest_path = default_manifest_path(output_dir)
+
     if overwrite and os.path.exists(output_dir):
         # Remove the existing output directory if overwrite is True
         shutil.rmtree(output_dir)
+    if overwrite and os.path.exists(manifest_path):
+        os.remove(manifest_path)
 
     # Create the output directory if it does not exist
     os.makedirs(output_dir, exist_ok=True)
@@ -109,6 +431,7 @@ def convert_jsonl_to_parquet(input_dir: str, output_dir: str, overwrite=False) -
     seen_basenames = set()
     total_files = 0
     total_rows = 0
+    converted = set()
 
     # List all files to be processed
     files_to_process = []
@@ -129,12 +452,55 @@ def convert_jsonl_to_parquet(input_dir: str, output_dir: str, overwrite=False) -
 
         seen_basenames.add(basename)
         output_file_path = os.path.join(output_dir, f"{basename}.parquet")
-        files_to_process.append((input_file_path, output_file_path))
+        files_to_process.append((os.path.abspath(input_file_path), output_file_path))
+
+    if quantization != "none":
+        streaming = True
+
+    # Skip shards converted by a previous run from unchanged sources
+    manifest = load_manifest(manifest_path, {"quantization": quantization})
+    all_files = files_to_process
+    current_keys = {os.path.basename(output_path) for _, output_path in all_files}
+    for key in list(manifest["shards"]):
+        if key not in current_keys:
+            stale_output = manifest["shards"].pop(key)["output"]
+            if os.path.isfile(stale_output):
+                os.remove(stale_output)
+            logging.info(f"Removed {stale_output}, whose source no longer exists")
+    files_to_process = [
+        (input_path, output_path)
+        for input_path, output_path in all_files
+        if not is_shard_up_to_date(manifest, os.path.basename(output_path), [input_path])
+    ]
+    skipped_files = len(all_files) - len(files_to_process)
+    if skipped_files:
+        logging.info(f"Skipping {skipped_files} up-to-date files recorded in {manifest_path}")
+    save_manifest(manifest, manifest_path)
+
+    if workers is None:
+        if executor == "process":
+            workers = os.cpu_count() or 1
+        else:
+            workers = min(32, (os.cpu_count() or 1) + 4)
+
+    if streaming:
+        if max_memory is not None and files_to_process:
+            batch_rows = estimate_batch_rows(files_to_process[0][0], max_memory, workers)
+            logging.info(f"Using {batch_rows} rows per batch to stay under {max_memory} bytes")
+        convert_fn = partial(
+            stream_convert_and_validate_file,
+            batch_rows=batch_rows,
+            decoder=decoder,
+            quantization=quantization,
+        )
+    else:
+        convert_fn = partial(convert_and_validate_file, decoder=decoder)
 
     # Process files concurrently
-    with ThreadPoolExecutor() as executor:
+    start = time.time()
+    with EXECUTORS[executor](max_workers=workers) as pool:
         future_to_file = {
-            executor.submit(convert_and_validate_file, input_path, output_path): (
+            pool.submit(fingerprint_and_convert, input_path, output_path, convert_fn): (
                 input_path,
                 output_path,
             )
@@ -143,18 +509,68 @@ def convert_jsonl_to_parquet(input_dir: str, output_dir: str, overwrite=False) -
 
         with tqdm(total=len(files_to_process), desc="Processing Files") as pbar:
             for future in as_completed(future_to_file):
-                input_path, _ = future_to_file[future]
+                input_path, output_path = future_to_file[future]
+                key = os.path.basename(output_path)
                 try:
-                    row_count = future.result()
+                    row_count, fingerprint = future.result()
                     total_files += 1
                     total_rows += row_count
+                    record_shard(manifest, key, {input_path: fingerprint}, row_count, output_path)
+                    converted.add((input_path, output_path))
                 except Exception as e:
                     logging.error(f"Failed to process {input_path}: {e}")
+                    manifest["shards"].pop(key, None)
                 finally:
+                    save_manifest(manifest, manifest_path)
                     pbar.update(1)
 
+    elapsed = time.time() - start
     logging.info(f"Total files processed: {total_files}")
     logging.info(f"Total rows processed: {total_rows}")
+    logging.info(f"Throughput: {total_rows / max(elapsed, 1e-9):.0f} rows/sec")
+
+    if skipped_files:
+        logging.info(f"Total files skipped as up to date: {skipped_files}")
+
+    # The report is computed on the first file that was converted, as failed files leave no
+    # complete output behind
+    report_pair = next((pair for pair in files_to_process if pair in converted), None)
+    if quantization != "none" and report_pair is not None:
+        if report_path is None:
+            report_path = f"{output_dir.rstrip(os.sep)}.quantization.json"
+        write_quantization_report(
+            report_pair, report_path, decoder, queries_path, sample_size, num_queries, k
+        )
+    return total_rows
+
+
+def write_quantization_report(
+    file_pair, report_path, decoder="json", queries_path=None, sample_size=10000, num_queries=100, k=10
+) -> None:
+    """
+    Writes a recall report for the quantized vectors of one converted file, comparing the
+    first sample_size original vectors against their quantized form.
+    """
+    input_file_path, output_file_path = file_pair
+    table = next(iter_table_batches(input_file_path, sample_size, decoder))
+    corpus = vector_column_to_numpy(table.column(VECTOR_COLUMN)[:sample_size])
+    quantization, scale, offset = read_quantization_metadata(output_file_path)
+    queries = read_query_vectors(queries_path, num_queries) if queries_path else None
+    report = recall_report(
+        corpus, quantization, scale, offset, queries=queries, num_queries=num_queries, k=k
+    )
+    write_recall_report(report, report_path)
+
+
+def parse_memory_size(value: str) -> int:
+    """
+    Parses a memory size such as 512M, 4G or 1048576 into a number of bytes.
+    """
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+    value = value.strip().upper().rstrip("B")
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
 
 
 if __name__ == "__main__":
@@ -173,8 +589,93 @@ if __name__ == "__main__":
         "--overwrite",
         action="store_true",
         default=False,
-        help="Overwrite the output directory.",
+        help="Overwrite the output directory instead of resuming from its manifest.",
+    )
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        default=False,
+        help="Convert in a single pass with bounded memory, writing record batches as row groups.",
+    )
+    parser.add_argument(
+        "--batch-rows",
+        type=int,
+        default=DEFAULT_BATCH_ROWS,
+        help="Number of records per batch (and Parquet row group) in streaming mode.",
+    )
+    parser.add_argument(
+        "--max-memory",
+        type=parse_memory_size,
+        default=None,
+        help="Approximate memory budget across all workers in streaming mode (e.g. 4G); overrides --batch-rows.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of files converted concurrently.",
+    )
+    parser.add_argument(
+        "--executor",
+        choices=list(EXECUTORS),
+        default="thread",
+        help="Convert files in worker threads or worker processes.",
+    )
+    parser.add_argument(
+        "--decoder",
+        choices=DECODERS,
+        default="auto",
+        help="JSON decoder; 'arrow' uses the Arrow JSON reader and requires streaming mode.",
+    )
+    parser.add_argument(
+        "--quantization",
+        choices=QUANTIZATION_TYPES,
+        default="none",
+        help="Store vectors as float16 or as int8 with per-dimension scale/offset in the schema metadata (implies --streaming).",
+    )
+    parser.add_argument(
+        "--quantization-report",
+        default=None,
+        help="Path of the quantization recall report (default: <output>.quantization.json).",
+    )
+    parser.add_argument(
+        "--quantization-queries",
+        default=None,
+        help="JSONL topics file of query vectors for the recall report (default: sampled document vectors).",
+    )
+    parser.add_argument(
+        "--quantization-sample-size",
+        type=int,
+        default=10000,
+        help="Number of document vectors searched in the recall report.",
+    )
+    parser.add_argument(
+        "--quantization-k",
+        type=int,
+        default=10,
+        help="Cutoff for top-k agreement in the recall report.",
+    )
+    parser.add_argument(
+        "--manifest",
+        default=None,
+        help="Path of the per-shard manifest used to resume conversions (default: <output>.manifest.json).",
     )
     args = parser.parse_args()
 
-    convert_jsonl_to_parquet(args.input, args.output, args.overwrite)
+    convert_jsonl_to_parquet(
+        args.input,
+        args.output,
+        args.overwrite,
+        streaming=args.streaming or args.max_memory is not None,
+        batch_rows=args.batch_rows,
+        max_memory=args.max_memory,
+        workers=args.workers,
+        executor=args.executor,
+        decoder=args.decoder,
+        quantization=args.quantization,
+        report_path=args.quantization_report,
+        queries_path=args.quantization_queries,
+        sample_size=args.quantization_sample_size,
+        k=args.quantization_k,
+        manifest_path=args.manifest,
+    )
@@ -0,0 +1,157 @@
+import os
+import json
+import hashlib
+import logging
+
+MANIFEST_VERSION = 1
+
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def default_manifest_path(output_dir: str) -> str:
+    """
+    Returns the manifest path for an output directory. The manifest is kept next to the
+    directory rather than inside it, since the Java collections read every file in it.
+    """
+    return f"{output_dir.rstrip(os.sep)}.manifest.json"
+
+
+def hash_file(file_path: str) -> str:
+    """
+    Computes the SHA-256 of a file, reading it in blocks.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_fingerprint(file_path: str) -> dict:
+    """
+    Records the size, modification time and hash of a source file.
+    """
+    stat = os.stat(file_path)
+    return {
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "sha256": hash_file(file_path),
+    }
+
+
+def is_file_unchanged(file_path: str, fingerprint: dict) -> bool:
+    """
+    Checks a source file against its recorded fingerprint. Size and modification time are
+    compared first; the file is only hashed if its size matches but its mtime does not, in
+    which case the recorded mtime is refreshed when the content turns out to be unchanged.
+    """
+    if not os.path.isfile(file_path):
+        return False
+    stat = os.stat(file_path)
+    if stat.st_size != fingerprint["size"]:
+        return False
+    if stat.st_mtime == fingerprint["mtime"]:
+        return True
+    if hash_file(file_path) != fingerprint["sha256"]:
+        return False
+    fingerprint["mtime"] = stat.st_mtime
+    return True
+
+
+def fingerprint_sources(manifest: dict, source_paths: list[str]) -> dict:
+    """
+    Fingerprints source files once for a whole conversion. A file whose size and modification
+    time match a fingerprint already recorded in the manifest reuses its hash instead of being
+    hashed again.
+    """
+    recorded = {}
+    for entry in manifest["shards"].values():
+        for path, fingerprint in entry["sources"].items():
+            recorded.setdefault(path, []).append(fingerprint)
+    sources = {}
+    for path in source_paths:
+        stat = os.stat(path)
+        sources[path] = next(
+            (dict(fingerprint) for fingerprint in recorded.get(path, [])
+             if fingerprint["size"] == stat.st_size and fingerprint["mtime"] == stat.st_mtime),
+            None,
+        ) or file_fingerprint(path)
+    return sources
+
+
+def new_manifest(options: dict) -> dict:
+    """
+    Creates an empty manifest for the given conversion options.
+    """
+    return {"version": MANIFEST_VERSION, "options": options, "shards": {}}
+
+
+def load_manifest(manifest_path: str, options: dict) -> dict:
+    """
+    Loads the manifest at manifest_path, or returns a fresh one if none exists. If it was
+    written by another version or with different conversion options, none of its shards can
+    be reused: their source fingerprints are cleared so they are all reconverted, but their
+    outputs stay listed so that outputs of removed sources can still be cleaned up.
+    """
+    if not os.path.isfile(manifest_path):
+        return new_manifest(options)
+    try:
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+    except Exception as e:
+        logging.warning(f"Ignoring unreadable manifest {manifest_path}: {e}")
+        return new_manifest(options)
+    if manifest.get("version") != MANIFEST_VERSION or manifest.get("options") != options:
+        logging.info(f"Conversion options changed since {manifest_path} was written; reconverting all shards")
+        fresh = new_manifest(options)
+        for key, entry in manifest.get("shards", {}).items():
+            fresh["shards"][key] = {"sources": {}, "rows": 0, "output": entry["output"]}
+        return fresh
+    return manifest
+
+
+def save_manifest(manifest: dict, manifest_path: str) -> None:
+    """
+    Writes the manifest atomically, so an interrupted run never leaves a truncated manifest.
+    """
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def record_shard(manifest: dict, key: str, sources: dict, rows: int, output_path: str) -> None:
+    """
+    Records a converted shard with the fingerprints of its source files.
+    """
+    manifest["shards"][key] = {"sources": sources, "rows": rows, "output": output_path}
+
+
+def is_shard_up_to_date(manifest: dict, key: str, source_paths: list[str]) -> bool:
+    """
+    Checks whether a shard was converted from the given, unchanged source files and its
+    output still exists.
+    """
+    entry = manifest["shards"].get(key)
+    if entry is None or not os.path.isfile(entry["output"]):
+        return False
+    if sorted(entry["sources"]) != sorted(source_paths):
+        return False
+    return all(is_file_unchanged(path, entry["sources"][path]) for path in source_paths)
+
+
+def is_shard_from_sources(manifest: dict, key: str, sources: dict) -> bool:
+    """
+    Checks whether a shard was converted from source files with the given fingerprints, as
+    computed by fingerprint_sources, and its output still exists.
+    """
+    entry = manifest["shards"].get(key)
+    if entry is None or not os.path.isfile(entry["output"]):
+        return False
+    if sorted(entry["sources"]) != sorted(sources):
+        return False
+    return all(
+        entry["sources"][path]["size"] == fingerprint["size"]
+        and entry["sources"][path]["sha256"] == fingerprint["sha256"]
+        for path, fingerprint in sources.items()
+    )
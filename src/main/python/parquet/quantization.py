@@ -0,0 +1,197 @@
+import gzip
+import json
+import logging
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+QUANTIZATION_TYPES = ["none", "float16", "int8"]
+
+# Key under which the quantization type and the per-dimension int8 parameters are stored
+# in the Parquet schema metadata.
+QUANTIZATION_METADATA_KEY = b"anserini.quantization"
+
+INT8_LEVELS = 255
+
+ARROW_TYPES = {"none": pa.float32(), "float16": pa.float16(), "int8": pa.int8()}
+BYTES_PER_VALUE = {"none": 4, "float16": 2, "int8": 1}
+
+
+def update_min_max(stats, vectors):
+    """
+    Updates running per-dimension (minimum, maximum) stats with a 2D array of vectors.
+    Pass None as stats for the first batch.
+    """
+    minimum = vectors.min(axis=0)
+    maximum = vectors.max(axis=0)
+    if stats is None:
+        return minimum, maximum
+    return np.minimum(stats[0], minimum), np.maximum(stats[1], maximum)
+
+
+def fit_int8(stats):
+    """
+    Computes per-dimension scale and offset for int8 scalar quantization from
+    (minimum, maximum) stats, mapping each dimension's range onto the 256 int8 levels.
+    """
+    minimum, maximum = stats
+    scale = (maximum - minimum) / INT8_LEVELS
+    # Constant dimensions would otherwise divide by zero
+    scale = np.where(scale > 0, scale, 1.0)
+    return scale.astype(np.float32), minimum.astype(np.float32)
+
+
+def quantize(vectors, quantization, scale=None, offset=None):
+    """
+    Quantizes a 2D array of vectors. For int8, a value x is stored as
+    round((x - offset) / scale) - 128.
+    """
+    if quantization == "none":
+        return vectors.astype(np.float32, copy=False)
+    if quantization == "float16":
+        return vectors.astype(np.float16)
+    if quantization == "int8":
+        codes = np.rint((vectors - offset) / scale) - 128
+        return np.clip(codes, -128, 127).astype(np.int8)
+    raise ValueError(f"Unknown quantization {quantization}, expected one of {QUANTIZATION_TYPES}")
+
+
+def dequantize(codes, quantization, scale=None, offset=None):
+    """
+    Reconstructs approximate float32 vectors from quantized codes.
+    """
+    if quantization == "int8":
+        return (codes.astype(np.float32) + 128) * scale + offset
+    return codes.astype(np.float32)
+
+
+def quantization_metadata(quantization, dimension, scale=None, offset=None):
+    """
+    Builds the Parquet schema metadata entry describing how vectors were quantized.
+    """
+    metadata = {"type": quantization, "dimension": int(dimension)}
+    if quantization == "int8":
+        metadata["scale"] = scale.tolist()
+        metadata["offset"] = offset.tolist()
+    return {QUANTIZATION_METADATA_KEY: json.dumps(metadata).encode("utf-8")}
+
+
+def read_quantization_metadata(parquet_file_path):
+    """
+    Reads the quantization metadata of a Parquet file, returning (type, scale, offset).
+    """
+    metadata = pq.read_schema(parquet_file_path).metadata or {}
+    if QUANTIZATION_METADATA_KEY not in metadata:
+        return "none", None, None
+    info = json.loads(metadata[QUANTIZATION_METADATA_KEY])
+    if info["type"] != "int8":
+        return info["type"], None, None
+    return (
+        info["type"],
+        np.asarray(info["scale"], dtype=np.float32),
+        np.asarray(info["offset"], dtype=np.float32),
+    )
+
+
+def vector_column_to_numpy(column):
+    """
+    Converts an Arrow list or fixed-size-list column of equal-length vectors to a 2D
+    numpy array, without going through Python objects.
+    """
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks()
+    values = column.flatten().to_numpy(zero_copy_only=False)
+    if len(column) == 0:
+        return values.reshape(0, 0)
+    return values.reshape(len(column), -1)
+
+
+def quantized_vector_array(vectors, quantization, scale=None, offset=None):
+    """
+    Quantizes a 2D array of vectors and wraps the codes as an Arrow FixedSizeList array.
+    """
+    codes = np.ascontiguousarray(quantize(vectors, quantization, scale, offset))
+    values = pa.array(codes.reshape(-1), type=ARROW_TYPES[quantization])
+    return pa.FixedSizeListArray.from_arrays(values, vectors.shape[1])
+
+
+def quantize_table(table, quantization, scale=None, offset=None, column="vector"):
+    """
+    Replaces the vector column of an Arrow table with its quantized form and records the
+    quantization parameters in the schema metadata.
+    """
+    vectors = vector_column_to_numpy(table.column(column))
+    array = quantized_vector_array(vectors, quantization, scale, offset)
+    table = table.set_column(table.schema.get_field_index(column), column, array)
+    return table.replace_schema_metadata(
+        quantization_metadata(quantization, vectors.shape[1], scale, offset)
+    )
+
+
+def read_query_vectors(queries_path, limit=None):
+    """
+    Reads query vectors from a JSONL topics file in the JsonStringVector format.
+    """
+    opener = gzip.open if queries_path.endswith(".gz") else open
+    queries = []
+    with opener(queries_path, "rt", encoding="utf-8") as f:
+        for line in f:
+            queries.append(json.loads(line)["vector"])
+            if limit is not None and len(queries) >= limit:
+                break
+    return np.asarray(queries, dtype=np.float32)
+
+
+def recall_report(corpus, quantization, scale=None, offset=None, queries=None,
+                  num_queries=100, k=10, seed=42):
+    """
+    Compares inner-product top-k retrieval over a corpus sample with the original and the
+    quantized-then-reconstructed vectors. If no query vectors are given, a random sample of
+    the corpus vectors is used as queries.
+    """
+    corpus = corpus.astype(np.float32, copy=False)
+    rng = np.random.default_rng(seed)
+    if queries is None:
+        queries = corpus[rng.choice(len(corpus), min(num_queries, len(corpus)), replace=False)]
+    else:
+        queries = queries[:num_queries]
+    k = min(k, len(corpus))
+
+    reconstructed = dequantize(quantize(corpus, quantization, scale, offset), quantization, scale, offset)
+    original_scores = queries @ corpus.T
+    quantized_scores = queries @ reconstructed.T
+
+    original_topk = np.argpartition(-original_scores, k - 1, axis=1)[:, :k]
+    quantized_topk = np.argpartition(-quantized_scores, k - 1, axis=1)[:, :k]
+    overlap = [len(np.intersect1d(a, b)) / k for a, b in zip(original_topk, quantized_topk)]
+    top1_agreement = np.mean(original_scores.argmax(axis=1) == quantized_scores.argmax(axis=1))
+
+    dimension = corpus.shape[1]
+    quantized_bytes = dimension * BYTES_PER_VALUE[quantization]
+    return {
+        "quantization": quantization,
+        "dimension": int(dimension),
+        "corpus_sample_size": int(len(corpus)),
+        "num_queries": int(len(queries)),
+        "k": int(k),
+        f"recall@{k}": float(np.mean(overlap)),
+        "top1_agreement": float(top1_agreement),
+        "mean_abs_score_error": float(np.mean(np.abs(original_scores - quantized_scores))),
+        "bytes_per_vector_float32": int(dimension * 4),
+        "bytes_per_vector_quantized": int(quantized_bytes),
+        "compression_ratio": float(dimension * 4 / quantized_bytes),
+    }
+
+
+def write_recall_report(report, report_path):
+    """
+    Logs the recall report and writes it as JSON.
+    """
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+    k = report["k"]
+    logging.info(
+        f"Quantization {report['quantization']}: recall@{k} {report[f'recall@{k}']:.4f}, "
+        f"top-1 agreement {report['top1_agreement']:.4f}, "
+        f"{report['compression_ratio']:.1f}x smaller vectors; report written to {report_path}"
+    )
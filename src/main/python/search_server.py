@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+#
+# Anserini: A toolkit for reproducible information retrieval research built on Lucene
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Client of a warm SearchCollection JVM for batch retrieval drivers.
+
+Instead of launching a SearchCollection JVM for every configuration, drivers
+start one io.anserini.search.SearchCollectionServer, which keeps the index
+readers it opens, and submit their SearchCollection command lines to it over
+a local socket, so that a whole sweep pays JVM warm-up and index opening once:
+
+    with SearchServer(anserini_root) as server:
+        server.search_all([search_args(command) for command in commands], parallelism)
+"""
+
+import json
+import logging
+import os
+import queue
+import re
+import shlex
+import signal
+import socket
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger('search_server')
+
+LISTENING = re.compile(r'SearchCollectionServer listening on (\S+):(\d+)')
+
+
+def search_args(command):
+    """Returns the SearchCollection arguments of a command line, i.e., everything after the
+    SearchCollection program or class, e.g. 'target/appassembler/bin/SearchCollection' or
+    'bin/run.sh io.anserini.search.SearchCollection'."""
+    tokens = shlex.split(command) if isinstance(command, str) else list(command)
+    for i, token in enumerate(tokens):
+        if token.endswith('SearchCollection'):
+            return tokens[i + 1:]
+    raise ValueError(f'Not a SearchCollection command: {command}')
+
+
+class SearchServer:
+    """A SearchCollectionServer process and a pool of connections to it, one per concurrent job."""
+
+    def __init__(self, anserini_root='', connections=4, quiet=False):
+        self.command = [os.path.join(anserini_root, 'bin/run.sh'), 'io.anserini.search.SearchCollectionServer',
+                        '-port', '0', '-connections', str(connections)] + (['-quiet'] if quiet else [])
+        self.connections = connections
+        self.process = None
+        self.address = None
+        self.idle = queue.Queue()
+        self.sockets = []
+        self.lock = threading.Lock()
+
+    def start(self):
+        # In its own process group, so that closing also stops the JVM that bin/run.sh launches
+        self.process = subprocess.Popen(self.command, stdout=subprocess.PIPE, text=True, start_new_session=True)
+        for line in self.process.stdout:
+            sys.stdout.write(line)
+            match = LISTENING.search(line)
+            if match:
+                self.address = (match.group(1), int(match.group(2)))
+                break
+        if self.address is None:
+            raise RuntimeError(f'SearchCollectionServer exited with code {self.process.wait()}')
+        # Keep forwarding the output of the searches, or the server would block on a full pipe
+        threading.Thread(target=self._forward_output, daemon=True).start()
+        return self
+
+    def _forward_output(self):
+        for line in self.process.stdout:
+            sys.stdout.write(line)
+
+    def _acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            connection = socket.create_connection(self.address)
+            with self.lock:
+                self.sockets.append(connection)
+            return connection.makefile('rw', encoding='utf-8')
+
+    def search(self, args):
+        """Runs one SearchCollection job, given its arguments (a list, or a string of arguments).
+        Like the command, a failed job does not raise: the error is logged and returned.
+
+        @Return: the response of the server, {'status': 'ok', 'millis': ...} or {'status': 'error', 'error': ...}
+        """
+        args = shlex.split(args) if isinstance(args, str) else [arg for arg in args if arg != '']
+        f = self._acquire()
+        f.write(json.dumps({'args': args}) + '\n')
+        f.flush()
+        line = f.readline()
+        if not line:
+            raise RuntimeError('SearchCollectionServer closed the connection')
+        self.idle.put(f)
+        response = json.loads(line)
+        if response['status'] != 'ok':
+            logger.error(f'Search failed: {response["error"]} ({" ".join(args)})')
+        return response
+
+    def search_all(self, jobs, parallelism=None):
+        """Runs SearchCollection jobs over up to parallelism concurrent connections, at most as many as
+        the server serves concurrently, since connections are kept open for later jobs.
+
+        @Return: the responses of the server, in the order of the jobs
+        """
+        jobs = list(jobs)
+        if not jobs:
+            return []
+        with ThreadPoolExecutor(min(parallelism or self.connections, self.connections, len(jobs))) as executor:
+            return list(executor.map(self.search, jobs))
+
+    def close(self):
+        with self.lock:
+            for connection in self.sockets:
+                connection.close()
+            self.sockets = []
+            self.idle = queue.Queue()
+        if self.process is not None:
+            os.killpg(self.process.pid, signal.SIGTERM)
+            self.process.wait()
+            self.process = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
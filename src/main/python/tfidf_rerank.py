@@ -0,0 +1,449 @@
+# -*- coding: utf-8 -*-
+#
+# Anserini: A toolkit for reproducible information retrieval research built on Lucene
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Shared helpers of the tf.idf document classifier rerankers, ecir2019_ccrf
+and trec2018/h2oloo-core.
+
+tf.idf matrices are built from the TF_IDF docvector tarballs dumped by
+IndexUtils, parsing documents in worker processes and accumulating their
+nonzeros in typed COO arrays. Docid and vocabulary indices are kept in
+string stores, and matrices in .npy buffers, both memory-mapped so that
+the processes reading them share their pages. Topics are trained and
+scored in a pool of worker processes, and the rerank runs of all the
+interpolation weights are written in a single pass over the topics.
+"""
+
+import collections
+import logging
+import mmap
+import os
+import tarfile
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import scipy.sparse
+import sklearn.preprocessing
+
+
+class SparseMatrixBuilder(object):
+    """
+    Accumulates the nonzeros of a sparse matrix in growable int32/int32/float32 COO arrays,
+    i.e., 12 bytes per nonzero instead of a dict entry keyed by a tuple.
+    """
+    def __init__(self, capacity=1 << 20):
+        self._rows = np.empty(capacity, dtype=np.int32)
+        self._cols = np.empty(capacity, dtype=np.int32)
+        self._values = np.empty(capacity, dtype=np.float32)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _reserve(self, n):
+        capacity = len(self._rows)
+        if self._size + n <= capacity:
+            return
+        while capacity < self._size + n:
+            capacity *= 2
+        for name in ['_rows', '_cols', '_values']:
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+
+    def add(self, rows, cols, values):
+        n = len(cols)
+        self._reserve(n)
+        end = self._size + n
+        self._rows[self._size:end] = rows
+        self._cols[self._size:end] = cols
+        self._values[self._size:end] = values
+        self._size = end
+
+    def to_csr(self, shape, normalize=True):
+        rows = self._rows[:self._size]
+        cols = self._cols[:self._size]
+        values = self._values[:self._size]
+
+        # lexsort is stable, so keeping the last entry of each (row, col) run means that later
+        # entries replace earlier ones, as they did with the dict
+        order = np.lexsort((cols, rows))
+        rows, cols, values = rows[order], cols[order], values[order]
+        last = np.ones(len(rows), dtype=bool)
+        last[:-1] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+        rows, cols, values = rows[last], cols[last], values[last]
+
+        indptr = np.zeros(shape[0] + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=shape[0]), out=indptr[1:])
+        matrix = scipy.sparse.csr_matrix((values, cols, indptr), shape=shape, dtype=np.float32)
+        return sklearn.preprocessing.normalize(matrix, norm='l2') if normalize else matrix
+
+
+def iter_tfidf_chunks(filepath, chunk_size):
+    """
+    Reads the documents of a TF_IDF docvector tarball in chunks of (docid, raw bytes) pairs.
+    Decompression is sequential, so only parsing is left to the workers.
+    """
+    chunk = []
+    with tarfile.open(filepath, 'r:gz') as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            chunk.append((member.name.strip(), tar.extractfile(member).read()))
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def parse_tfidf_chunk(chunk, docids, is_alpha):
+    """
+    Parses a chunk of documents, keeping those in docids. Terms are interned per chunk so that
+    each distinct term is sent back to the parent process once. Returns the number of documents
+    read, the docids kept, the number of terms of each kept document, the distinct terms in order
+    of first occurrence, and the term index and tf.idf of every posting.
+    """
+    kept, counts, term_ids, values = [], [], [], []
+    terms = {}
+    for docid, data in chunk:
+        if docid not in docids:
+            continue
+        count = 0
+        for line in data.decode('utf-8').splitlines():
+            if not line or line[:4] == '<DOC':
+                continue
+            word, tfidf = line.strip().split(' ')
+            if is_alpha and not word.isalpha():
+                continue
+            term_ids.append(terms.setdefault(word, len(terms)))
+            values.append(float(tfidf))
+            count += 1
+        kept.append(docid)
+        counts.append(count)
+    return (len(chunk), kept, np.array(counts, dtype=np.int64), list(terms),
+            np.array(term_ids, dtype=np.int32), np.array(values, dtype=np.float32))
+
+
+_worker_args = None
+
+
+def _init_tfidf_worker(docids, is_alpha):
+    global _worker_args
+    _worker_args = (docids, is_alpha)
+
+
+def _parse_tfidf_chunk(chunk):
+    return parse_tfidf_chunk(chunk, *_worker_args)
+
+
+def _iter_parsed_chunks(filepath, docids, is_alpha, executor, workers, chunk_size):
+    chunks = iter_tfidf_chunks(filepath, chunk_size)
+    if executor is None:
+        for chunk in chunks:
+            yield parse_tfidf_chunk(chunk, docids, is_alpha)
+        return
+
+    # Results are consumed in submission order, with a bounded number of chunks in flight
+    pending = collections.deque()
+    for chunk in chunks:
+        pending.append(executor.submit(_parse_tfidf_chunk, chunk))
+        if len(pending) >= 2 * workers:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def build_tfidf_matrix(tfidf_files, docid_idx_dict, vocab_idx_dict=None, is_alpha=False,
+                       workers=1, chunk_size=1000):
+    """
+    Builds the L2-normalized tf.idf CSR matrix of the documents in docid_idx_dict, which maps
+    docids to row indices, from TF_IDF docvector tarballs, parsing documents in worker processes.
+    If vocab_idx_dict is None, a vocabulary dict is built from the documents, with indices
+    assigned in order of first occurrence; otherwise, terms missing from the given vocabulary,
+    a dict or a StringStore, are dropped. Returns the matrix and the vocabulary.
+    """
+    grow_vocab = vocab_idx_dict is None
+    if grow_vocab:
+        vocab_idx_dict = {}
+    num_vocabs = len(vocab_idx_dict)
+    docids = set(docid_idx_dict)
+
+    builder = SparseMatrixBuilder()
+    executor = None
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_tfidf_worker,
+                                       initargs=(docids, is_alpha))
+    try:
+        for tfidf_file in tfidf_files:
+            logging.info(f'Building tf.idf matrix for {tfidf_file} with {workers} workers...')
+            count = 0
+            for num_read, kept, counts, terms, term_ids, values in _iter_parsed_chunks(
+                    tfidf_file, docids, is_alpha, executor, workers, chunk_size):
+                # Map chunk-local term indices to vocabulary indices, -1 for terms not in the vocabulary
+                mapping = np.empty(len(terms), dtype=np.int32)
+                for i, word in enumerate(terms):
+                    vocab_idx = vocab_idx_dict.get(word, -1)
+                    if vocab_idx == -1 and grow_vocab:
+                        vocab_idx = num_vocabs
+                        vocab_idx_dict[word] = vocab_idx
+                        num_vocabs += 1
+                    mapping[i] = vocab_idx
+
+                doc_idx = np.array([docid_idx_dict[docid] for docid in kept], dtype=np.int32)
+                rows = np.repeat(doc_idx, counts)
+                cols = mapping[term_ids]
+                found = cols >= 0
+                builder.add(rows[found], cols[found], values[found])
+
+                if (count + num_read) // 100000 > count // 100000:
+                    logging.info(f'{count + num_read} documents processed...')
+                count += num_read
+            logging.info(f'Finished {tfidf_file}, {count} documents in total.')
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    num_docs = len(docid_idx_dict)
+    logging.info(f'Converting {len(builder)} nonzeros into a {num_docs} x {num_vocabs} sparse matrix...')
+    return builder.to_csr((num_docs, num_vocabs)), vocab_idx_dict
+
+
+STRING_STORE_MAGIC = b'STRSTORE'
+STRING_STORE_VERSION = 1
+
+
+def _string_slot(data, mask):
+    # crc32 rather than hash(), which is salted differently in every process
+    return zlib.crc32(data) & mask
+
+
+def write_string_store(path, strings):
+    """
+    Writes strings to a StringStore file, in which the index of each string is its position in
+    strings. The file holds a header, the offsets of the strings, an open-addressing hash table
+    of string indices (-1 for empty slots) and the concatenated UTF-8 encoded strings.
+    """
+    encoded = [s.encode('utf-8') for s in strings]
+    num_strings = len(encoded)
+    table_size = 1
+    while table_size < 2 * num_strings:
+        table_size *= 2
+    mask = table_size - 1
+
+    offsets = np.zeros(num_strings + 1, dtype=np.int64)
+    np.cumsum([len(data) for data in encoded], out=offsets[1:])
+    table = [-1] * table_size
+    for idx, data in enumerate(encoded):
+        slot = _string_slot(data, mask)
+        while table[slot] != -1:
+            if encoded[table[slot]] == data:
+                raise ValueError(f'Duplicate string {strings[idx]} in string store')
+            slot = (slot + 1) & mask
+        table[slot] = idx
+
+    header = np.array([STRING_STORE_VERSION, num_strings, table_size], dtype=np.int64)
+    with open(path, 'wb') as f:
+        f.write(STRING_STORE_MAGIC)
+        f.write(header.tobytes())
+        f.write(offsets.tobytes())
+        f.write(np.array(table, dtype=np.int32).tobytes())
+        for data in encoded:
+            f.write(data)
+
+
+class StringStore(object):
+    """
+    Read-only mapping between strings and their indices, memory-mapped from a file written by
+    write_string_store. Lookups go through the file in both directions without loading it, so
+    opening a store takes constant time and its pages are shared between processes.
+    """
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(STRING_STORE_MAGIC)] != STRING_STORE_MAGIC:
+            raise ValueError(f'{path} is not a string store')
+        offset = len(STRING_STORE_MAGIC)
+        version, num_strings, table_size = np.frombuffer(self._mmap, dtype=np.int64, count=3, offset=offset)
+        if version != STRING_STORE_VERSION:
+            raise ValueError(f'Unsupported string store version {version} in {path}')
+        offset += 3 * 8
+        self._offsets = np.frombuffer(self._mmap, dtype=np.int64, count=num_strings + 1, offset=offset)
+        offset += (num_strings + 1) * 8
+        self._table = np.frombuffer(self._mmap, dtype=np.int32, count=table_size, offset=offset)
+        self._data_start = offset + table_size * 4
+        self._mask = int(table_size) - 1
+        self._size = int(num_strings)
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        for idx in range(self._size):
+            yield self.string(idx)
+
+    def __contains__(self, string):
+        return self.get(string, -1) != -1
+
+    def __getitem__(self, string):
+        idx = self.get(string, -1)
+        if idx == -1:
+            raise KeyError(string)
+        return idx
+
+    def _bytes(self, idx):
+        start = self._data_start + int(self._offsets[idx])
+        end = self._data_start + int(self._offsets[idx + 1])
+        return self._mmap[start:end]
+
+    def get(self, string, default=None):
+        """
+        Returns the index of a string, or default if it is not in the store.
+        """
+        if not isinstance(string, str):
+            return default
+        data = string.encode('utf-8')
+        slot = _string_slot(data, self._mask)
+        while True:
+            idx = int(self._table[slot])
+            if idx == -1:
+                return default
+            if self._bytes(idx) == data:
+                return idx
+            slot = (slot + 1) & self._mask
+
+    def string(self, idx):
+        """
+        Returns the string with the given index.
+        """
+        if not 0 <= idx < self._size:
+            raise IndexError(idx)
+        return self._bytes(idx).decode('utf-8')
+
+    def close(self):
+        # Views of the mapped buffer must be released before it can be closed
+        self._offsets = self._table = None
+        self._mmap.close()
+        self._file.close()
+
+
+def save_csr_buffers(matrix, folder):
+    """
+    Writes the arrays of a CSR matrix as uncompressed .npy files, which, unlike .npz archives,
+    can be memory-mapped.
+    """
+    os.makedirs(folder, exist_ok=True)
+    for name in ['data', 'indices', 'indptr']:
+        np.save(os.path.join(folder, f'{name}.npy'), getattr(matrix, name))
+    np.save(os.path.join(folder, 'shape.npy'), np.array(matrix.shape, dtype=np.int64))
+
+
+def load_csr_buffers(folder):
+    """
+    Memory-maps a CSR matrix written by save_csr_buffers without copying it, so that all the
+    processes mapping it share the same pages.
+    """
+    arrays = tuple(np.load(os.path.join(folder, f'{name}.npy'), mmap_mode='r')
+                   for name in ['data', 'indices', 'indptr'])
+    shape = tuple(np.load(os.path.join(folder, 'shape.npy')).tolist())
+    return scipy.sparse.csr_matrix(arrays, shape=shape, copy=False)
+
+
+def _timed_call(fn, topic, args):
+    start_time = time.time()
+    result = fn(topic, *args)
+    return result, time.time() - start_time
+
+
+def map_topics(fn, tasks, workers=1, initializer=None, initargs=()):
+    """
+    Calls fn(topic, *args) for each (topic, args) in tasks, in a pool of worker processes
+    set up with initializer(*initargs), and logs the time taken by each topic. Results are
+    returned in the order of tasks, whatever the order in which the topics finish, along with
+    a dict of the time taken by each topic.
+    """
+    start_time = time.time()
+    results, timings = [None] * len(tasks), {}
+    if workers <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for i, (topic, args) in enumerate(tasks):
+            results[i], elapsed = _timed_call(fn, topic, args)
+            timings[topic] = elapsed
+            logging.info(f'Topic {topic} finished in {elapsed:.2f} seconds')
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as executor:
+            futures = {executor.submit(_timed_call, fn, topic, args): i for i, (topic, args) in enumerate(tasks)}
+            for future in as_completed(futures):
+                i = futures[future]
+                results[i], elapsed = future.result()
+                timings[tasks[i][0]] = elapsed
+                logging.info(f'Topic {tasks[i][0]} finished in {elapsed:.2f} seconds')
+
+    wall_time = time.time() - start_time
+    if timings:
+        slowest = max(timings, key=timings.get)
+        logging.info(f'{len(tasks)} topics finished in {wall_time:.2f} seconds with {workers} workers, '
+                     f'{sum(timings.values()):.2f} seconds in total, slowest topic {slowest} '
+                     f'({timings[slowest]:.2f} seconds)')
+    return results, {topic: timings[topic] for topic, _ in tasks}
+
+
+def top_k_indices(scores, k):
+    """
+    Returns the indices of the k highest scores in descending order of score, breaking ties by
+    index as a stable sort would, after selecting them with argpartition.
+    """
+    if len(scores) <= k:
+        return np.argsort(-scores, kind='stable')
+    kth = -np.partition(-scores, k - 1)[k - 1]
+    above = np.flatnonzero(scores > kth)
+    ties = np.flatnonzero(scores == kth)[:k - len(above)]
+    candidates = np.concatenate([above, ties])
+    return candidates[np.lexsort((candidates, -scores[candidates]))]
+
+
+def interpolate_scores(old_score, new_score, alphas):
+    """
+    Min-max normalizes the base and classifier scores of a topic once and mixes them for all
+    alphas at once, returning a matrix with one row of scores per alpha.
+    """
+    old_score = np.asarray(old_score, dtype=np.float64)
+    new_score = np.asarray(new_score, dtype=np.float64)
+    old_score = (old_score - old_score.min()) / (old_score.max() - old_score.min())
+    new_score = (new_score - new_score.min()) / (new_score.max() - new_score.min())
+    alphas = np.asarray(alphas, dtype=np.float64)[:, None]
+    return old_score * (1 - alphas) + new_score * alphas
+
+
+def write_reranked_runs(test_doc_score, alphas, output, limit, tag):
+    """
+    Writes the rerank_{alpha}.txt run of every alpha in a single pass over the topics, keeping
+    the top limit documents of each topic.
+    """
+    files = [open(os.path.join(output, f'rerank_{alpha}.txt'), 'w', buffering=1 << 20) for alpha in alphas]
+    try:
+        for topic in test_doc_score:
+            docid, _, old_score, new_score = test_doc_score[topic]
+            for f, score in zip(files, interpolate_scores(old_score, new_score, alphas)):
+                top = top_k_indices(score, limit)
+                f.write(''.join(f'{topic} Q0 {docid[i]} {rank} {s} h2oloo_{tag}\n'
+                                for rank, (i, s) in enumerate(zip(top.tolist(), score[top].tolist()), 1)))
+    finally:
+        for f in files:
+            f.close()
@@ -18,11 +18,23 @@ import math
 import os
 import re
 import subprocess
+import sys
 
 import pyserini.util
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from search_server import search_args
 
-def perform_runs(round_number, indexes):
+
+def run_search(command, server=None):
+    # Run a SearchCollection command, or submit it to a warm SearchServer if one is given
+    if server is None:
+        os.system(command)
+    else:
+        server.search(search_args(command))
+
+
+def perform_runs(round_number, indexes, server=None):
     base_topics = f'tools/topics-and-qrels/topics.covid-round{round_number}.xml'
     udel_topics = f'tools/topics-and-qrels/topics.covid-round{round_number}-udel.xml'
 
@@ -35,21 +47,21 @@ def perform_runs(round_number, indexes):
 
     abstract_index = indexes[0]
     abstract_prefix = f'anserini.covid-r{round_number}.abstract'
-    os.system(f'bin/run.sh io.anserini.search.SearchCollection -index {abstract_index} ' +
-              f'-topicReader Covid -topics {base_topics} -topicField query+question ' +
-              f'-removeDuplicates -bm25 -hits 10000 ' +
-              f'-output runs/{abstract_prefix}.qq.bm25.txt -runtag {abstract_prefix}.qq.bm25.txt')
-
-    os.system(f'bin/run.sh io.anserini.search.SearchCollection -index {abstract_index} ' +
-              f'-topicReader Covid -topics {udel_topics} -topicField query ' +
-              f'-removeDuplicates -bm25 -hits 10000 ' +
-              f'-output runs/{abstract_prefix}.qdel.bm25.txt -runtag {abstract_prefix}.qdel.bm25.txt')
-
-    os.system(f'bin/run.sh io.anserini.search.SearchCollection -index {abstract_index} ' +
-              f'-topicReader Covid -topics {udel_topics} -topicField query -removeDuplicates ' +
-              f'-bm25 -rm3 -rm3.fbTerms 100 -hits 10000 ' +
-              f'-rf.qrels {cumulative_qrels} ' +
-              f'-output runs/{abstract_prefix}.qdel.bm25+rm3Rf.txt -runtag {abstract_prefix}.qdel.bm25+rm3Rf.txt')
+    run_search(f'bin/run.sh io.anserini.search.SearchCollection -index {abstract_index} ' +
+               f'-topicReader Covid -topics {base_topics} -topicField query+question ' +
+               f'-removeDuplicates -bm25 -hits 10000 ' +
+               f'-output runs/{abstract_prefix}.qq.bm25.txt -runtag {abstract_prefix}.qq.bm25.txt', server)
+
+    run_search(f'bin/run.sh io.anserini.search.SearchCollection -index {abstract_index} ' +
+               f'-topicReader Covid -topics {udel_topics} -topicField query ' +
+               f'-removeDuplicates -bm25 -hits 10000 ' +
+               f'-output runs/{abstract_prefix}.qdel.bm25.txt -runtag {abstract_prefix}.qdel.bm25.txt', server)
+
+    run_search(f'bin/run.sh io.anserini.search.SearchCollection -index {abstract_index} ' +
+               f'-topicReader Covid -topics {udel_topics} -topicField query -removeDuplicates ' +
+               f'-bm25 -rm3 -rm3.fbTerms 100 -hits 10000 ' +
+               f'-rf.qrels {cumulative_qrels} ' +
+               f'-output runs/{abstract_prefix}.qdel.bm25+rm3Rf.txt -runtag {abstract_prefix}.qdel.bm25+rm3Rf.txt', server)
 
     print('')
     print('## Running on full-text index...')
@@ -57,15 +69,15 @@ def perform_runs(round_number, indexes):
 
     full_text_index = indexes[1]
     full_text_prefix = f'anserini.covid-r{round_number}.full-text'
-    os.system(f'bin/run.sh io.anserini.search.SearchCollection -index {full_text_index} ' +
-              f'-topicReader Covid -topics {base_topics} -topicField query+question ' +
-              f'-removeDuplicates -bm25 -hits 10000 ' +
-              f'-output runs/{full_text_prefix}.qq.bm25.txt -runtag {full_text_prefix}.qq.bm25.txt')
+    run_search(f'bin/run.sh io.anserini.search.SearchCollection -index {full_text_index} ' +
+               f'-topicReader Covid -topics {base_topics} -topicField query+question ' +
+               f'-removeDuplicates -bm25 -hits 10000 ' +
+               f'-output runs/{full_text_prefix}.qq.bm25.txt -runtag {full_text_prefix}.qq.bm25.txt', server)
 
-    os.system(f'bin/run.sh io.anserini.search.SearchCollection -index {full_text_index} ' +
-              f'-topicReader Covid -topics {udel_topics} -topicField query ' +
-              f'-removeDuplicates -bm25 -hits 10000 ' +
-              f'-output runs/{full_text_prefix}.qdel.bm25.txt -runtag {full_text_prefix}.qdel.bm25.txt')
+    run_search(f'bin/run.sh io.anserini.search.SearchCollection -index {full_text_index} ' +
+               f'-topicReader Covid -topics {udel_topics} -topicField query ' +
+               f'-removeDuplicates -bm25 -hits 10000 ' +
+               f'-output runs/{full_text_prefix}.qdel.bm25.txt -runtag {full_text_prefix}.qdel.bm25.txt', server)
 
     print('')
     print('## Running on paragraph index...')
@@ -73,15 +85,15 @@ def perform_runs(round_number, indexes):
 
     paragraph_index = indexes[2]
     paragraph_prefix = f'anserini.covid-r{round_number}.paragraph'
-    os.system(f'bin/run.sh io.anserini.search.SearchCollection -index {paragraph_index} ' +
-              f'-topicReader Covid -topics {base_topics} -topicField query+question ' +
-              f'-selectMaxPassage -bm25 -hits 50000 ' +
-              f'-output runs/{paragraph_prefix}.qq.bm25.txt -runtag {paragraph_prefix}.qq.bm25.txt')
-
-    os.system(f'bin/run.sh io.anserini.search.SearchCollection -index {paragraph_index} ' +
-              f'-topicReader Covid -topics {udel_topics} -topicField query ' +
-              f'-selectMaxPassage -bm25 -hits 50000 ' +
-              f'-output runs/{paragraph_prefix}.qdel.bm25.txt -runtag {paragraph_prefix}.qdel.bm25.txt')
+    run_search(f'bin/run.sh io.anserini.search.SearchCollection -index {paragraph_index} ' +
+               f'-topicReader Covid -topics {base_topics} -topicField query+question ' +
+               f'-selectMaxPassage -bm25 -hits 50000 ' +
+               f'-output runs/{paragraph_prefix}.qq.bm25.txt -runtag {paragraph_prefix}.qq.bm25.txt', server)
+
+    run_search(f'bin/run.sh io.anserini.search.SearchCollection -index {paragraph_index} ' +
+               f'-topicReader Covid -topics {udel_topics} -topicField query ' +
+               f'-selectMaxPassage -bm25 -hits 50000 ' +
+               f'-output runs/{paragraph_prefix}.qdel.bm25.txt -runtag {paragraph_prefix}.qdel.bm25.txt', server)
 
 
 def perform_fusion(round_number, run_checksums, check_md5=True):
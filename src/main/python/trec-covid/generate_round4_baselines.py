@@ -16,12 +16,16 @@
 
 """Perform Anserini baseline runs for TREC-COVID Round 4."""
 
+import argparse
 import os
 import sys
 
 from covid_baseline_tools import perform_runs, perform_fusion, prepare_final_submissions, \
     evaluate_runs, verify_stored_runs
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from search_server import SearchServer
+
 # This makes errors more readable,
 # see https://stackoverflow.com/questions/27674602/hide-traceback-unless-a-debug-flag-is-set
 sys.tracebacklimit = 0
@@ -85,7 +89,7 @@ stored_runs = {
 }
 
 
-def main():
+def main(args):
     if not (os.path.isdir(indexes[0]) and os.path.isdir(indexes[1]) and os.path.isdir(indexes[2])):
         print('Required indexes do not exist. Please download first.')
 
@@ -97,7 +101,11 @@ def main():
     check_md5_flag = False
 
     verify_stored_runs(stored_runs)
-    perform_runs(4, indexes)
+    if args.server:
+        with SearchServer(connections=1) as server:
+            perform_runs(4, indexes, server)
+    else:
+        perform_runs(4, indexes)
     perform_fusion(4, cumulative_runs, check_md5=check_md5_flag)
     prepare_final_submissions(4, final_runs, check_md5=check_md5_flag)
 
@@ -187,4 +195,8 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--server', action='store_true',
+                        help='Run the baselines on a single warm SearchCollectionServer instead of a JVM each.')
+
+    main(parser.parse_args())
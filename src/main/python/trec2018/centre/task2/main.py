@@ -19,10 +19,14 @@ from multiprocessing import Pool
 import os
 import argparse
 import subprocess
+import sys
 from operator import itemgetter
 import csv
 import matplotlib.pyplot as plt
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..'))
+from search_server import SearchServer, search_args
+
 parallelism=1
 def batch_everything(all_params, func):
     if len(all_params) == 0:
@@ -35,7 +39,7 @@ def atom_retrieval(retrieval_command):
     if not os.path.exists(output_fn):
         subprocess.call(retrieval_command, shell=True)
 
-def batch_retrieval(anserini_root, results_root, target_index, expansion_index, dry_run = False):
+def batch_retrieval(anserini_root, results_root, target_index, expansion_index, dry_run = False, server = None):
     all_commands = []
     for model in ['bm25', 'ql', 'f2log']:
         for beta in range(1, 31):
@@ -54,6 +58,9 @@ def batch_retrieval(anserini_root, results_root, target_index, expansion_index,
     print('='*10+'Starting Batch Retrieval'+'='*10)
     if dry_run:
         print('\n'.join(all_commands))
+    elif server is not None:
+        server.search_all([search_args(command) for command in all_commands
+                           if not os.path.exists(command.split(' ')[-1])], parallelism)
     else:
         batch_everything(all_commands, atom_retrieval)
 
@@ -138,13 +145,20 @@ if __name__ == '__main__':
     parser.add_argument('--dry_run', dest='dry_run', action='store_true',
                         help='output the commands but not actually running them. this is useful for development/debug')
     parser.add_argument('--n', dest='parallelism', type=int, default=4, help='number of parallel threads for retrieval/eval')
+    parser.add_argument('--server', dest='server', action='store_true',
+                        help='submit the retrievals to a single warm SearchCollectionServer instead of launching a JVM for each one')
     args = parser.parse_args()
 
     parallelism = args.parallelism
     if not os.path.exists(args.results_root):
         os.makedirs(args.results_root)
     if args.retrieval:
-        batch_retrieval(args.anserini_root, args.results_root, args.target_index, args.expansion_index, args.dry_run)
+        if args.server and not args.dry_run:
+            with SearchServer(args.anserini_root, parallelism) as server:
+                batch_retrieval(args.anserini_root, args.results_root, args.target_index, args.expansion_index,
+                                args.dry_run, server)
+        else:
+            batch_retrieval(args.anserini_root, args.results_root, args.target_index, args.expansion_index, args.dry_run)
     if args.eval:
         batch_eval(args.anserini_root, args.results_root, args.eval_output, args.dry_run)
     if args.plot:
@@ -1,14 +1,13 @@
 import argparse
 import logging
 import os
-import pickle
+import sys
 import time
 
-from scipy.sparse import save_npz, csr_matrix
-import sklearn.preprocessing
-import numpy as np
+from scipy.sparse import save_npz
 
-from utils import TfidfTgzReader
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from tfidf_rerank import StringStore, build_tfidf_matrix, write_string_store
 
 topic_list = [
     '321', '336', '341',
@@ -25,10 +24,7 @@ def read_vocab(path):
 
   """
   logging.info("loading vocabulary dictionary...")
-  with open(path, 'rb') as f:
-    vocab = pickle.load(f)
-
-  return vocab
+  return StringStore(path)
 
 def build_docid_idx_dict(rank_file):
   """
@@ -42,7 +38,6 @@ def build_docid_idx_dict(rank_file):
       topic, _, docid, _, _, _ = line.split(' ')
       if topic in topic_list and docid not in docid_idx_dict:
         docid_idx_dict[docid] = cur_idx
-        docid_idx_dict[cur_idx] = docid
         cur_idx += 1
   return docid_idx_dict
 
@@ -51,45 +46,18 @@ def write_docid_idx_dict(docid_idx_dict, filename):
 
   """
   logging.info(f"writting docid-idx-dict to {filename}")
-  with open(filename, 'wb') as f:
-    pickle.dump(docid_idx_dict, f)
+  write_string_store(filename, list(docid_idx_dict))
 
 
-def build_tfidf_matrix(tfidf_raw, docid_idx_dict, vocab_idx_dict):
+def build_test_matrix(tfidf_raw, docid_idx_dict, vocab_idx_dict, workers):
   """
 
   """
-  num_docs, num_vocabs = len(docid_idx_dict) // 2, len(vocab_idx_dict) // 2
+  num_docs, num_vocabs = len(docid_idx_dict), len(vocab_idx_dict)
   logging.info(f'start building tfidf sparse matrix with {num_docs} docs and {num_vocabs} vocabs...')
-
-  tfidf_dict = {}
-  count = 0
-
-  reader = TfidfTgzReader(tfidf_raw)
-  while reader.hasnextdoc():
-    docid = reader.getnextdoc().strip()
-    count += 1
-    if count % 100000 == 0:
-      logging.info(f'{count} files have been processed...')
-    
-    if docid not in docid_idx_dict:
-      reader.skipdoc()
-      continue
-      
-    doc_idx = docid_idx_dict[docid]
-    while reader.hasnexttfidf():
-      word, tfidf = reader.getnexttfidf()
-      if word in vocab_idx_dict:
-        vocab_idx = vocab_idx_dict[word]
-        tfidf_dict[(doc_idx, vocab_idx)] = float(tfidf)
-
-  logging.info(f'finish building tfidf dict, {count} files in total.')
-
-  indices = tuple(zip(*tfidf_dict.keys()))
-  values = list(tfidf_dict.values())
-  tfidf_sp = csr_matrix((values, indices), shape=(num_docs, num_vocabs), dtype=np.float32)
+  tfidf_sp, _ = build_tfidf_matrix([tfidf_raw], docid_idx_dict, vocab_idx_dict, workers=workers)
   logging.info(f'finish building tfidf sparse matrix.')
-  return sklearn.preprocessing.normalize(tfidf_sp, norm='l2')
+  return tfidf_sp
 
 def _safe_mkdir(path):
   if not os.path.exists(path):
@@ -106,9 +74,11 @@ if __name__ == '__main__':
   parser.add_argument("--rank-file", '-r', type=str, 
     help='path to qrels_file', required=True)
   parser.add_argument("--vocab-folder", '-v', type=str, 
-    help='folder contains vocab-idx-dict.pkl', required=True)
+    help='folder contains vocab-idx.strings', required=True)
   parser.add_argument("--output-folder", '-o', type=str, 
     help='output folder to dump training data for each topic', required=True)
+  parser.add_argument("--workers", '-w', type=int, default=os.cpu_count(),
+    help='number of processes parsing the tfidf file')
 
   args = parser.parse_args()
 
@@ -121,8 +91,8 @@ if __name__ == '__main__':
   assert os.path.isdir(vocab_folder)
 
   # constant
-  vocab_path = os.path.join(vocab_folder, 'vocab-idx-dict.pkl')
-  out_docid_idx_file = os.path.join(out_folder, 'test-docid-idx-dict.pkl')
+  vocab_path = os.path.join(vocab_folder, 'vocab-idx.strings')
+  out_docid_idx_file = os.path.join(out_folder, 'test-docid-idx.strings')
   out_feature_file = os.path.join(out_folder, 'test.npz')
 
   # preprocessing
@@ -133,7 +103,7 @@ if __name__ == '__main__':
 
   vocab_dict = read_vocab(vocab_path)
   docid_idx_dict = build_docid_idx_dict(rank_file)
-  tfidf_sp = build_tfidf_matrix(tfidf_raw, docid_idx_dict, vocab_dict)
+  tfidf_sp = build_test_matrix(tfidf_raw, docid_idx_dict, vocab_dict, args.workers)
 
   write_docid_idx_dict(docid_idx_dict, out_docid_idx_file)
 
@@ -1,14 +1,14 @@
 import argparse
 import logging
 import os
-import pickle
+import sys
 import time
 
 from scipy.sparse import save_npz, csr_matrix
-import sklearn.preprocessing
 import numpy as np
 
-from utils import TfidfTgzReader
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from tfidf_rerank import build_tfidf_matrix, write_string_store
 
 topic_list = [
     '321', '336', '341',
@@ -41,7 +41,6 @@ def build_docid_idx_and_label(rank_file_folder):
           if docid not in docid_idx_dict:
             # build docid_idx_dict
             docid_idx_dict[docid] = cur_idx
-            docid_idx_dict[cur_idx] = docid
             cur_idx += 1
 
           # update topic_docid_label
@@ -51,70 +50,30 @@ def build_docid_idx_and_label(rank_file_folder):
   logging.info(f'{cur_idx} files found in total.')
   return docid_idx_dict, topic_docid_label
 
-def build_vocab_tfidf_dict(tfidf_raw_folder, docid_idx_dict, isalpha):
+def build_vocab_tfidf_matrix(tfidf_raw_folder, docid_idx_dict, isalpha, workers):
   """
 
   """
-  logging.info('start building vocab tfidf dict')
-  vocab_idx_dict, tfidf_dict = {}, {}
-  cur_idx = 0
-
-  tfidf_raw_files = os.listdir(tfidf_raw_folder)
-  for tfidf_raw in tfidf_raw_files:
-    logging.info(f'start building vocab tfidf dict for {tfidf_raw}')
-    count = 0
-
-    reader = TfidfTgzReader(os.path.join(tfidf_raw_folder, tfidf_raw))
-    while reader.hasnextdoc():
-      docid = reader.getnextdoc().strip()
-      count += 1
-      if count % 100000 == 0:
-        logging.info(f'{count} files have been processed...')
-      
-      if docid not in docid_idx_dict:
-        # reader.skipdoc()
-        continue
-        
-      doc_idx = docid_idx_dict[docid]
-      while reader.hasnexttfidf():
-        word, tfidf = reader.getnexttfidf()
-        if not isalpha or word.isalpha():
-          if word not in vocab_idx_dict:
-            vocab_idx_dict[word] = cur_idx
-            vocab_idx_dict[cur_idx] = word
-            cur_idx += 1
-          tfidf_dict[(doc_idx, vocab_idx_dict[word])] = float(tfidf)
-
-  logging.info(f'finish building vocab tfidf dict, {cur_idx} words in total.')
-  return vocab_idx_dict, tfidf_dict
+  logging.info('start building vocab and tfidf matrix')
+  tfidf_raw_files = [os.path.join(tfidf_raw_folder, f) for f in os.listdir(tfidf_raw_folder)]
+  tfidf_sp, vocab_idx_dict = build_tfidf_matrix(tfidf_raw_files, docid_idx_dict,
+    is_alpha=isalpha, workers=workers)
+  logging.info(f'finish building vocab and tfidf matrix, {len(vocab_idx_dict)} words in total.')
+  return vocab_idx_dict, tfidf_sp
 
 
 def write_docid_idx_dict(docid_idx_dict, filename):
   """
   """
   logging.info(f"writting docid-idx-dict to {filename}")
-  with open(filename, 'wb') as f:
-    pickle.dump(docid_idx_dict, f)
+  write_string_store(filename, list(docid_idx_dict))
     
 def write_vocab_idx_dict(vocab_idx_dict, filename):
   """
   """
   logging.info(f"writting vocab-idx-dict to {filename}")
-  with open(filename, 'wb') as f:
-    pickle.dump(vocab_idx_dict, f)
-
-
-def to_sparse(tfidf_dict, docid_idx_dict, vocab_idx_dict):
-  """
-
-  """
-  logging.info("converting tfidf info to sparse matrix")
-  num_docs, num_vocabs = len(docid_idx_dict) // 2, len(vocab_idx_dict) // 2
-  indices = tuple(zip(*tfidf_dict.keys()))
-  values = list(tfidf_dict.values())
-  tfidf_sp = csr_matrix((values, indices), shape=(num_docs, num_vocabs), dtype=np.float32)
+  write_string_store(filename, list(vocab_idx_dict))
 
-  return sklearn.preprocessing.normalize(tfidf_sp, norm='l2')
 
 def write_train_feature(topic_docid_label: dict,
             feature_matrix: csr_matrix,
@@ -147,6 +106,8 @@ if __name__ == '__main__':
     help='output folder to dump every file into', required=True)
   parser.add_argument("--only-alpha", '-a', type=bool, default=False,
     help='whether to only keep alpha word')
+  parser.add_argument("--workers", '-w', type=int, default=os.cpu_count(),
+    help='number of processes parsing the tfidf files')
 
   # argument parse
   args = parser.parse_args()
@@ -154,6 +115,7 @@ if __name__ == '__main__':
   rank_file_folder = args.qrels_folder
   out_folder = args.output_folder
   isalpha = args.only_alpha
+  workers = args.workers
 
   # sanity check
   assert os.path.isdir(tfidf_file_folder)
@@ -161,8 +123,8 @@ if __name__ == '__main__':
 
   # constants
   out_feature_folder = os.path.join(out_folder, 'features')
-  out_docid_idx_file = os.path.join(out_folder, 'train-docid-idx-dict.pkl')
-  out_vocab_idx_file = os.path.join(out_folder, 'vocab-idx-dict.pkl')
+  out_docid_idx_file = os.path.join(out_folder, 'train-docid-idx.strings')
+  out_vocab_idx_file = os.path.join(out_folder, 'vocab-idx.strings')
 
   # preprocessing
   _safe_mkdir(out_folder)
@@ -172,12 +134,11 @@ if __name__ == '__main__':
   logging.info(f'start building train...')
 
   docid_idx_dict, topic_docid_label = build_docid_idx_and_label(rank_file_folder)
-  vocab_idx_dict, tfidf_dict = build_vocab_tfidf_dict(tfidf_file_folder, docid_idx_dict, isalpha)
+  vocab_idx_dict, tfidf_sp = build_vocab_tfidf_matrix(tfidf_file_folder, docid_idx_dict, isalpha, workers)
 
   write_docid_idx_dict(docid_idx_dict, out_docid_idx_file)
   write_vocab_idx_dict(vocab_idx_dict, out_vocab_idx_file)
 
-  tfidf_sp = to_sparse(tfidf_dict, docid_idx_dict, vocab_idx_dict)
   write_train_feature(topic_docid_label, tfidf_sp, docid_idx_dict, out_path=out_feature_folder)
 
   logging.info(f'build train finished in {time.time() - start_time} seconds')
@@ -1,5 +1,7 @@
 import argparse
 
+from utils import FUSION_METHODS, fuse_runs
+
 topic_list = [
     '321', '336', '341',
     '347', '350', '362',
@@ -19,8 +21,7 @@ def submission(origin_file, runtag, output_file):
       data[-1] = runtag
       fout.write(' '.join(data) + '\n')
 
-def ensemble(folder, ratio, num_ensemble, runtag, output):
-  ensemble_dict = {}
+def ensemble(folder, ratio, num_ensemble, runtag, output, method='sum', weights=None, rrf_k=60):
   if num_ensemble == 1:
     clf_list = ['LR2']
   elif num_ensemble == 3:
@@ -30,22 +31,8 @@ def ensemble(folder, ratio, num_ensemble, runtag, output):
   else:
     return
 
-  for clf in clf_list:
-    with open('{}/{}/rerank_{}.txt'.format(folder, clf, ratio), 'r') as f:
-      for line in f:
-        data = line.split()
-        topic, docid, score = data[0], data[2], float(data[4])
-        if topic not in ensemble_dict:
-          ensemble_dict[topic] = {}
-        if docid not in ensemble_dict[topic]:
-          ensemble_dict[topic][docid] = 0
-        ensemble_dict[topic][docid] += score
-
-  with open(output, 'w') as f:
-    for topic in ensemble_dict:
-      for rank, (docid, score) in enumerate(sorted(ensemble_dict[topic].items(),
-                                                   key=lambda x: -x[1])):
-        f.write('{} Q0 {} {} {} {}\n'.format(topic, docid, rank+1, score, runtag))
+  run_files = ['{}/{}/rerank_{}.txt'.format(folder, clf, ratio) for clf in clf_list]
+  fuse_runs(run_files, output, runtag, method, weights, rrf_k)
 
 if __name__ == '__main__':
   parser = argparse.ArgumentParser()
@@ -59,6 +46,13 @@ if __name__ == '__main__':
                       help='number of ensemble classifiers, '
                       'choose from 1, 3, and 7. 1 for LR2, 3 for LR2+SVM+LGB, '
                       '7 for all classifiers', required=True)
+  parser.add_argument("--method", type=str, default='sum', choices=FUSION_METHODS,
+                      help='fusion method: sum of scores, CombSUM or CombMNZ of min-max '
+                      'normalized scores, or reciprocal rank fusion')
+  parser.add_argument("--weights", type=float, nargs='+', default=None,
+                      help='weight of each ensemble classifier, in the order listed by --ensemble')
+  parser.add_argument("--rrf-k", type=int, default=60,
+                      help='rank constant of reciprocal rank fusion')
   parser.add_argument("--runtag", type=str,
                       help='submission runtag', required=True)
   parser.add_argument("--output", type=str,
@@ -67,6 +61,9 @@ if __name__ == '__main__':
   args = parser.parse_args()
   if args.ensemble not in [1,3,7]:
     raise ValueError('Unsupported number of ensemble classifiers. Must choose from 1, 3, and 7.')
+  if args.weights is not None and len(args.weights) != args.ensemble:
+    raise ValueError(f'Expected {args.ensemble} weights, one per ensemble classifier.')
   
-  ensemble(args.clf_folder, args.ratio, args.ensemble, args.runtag, args.output)
+  ensemble(args.clf_folder, args.ratio, args.ensemble, args.runtag, args.output,
+           args.method, args.weights, args.rrf_k)
   submission(args.rank_file, args.runtag, args.output)
@@ -0,0 +1,54 @@
+import os
+import tempfile
+import unittest
+
+from utils import fuse_runs
+
+def write_run(path, topics):
+  with open(path, 'w') as f:
+    for topic in topics:
+      for rank, docid in enumerate(['d1', 'd2', 'd3'], 1):
+        f.write(f'{topic} Q0 {topic}-{docid} {rank} {10 - rank} run\n')
+
+class TestFuseRuns(unittest.TestCase):
+  def setUp(self):
+    self.folder = tempfile.TemporaryDirectory()
+    self.output = os.path.join(self.folder.name, 'fused.txt')
+
+  def tearDown(self):
+    self.folder.cleanup()
+
+  def run_files(self, *topic_orders):
+    paths = []
+    for i, topics in enumerate(topic_orders):
+      paths.append(os.path.join(self.folder.name, f'run{i}.txt'))
+      write_run(paths[-1], topics)
+    return paths
+
+  def fused_topics(self):
+    with open(self.output) as f:
+      topics = [line.split()[0] for line in f]
+    return [topic for i, topic in enumerate(topics) if i == 0 or topics[i - 1] != topic]
+
+  def test_same_order(self):
+    fuse_runs(self.run_files(['1', '2', '3'], ['1', '2', '3']), self.output, 'fused')
+    self.assertEqual(self.fused_topics(), ['1', '2', '3'])
+
+  def test_missing_topic(self):
+    fuse_runs(self.run_files(['1', '2', '3'], ['1', '3']), self.output, 'fused')
+    self.assertEqual(self.fused_topics(), ['1', '2', '3'])
+
+  def test_missing_topic_in_first_run(self):
+    fuse_runs(self.run_files(['1', '3'], ['1', '2', '3']), self.output, 'fused')
+    self.assertEqual(self.fused_topics(), ['1', '2', '3'])
+    fuse_runs(self.run_files(['9', '10'], ['2', '9'], ['2', '10', '11']), self.output, 'fused')
+    self.assertEqual(self.fused_topics(), ['2', '9', '10', '11'])
+
+  def test_different_order(self):
+    for topic_orders in [(['1', '2'], ['2', '1']), (['1', '2', '3'], ['3', '2']), (['1', '2'], ['1', '2', '1'])]:
+      with self.assertRaises(ValueError):
+        fuse_runs(self.run_files(*topic_orders), self.output, 'fused')
+      self.assertEqual(sorted(os.listdir(self.folder.name)), [f'run{i}.txt' for i in range(len(topic_orders))])
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,7 +1,9 @@
 import argparse
+import json
 import logging
 import os
-import pickle
+import sys
+import tempfile
 import time
 
 import numpy as np
@@ -11,6 +13,9 @@ from sklearn.externals import joblib
 from sklearn.ensemble import RandomForestClassifier
 import lightgbm as lgb
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from tfidf_rerank import StringStore, load_csr_buffers, map_topics, save_csr_buffers, write_reranked_runs
+
 topic_list = [
     '321', '336', '341',
     '347', '350', '362',
@@ -44,9 +49,7 @@ def load_docid_idx(path):
 
   """
   logging.info('loading docid idx dict...')
-  with open(path, 'rb') as f:
-    docid_idx_dict = pickle.load(f)
-  return docid_idx_dict
+  return StringStore(path)
 
 
 def generate_test_score(rank_file, docid_idx_dict):
@@ -79,34 +82,12 @@ def generate_test_score(rank_file, docid_idx_dict):
 
   return score_dict
 
-def rerank(test_doc_score, alpha, output, limit, tag):
+def rerank(test_doc_score, alphas, output, limit, tag):
   """
 
   """
-  def interpolate(old_score, new_score):
-    s_min, s_max = min(old_score), max(old_score)
-    old_score = (old_score - s_min) / (s_max - s_min)
-
-    s_min, s_max = min(new_score), max(new_score)
-    new_score = (new_score - s_min) / (s_max - s_min)
-
-    score = old_score * (1 - alpha) + new_score * alpha
-    return score
-  
-  filename = f'rerank_{alpha}.txt'
-  with open(os.path.join(output, filename), 'w') as f:
-    logging.info(f'dump file for alpha = {alpha}...') 
-    for topic in test_doc_score:
-      docid, _, old_score, new_score = test_doc_score[topic]
-      score = interpolate(np.array(old_score), new_score)
-      sorted_score = sorted(list(zip(docid, score)), key=lambda x: -x[1])
-      
-      rank = 1
-      for docid, score in sorted_score:
-        f.write(f'{topic} Q0 {docid} {rank} {score} h2oloo_{tag}\n')
-        rank += 1
-        if rank > limit:
-          break
+  logging.info(f'dump files for alpha = {", ".join(str(alpha) for alpha in alphas)}...')
+  write_reranked_runs(test_doc_score, alphas, output, limit, tag)
 
 
 def evaluate_topic(X_train, y_train, X_test, classifier):
@@ -180,6 +161,19 @@ def evaluate_topic(X_train, y_train, X_test, classifier):
   
   return y_test
 
+def _init_topic_worker(test_buffers_folder, feature_folder):
+  global worker_test_data, worker_train_feature_folder
+  worker_test_data = load_csr_buffers(test_buffers_folder)
+  worker_train_feature_folder = feature_folder
+
+def classify_topic(topic, doc_idx, classifier):
+  """
+
+  """
+  X_train, y_train = load_train(topic, worker_train_feature_folder)
+  X_test = worker_test_data[doc_idx]
+  return evaluate_topic(X_train, y_train, X_test, classifier)
+
 def _safe_mkdir(path):
   if not os.path.exists(path):
     os.makedirs(path)
@@ -202,6 +196,8 @@ if __name__ == '__main__':
     help='output folder to write rerank file', required=True)
   parser.add_argument("--limit", '-l', type=int,
     help='the number of hits to write in file', default=10000)
+  parser.add_argument("--workers", '-w', type=int, default=os.cpu_count(),
+    help='the number of topics to train and test concurrently')
   
 
   # argument parse
@@ -212,6 +208,7 @@ if __name__ == '__main__':
   clf = args.classifier
   output_folder = args.output_folder
   limit = args.limit
+  workers = args.workers
 
   # sanity check
   assert os.path.isdir(train_folder)
@@ -220,7 +217,7 @@ if __name__ == '__main__':
   # constants
   train_feature_folder = os.path.join(train_folder, 'features')
   test_feature_path = os.path.join(test_folder, 'test.npz')
-  test_docid_idx_path = os.path.join(test_folder, 'test-docid-idx-dict.pkl')
+  test_docid_idx_path = os.path.join(test_folder, 'test-docid-idx.strings')
 
   # preprocessing
   test_docid_idx_dict = load_docid_idx(test_docid_idx_path)
@@ -230,19 +227,21 @@ if __name__ == '__main__':
   _safe_mkdir(output_folder)
   
   # pipeline from here
-  logging.info(f'start training using {clf} as classifier...')
+  logging.info(f'start training using {clf} as classifier with {workers} workers...')
 
-  for topic in topic_list:
-    X_train, y_train = load_train(topic, train_feature_folder)
-    _, doc_idx, _ = test_doc_score[topic]
-    X_test = test_data[doc_idx]
+  # workers memory-map the test matrix instead of each getting a copy of it
+  with tempfile.TemporaryDirectory(dir=output_folder) as test_buffers_folder:
+    save_csr_buffers(test_data, test_buffers_folder)
+    tasks = [(topic, (test_doc_score[topic][1], clf)) for topic in topic_list]
+    y_tests, timings = map_topics(classify_topic, tasks, workers, _init_topic_worker,
+      (test_buffers_folder, train_feature_folder))
 
-    logging.info(f'Train and test on topic {topic}')
-    y_test = evaluate_topic(X_train, y_train, X_test, clf)
-    
+  for topic, y_test in zip(topic_list, y_tests):
     test_doc_score[topic].append(y_test)
-     
-  for alpha in [0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1]:
-    rerank(test_doc_score, alpha, output_folder, limit, clf)
+
+  with open(os.path.join(output_folder, f'topic-times-{clf}.json'), 'w') as f:
+    json.dump(timings, f, indent=2)
+
+  rerank(test_doc_score, [0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1], output_folder, limit, clf)
 
   logging.info(f'train with {clf} finished in {time.time() - start_time} seconds')
@@ -1,5 +1,9 @@
+import itertools
+import os
 import tarfile
 
+import numpy as np
+
 class TfidfTxtReader(object):
   """
 
@@ -81,4 +85,96 @@ class TfidfTgzReader(object):
     return True
 
   def getnexttfidf(self):
-    return self._curtfidf
\ No newline at end of file
+    return self._curtfidf
+
+
+FUSION_METHODS = ['sum', 'combsum', 'combmnz', 'rrf']
+
+
+def iter_run_topics(path):
+  """
+  Reads a run file one topic at a time, yielding (topic, docids, scores, ranks) for each block
+  of consecutive lines of the same topic.
+  """
+  with open(path, 'r') as f:
+    for topic, lines in itertools.groupby((line.split() for line in f), key=lambda data: data[0]):
+      lines = list(lines)
+      yield (topic, [data[2] for data in lines],
+          np.array([float(data[4]) for data in lines]), np.array([int(data[3]) for data in lines]))
+
+
+def fuse_topic(blocks, method='sum', rrf_k=60):
+  """
+  Fuses the (weight, docids, scores, ranks) results of one topic from several runs. Docids are
+  interned in order of first appearance and contributions are accumulated in arrays indexed by
+  them: raw scores for sum, min-max normalized scores for combsum and combmnz (which is then
+  multiplied by the number of runs retrieving each document), and 1 / (rrf_k + rank) for rrf,
+  each multiplied by the weight of its run. Returns the docids and their fused scores.
+  """
+  doc_index = {}
+  positions = [np.fromiter((doc_index.setdefault(docid, len(doc_index)) for docid in docids),
+      dtype=np.int64, count=len(docids)) for _, docids, _, _ in blocks]
+  fused = np.zeros(len(doc_index))
+  hits = np.zeros(len(doc_index), dtype=np.int64)
+
+  for (weight, _, scores, ranks), idx in zip(blocks, positions):
+    if method == 'rrf':
+      contribution = 1.0 / (rrf_k + ranks)
+    elif method in ['combsum', 'combmnz']:
+      s_min, s_max = scores.min(), scores.max()
+      contribution = (scores - s_min) / (s_max - s_min) if s_max > s_min else np.ones(len(scores))
+    elif method == 'sum':
+      contribution = scores
+    else:
+      raise ValueError(f'Unsupported fusion method {method}, expected one of {FUSION_METHODS}')
+    np.add.at(fused, idx, contribution * weight)
+    np.add.at(hits, idx, 1)
+
+  if method == 'combmnz':
+    fused *= hits
+  return list(doc_index), fused
+
+
+def topic_key(topic):
+  """
+  Orders topics by number, before any non-numeric topics in string order.
+  """
+  return (0, int(topic), topic) if topic.isdigit() else (1, 0, topic)
+
+
+def fuse_runs(run_files, output, runtag, method='sum', weights=None, rrf_k=60):
+  """
+  Fuses run files topic by topic in a streaming k-way merge, so that only one topic of each run
+  is held in memory. The runs are expected to list their topics in ascending topic_key order, as
+  the rerank files do; each step fuses the smallest topic at the head of any run, so a topic
+  missing from some runs, including the first, is fused from the others. Documents of each topic
+  are written by descending fused score, ties keeping their order of first appearance. Raises a
+  ValueError if a run lists its topics out of order or more than once, in which case no output
+  is written.
+  """
+  weights = [1.0] * len(run_files) if weights is None else weights
+  iterators = [iter_run_topics(path) for path in run_files]
+  heads = [next(iterator, None) for iterator in iterators]
+
+  tmp_output = f'{output}.tmp'
+  try:
+    with open(tmp_output, 'w', buffering=1 << 20) as f:
+      while any(head is not None for head in heads):
+        topic = min((head[0] for head in heads if head is not None), key=topic_key)
+        blocks = []
+        for i, head in enumerate(heads):
+          if head is not None and head[0] == topic:
+            blocks.append((weights[i],) + head[1:])
+            heads[i] = next(iterators[i], None)
+            if heads[i] is not None and topic_key(heads[i][0]) <= topic_key(topic):
+              raise ValueError(f'Topic {heads[i][0]} of {run_files[i]} is out of order, '
+                  f'runs must list their topics once each and in ascending order')
+
+        docids, scores = fuse_topic(blocks, method, rrf_k)
+        order = np.argsort(-scores, kind='stable')
+        f.write(''.join(f'{topic} Q0 {docids[i]} {rank} {score} {runtag}\n'
+            for rank, (i, score) in enumerate(zip(order.tolist(), scores[order].tolist()), 1)))
+    os.replace(tmp_output, output)
+  finally:
+    if os.path.exists(tmp_output):
+      os.remove(tmp_output)
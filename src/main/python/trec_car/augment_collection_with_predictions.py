@@ -14,57 +14,163 @@
 # limitations under the License.
 #
 
+import argparse
+import io
 import json
 import os
-import argparse
+import time
+from multiprocessing import Pool
+
 from trec_car_classes import *
+from trec_car_classes import _item_end
+from trec_car_toc import scan_ranges
+
+BLOCK_SIZE = 1 << 20
+
+
+def count_lines(path):
+    """
+    Count the lines of a file, block by block.
+    """
+    num_lines = 0
+    last = b'\n'
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+            num_lines += block.count(b'\n')
+            last = block[-1:]
+    # A last line without newline
+    return num_lines + (last != b'\n')
+
+
+def open_at_line(path, line):
+    """
+    Open a text file at the start of a line, counting newlines block by block instead of
+    reading the lines before it.
+    """
+    f = open(path, 'rb')
+    position = 0
+    while line > 0:
+        block = f.read(BLOCK_SIZE)
+        if not block:
+            break
+        count = block.count(b'\n')
+        if count < line:
+            line -= count
+            position += len(block)
+            continue
+        index = -1
+        for _ in range(line):
+            index = block.index(b'\n', index + 1)
+        position += index + 1
+        break
+    f.seek(position)
+    return io.TextIOWrapper(f, encoding='utf-8')
+
+
+def augment_range(task):
+    """
+    Augment the paragraphs of a byte range of the collection, starting at a record boundary,
+    with their predictions, into the shards of the range.
+
+    @Return: (number of docs, number of shards, seconds)
+    """
+    range_index, first, end, first_doc, args = task
+    start = time.time()
+    with open(args.collection_path, 'rb') as f:
+        buf = open_mmap(f)
+    predictions_file = open_at_line(args.predictions, first_doc * args.stride)
+    ids_file = open_at_line(args.ids, first_doc) if args.ids else None
+
+    offset = first
+    i = 0
+    file_index = 0
+    while offset < end:
+        record_end = _item_end(buf, offset)
+        para_obj = LazyParagraph(buf, offset, record_end)
+        offset = record_end
+
+        # Start writting to a new file whent the current one reached its maximum capacity.
+        if i % args.max_docs_per_file == 0:
+            if i > 0:
+                output_jsonl_file.close()
+            output_path = os.path.join(args.output_folder, 'docs{:02d}_{:02d}.json'.format(range_index, file_index))
+            output_jsonl_file = open(output_path, 'w')
+            file_index += 1
+
+        doc_id = para_obj.para_id
+        if ids_file is not None:
+            expected_id = ids_file.readline().strip()
+            if expected_id != doc_id:
+                raise ValueError('Paragraph {} of the collection is {}, but its predictions are of {}'.format(
+                    first_doc + i, doc_id, expected_id))
+
+        para_txt = [elem.text if isinstance(elem, ParaText)
+                    else elem.anchor_text
+                    for elem in para_obj.bodies]
+
+        doc_text = ' '.join(para_txt)
+        doc_text = doc_text.replace('\n', ' ')
+        doc_text = ' '.join(doc_text.split())
+
+        if not doc_text:
+            doc_text = 'dummy document.'
+
+        # Reads from predictions and merge then to the original doc text.
+        pred_text = []
+        for _ in range(args.stride):
+            line = predictions_file.readline()
+            if not line:
+                raise ValueError('Predictions file ends before the predictions of paragraph {} ({})'.format(
+                    first_doc + i, doc_id))
+            pred_text.append(line.strip())
+        pred_text = ' '.join(pred_text)
+        pred_text = pred_text.replace(' / ', ' ')
+        text = (doc_text + ' ') * args.original_copies + pred_text
+
+        output_dict = {'id': doc_id, 'contents': text}
+        output_jsonl_file.write(json.dumps(output_dict) + '\n')
+        i += 1
+
+    if i > 0:
+        output_jsonl_file.close()
+    predictions_file.close()
+    if ids_file is not None:
+        ids_file.close()
+    return i, file_index, time.time() - start
 
 
 def convert_collection(args):
     print('Converting collection...')
-
-    predictions_file = open(args.predictions)
-    file_index = 0
-    with open(args.collection_path, 'rb') as f:
-
-        for i, para_obj in enumerate(iter_paragraphs(f)):
-
-            # Start writting to a new file whent the current one reached its maximum capacity. 
-            if i % args.max_docs_per_file == 0:
-                if i > 0:
-                    output_jsonl_file.close()
-                output_path = os.path.join(args.output_folder, 'docs{:02d}.json'.format(file_index))
-                output_jsonl_file = open(output_path, 'w')
-                file_index += 1
-
-            doc_id = para_obj.para_id
-            para_txt = [elem.text if isinstance(elem, ParaText)
-                        else elem.anchor_text
-                        for elem in para_obj.bodies]
-
-            doc_text = ' '.join(para_txt)
-            doc_text = doc_text.replace('\n', ' ')
-            doc_text = ' '.join(doc_text.split())
-
-            if not doc_text:
-                doc_text = 'dummy document.'
-
-            # Reads from predictions and merge then to the original doc text. 
-            pred_text = []
-            for _ in range(args.stride):
-                pred_text.append(predictions_file.readline().strip())
-            pred_text = ' '.join(pred_text)
-            pred_text = pred_text.replace(' / ', ' ')
-            text = (doc_text + ' ') * args.original_copies + pred_text
-      
-            output_dict = {'id': doc_id, 'contents': text}
-            output_jsonl_file.write(json.dumps(output_dict) + '\n')
-
-            if i % 100000 == 0:
-                print('Converted {} docs in {} files'.format(i, file_index))
-
-    output_jsonl_file.close()
-    predictions_file.close()
+    start = time.time()
+    with Pool(args.workers) as pool:
+        # Split the collection into ranges starting at record boundaries, and count their paragraphs
+        ranges = scan_ranges(args.collection_path, 'paragraphs', None, args.workers, pool)
+        num_docs = sum(count for _, count, _ in ranges)
+        print('Found {} paragraphs in {} ranges'.format(num_docs, len(ranges)))
+
+        # The stride must match the predictions exactly, or every expansion would be shifted.
+        num_lines = count_lines(args.predictions)
+        if num_lines != num_docs * args.stride:
+            raise ValueError('{} has {} lines, but {} paragraphs with a stride of {} need {}'.format(
+                args.predictions, num_lines, num_docs, args.stride, num_docs * args.stride))
+        if args.ids:
+            num_ids = count_lines(args.ids)
+            if num_ids != num_docs:
+                raise ValueError('{} has {} ids, but the collection has {} paragraphs'.format(
+                    args.ids, num_ids, num_docs))
+
+        tasks = []
+        first_doc = 0
+        for range_index, (first, count, end) in enumerate(ranges):
+            tasks.append((range_index, first, end, first_doc, args))
+            first_doc += count
+
+        converted = 0
+        for count, num_files, seconds in pool.imap_unordered(augment_range, tasks):
+            converted += count
+            print('Converted {} docs in {} files in {:.1f}s, {} of {} docs'.format(
+                count, num_files, seconds, converted, num_docs))
+    print('Converted {} docs in {:.1f}s'.format(converted, time.time() - start))
 
 
 if __name__ == '__main__':
@@ -80,6 +186,11 @@ if __name__ == '__main__':
                         help='Maximum number of documents in each jsonl file.')
     parser.add_argument('--original-copies', default=1, type=int,
                         help='Number of copies of the original document to duplicate.')
+    parser.add_argument('--ids', default=None,
+                        help='Optional file of the paragraph ids the predictions were generated for, one per line, ' +
+                             'to check that every paragraph gets its own predictions.')
+    parser.add_argument('--workers', default=os.cpu_count(), type=int,
+                        help='Number of worker processes, each converting a range of the collection.')
     args = parser.parse_args()
 
     if not os.path.exists(args.output_folder):
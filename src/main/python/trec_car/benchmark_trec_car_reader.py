@@ -0,0 +1,133 @@
+#
+# Pyserini: Python interface to the Anserini IR toolkit built on Lucene
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import argparse
+import multiprocessing
+import os
+import random
+import resource
+import tempfile
+import time
+from urllib.parse import quote
+
+import cbor
+
+from trec_car_classes import iter_paragraphs, iter_paragraphs_lazy
+
+READERS = {
+    'eager': iter_paragraphs,
+    'lazy': iter_paragraphs_lazy,
+}
+
+WORDS = ['retrieval', 'lucene', 'paragraph', 'wikipedia', 'section', 'anchor', 'query', 'index',
+         'café', 'naïve', 'document', 'collection', 'the', 'of', 'and', 'in']
+
+
+def generate_synthetic_paragraphs(path, num_paragraphs, seed=42):
+    """
+    Writes a TREC CAR paragraphs file of random paragraphs mixing plain text and links.
+    """
+    rng = random.Random(seed)
+    with open(path, 'wb') as f:
+        f.write(cbor.dumps(['CAR', [2], []]))
+        # Variable-length list of paragraphs, as in the TREC CAR dumps
+        f.write(b'\x9f')
+        for i in range(num_paragraphs):
+            bodies = []
+            for _ in range(rng.randint(1, 12)):
+                text = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 30)))
+                if rng.random() < 0.3:
+                    page = rng.choice(WORDS).title()
+                    section = [rng.choice(WORDS)] if rng.random() < 0.2 else []
+                    bodies.append([1, [0, page, section, ('enwiki:' + quote(page)).encode('ascii'), text]])
+                else:
+                    bodies.append([0, text + ' '])
+            f.write(cbor.dumps([0, ('%040x' % rng.getrandbits(160)).encode('ascii'), bodies]))
+        f.write(b'\xff')
+
+
+def file_rss():
+    """
+    Resident file-backed memory in kilobytes, which includes the pages of a memory-mapped file (Linux only).
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('RssFile:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def scan(reader, path, fields, keep):
+    """
+    Reads every paragraph of a file, accessing the given fields, in a fresh process so that
+    its peak RSS is the one of the reader.
+    """
+    kept = []
+    start = time.time()
+    with open(path, 'rb') as f:
+        for paragraph in READERS[reader](f):
+            paragraph.para_id
+            if fields == 'text':
+                paragraph.get_text()
+            if keep:
+                kept.append(paragraph)
+    elapsed = time.time() - start
+    # Kilobytes on Linux
+    return elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, file_rss()
+
+
+def benchmark(args):
+    """
+    Scans the same synthetic paragraphs file with each reader and reports paragraphs/sec and peak RSS.
+    The file-backed part of the RSS is reported apart, as the pages of the file mapped by the lazy
+    reader are resident but can be reclaimed at any time.
+    """
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'paragraphs.cbor')
+        generate_synthetic_paragraphs(path, args.paragraphs)
+        size = os.path.getsize(path)
+
+        results = []
+        for reader in args.readers:
+            for fields in args.fields:
+                with context.Pool(1) as pool:
+                    elapsed, max_rss, mapped_rss = pool.apply(scan, (reader, path, fields, args.keep))
+                results.append((reader, fields, elapsed, max_rss, mapped_rss))
+
+    print(f'{args.paragraphs} paragraphs, {size / 2 ** 20:.1f} MB, keep={args.keep}')
+    print(f"{'reader':>8} {'fields':>8} {'seconds':>10} {'paras/sec':>12} {'peak RSS MB':>12} {'file RSS MB':>12}")
+    for reader, fields, elapsed, max_rss, mapped_rss in results:
+        print(f'{reader:>8} {fields:>8} {elapsed:>10.2f} {args.paragraphs / elapsed:>12.0f} '
+              f'{max_rss / 1024:>12.1f} {mapped_rss / 1024:>12.1f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark the eager and lazy TREC CAR paragraph readers on a synthetic paragraphs file.')
+    parser.add_argument('--paragraphs', type=int, default=200000, help='Number of synthetic paragraphs.')
+    parser.add_argument('--readers', nargs='+', choices=list(READERS), default=list(READERS),
+                        help='Readers to benchmark.')
+    parser.add_argument('--fields', nargs='+', choices=['id', 'text'], default=['id', 'text'],
+                        help='Fields accessed for each paragraph: the id only, or the id and the text.')
+    parser.add_argument('--keep', action='store_true', default=False,
+                        help='Keep every paragraph in memory, as when loading a collection.')
+    args = parser.parse_args()
+
+    benchmark(args)
@@ -4,6 +4,8 @@
 from __future__ import print_function
 import cbor
 import itertools
+import mmap
+import os
 import typing
 
 PageId = str
@@ -37,6 +39,8 @@ class Page(object):
 
        Metadata about the page
     """
+    __slots__ = ('page_name', 'page_id', 'skeleton', 'child_sections', 'page_type', 'page_meta')
+
     def __init__(self, page_name, page_id, skeleton, page_type, page_meta):
         self.page_name = page_name
         self.page_id = page_id
@@ -117,6 +121,8 @@ class PageType(object):
     * :class:`DisambiguationPage`
     * :class:`RedirectPage`
     """
+    __slots__ = ()
+
     @staticmethod
     def from_cbor(cbor):
         typetag = cbor[0]
@@ -132,16 +138,22 @@ class PageType(object):
 
 class ArticlePage(PageType):
     ''
+    __slots__ = ()
+
     def __init__(self):
         pass
     def __str__(self): return "ArticlePage"
 
 class CategoryPage(PageType):
+    __slots__ = ()
+
     def __init__(self):
         pass
     def __str__(self): return "CategoryPage"
 
 class DisambiguationPage(PageType):
+    __slots__ = ()
+
     def __init__(self):
         pass
     def __str__(self): return "Disambiguation Page"
@@ -154,6 +166,8 @@ class RedirectPage(PageType):
 
        The target of the redirect.
     """
+    __slots__ = ('targetPage',)
+
     def __init__(self, targetPage):
         self.targetPage = targetPage
     def __str__(self):
@@ -206,6 +220,9 @@ class PageMetadata(object):
 
         (Anchor text, frequency) of pages containing inlinks
     """
+    __slots__ = ('redirectNames', 'disambiguationNames', 'disambiguationIds', 'categoryNames', 'categoryIds',
+                 'inlinkIds', 'inlinkAnchors')
+
     def __init__(self, redirectNames, disambiguationNames, disambiguationIds, categoryNames, categoryIds, inlinkIds,
                  inlinkAnchors):
         self.inlinkAnchors = inlinkAnchors
@@ -295,6 +312,8 @@ class PageSkeleton(object):
     * :class:`Image`
 
     """
+    __slots__ = ()
+
     @staticmethod
     def from_cbor(cbor):
         tag = cbor[0]
@@ -334,6 +353,8 @@ class Section(PageSkeleton):
 
        The :class:`PageSkeleton` elements contained by the section.
     """
+    __slots__ = ('heading', 'headingId', 'children', 'child_sections')
+
     def __init__(self, heading, headingId, children):
         self.heading = heading
         self.headingId = headingId
@@ -364,6 +385,8 @@ class Para(PageSkeleton):
 
        The content of the Paragraph (which in turn contain a list of :class:`ParaBody`\ s)
     """
+    __slots__ = ('paragraph',)
+
     def __init__(self, paragraph):
         self.paragraph = paragraph
 
@@ -390,6 +413,8 @@ class Image(PageSkeleton):
        URL to the image; spaces need to be replaced with underscores, Wikimedia
        Commons namespace needs to be prefixed
     """
+    __slots__ = ('caption', 'imageurl')
+
     def __init__(self, imageurl, caption):
         self.caption = caption
         self.imageurl = imageurl
@@ -414,6 +439,8 @@ class List(PageSkeleton):
 
        A :class:`Paragraph` containing the list element contents.
     """
+    __slots__ = ('level', 'body')
+
     def __init__(self, level, body):
         self.level = level
         self.body = body
@@ -428,6 +455,8 @@ class Paragraph(object):
     """
     A paragraph.
     """
+    __slots__ = ('para_id', 'bodies')
+
     def __init__(self, para_id, bodies):
         self.para_id = para_id
         self.bodies = list(bodies)
@@ -453,6 +482,8 @@ class ParaBody(object):
     """
     An abstract superclass representing a bit of :class:`Paragraph` content.
     """
+    __slots__ = ()
+
     @staticmethod
     def from_cbor(cbor):
         tag = cbor[0]
@@ -489,6 +520,8 @@ class ParaText(ParaBody):
 
        The text
     """
+    __slots__ = ('text',)
+
     def __init__(self, text):
         self.text = text
 
@@ -527,6 +560,8 @@ class ParaLink(ParaBody):
 
        The anchor text of the link
     """
+    __slots__ = ('page', 'pageid', 'link_section', 'anchor_text')
+
     def __init__(self, page, link_section, pageid, anchor_text):
         self.page = page
         self.pageid = pageid
@@ -639,3 +674,256 @@ def with_toc(read_val):
 
 AnnotationsFile = with_toc(Page.from_cbor)
 ParagraphsFile = with_toc(Paragraph.from_cbor)
+
+
+def _read_head(buf, offset):
+    """
+    Read the head of the CBOR item at ``offset``.
+
+    :rtype: typing.Tuple[int, int, int]
+    :return: the major type, the argument (``None`` for an indefinite length) and the
+             offset of the content of the item
+    """
+    initial = buf[offset]
+    major, info = initial >> 5, initial & 0x1f
+    if info < 24:
+        return major, info, offset + 1
+    elif info == 31:
+        return major, None, offset + 1
+    size = 1 << (info - 24)
+    return major, int.from_bytes(buf[offset + 1:offset + 1 + size], 'big'), offset + 1 + size
+
+def _item_end(buf, offset):
+    """
+    Offset right after the CBOR item at ``offset``, found by walking the heads of the
+    nested items without decoding them.
+    """
+    # Items left to skip in the current container (-1 for an indefinite length), and in the
+    # enclosing ones. The head parsing of _read_head is inlined, as this is the scanning loop.
+    remaining = 1
+    stack = []
+    while True:
+        initial = buf[offset]
+        if remaining < 0 and initial == 0xff:
+            # Break of an indefinite-length container
+            offset += 1
+            remaining = stack.pop()
+        else:
+            if remaining > 0:
+                remaining -= 1
+            major = initial >> 5
+            info = initial & 0x1f
+            if info < 24:
+                argument = info
+                offset += 1
+            elif info == 31:
+                argument = -1
+                offset += 1
+            else:
+                size = 1 << (info - 24)
+                argument = int.from_bytes(buf[offset + 1:offset + 1 + size], 'big')
+                offset += 1 + size
+
+            if major == 2 or major == 3:
+                if argument < 0:
+                    # Chunks up to a break
+                    stack.append(remaining)
+                    remaining = -1
+                else:
+                    offset += argument
+            elif major == 4 or major == 5 or major == 6:
+                if major == 5 and argument > 0:
+                    argument *= 2
+                elif major == 6:
+                    argument = 1
+                if argument != 0:
+                    stack.append(remaining)
+                    remaining = argument
+
+        while remaining == 0:
+            if not stack:
+                return offset
+            remaining = stack.pop()
+
+def _leading_fields(buf, offset, count):
+    """
+    The first ``count`` elements of the CBOR array at ``offset``, read without decoding
+    the rest of the array.
+
+    :return: the elements, or ``None`` if one of them is not an integer or a definite-length string
+    """
+    major, _, offset = _read_head(buf, offset)
+    if major != 4:
+        return None
+    fields = []
+    for _ in range(count):
+        major, argument, offset = _read_head(buf, offset)
+        if major == 0:
+            fields.append(argument)
+        elif (major == 2 or major == 3) and argument is not None:
+            value = buf[offset:offset + argument]
+            fields.append(value if major == 2 else value.decode('utf-8'))
+            offset += argument
+        else:
+            return None
+    return fields
+
+def records_start(buf, expected_file_types):
+    """
+    Offset of the first record of a CBOR file, after the header if any.
+
+    :type buf: mmap.mmap
+    """
+    end = _item_end(buf, 0)
+    maybe_hdr = cbor.loads(buf[0:end])
+    if isinstance(maybe_hdr, list) and maybe_hdr[0] == 'CAR':
+        # We have a header.
+        file_type = maybe_hdr[1][0]
+        assert file_type in expected_file_types
+
+        # Beginning of variable-length list.
+        assert buf[end:end + 1] == b'\x9f'
+        return end + 1
+    return 0
+
+def iter_records(buf, expected_file_types):
+    """
+    Iterate over the location of the records of a CBOR file, skipping the header if any.
+
+    :type buf: mmap.mmap
+    :rtype: typing.Iterator[typing.Tuple[int, int]]
+    :return: the start and end offset of each record
+    """
+    size = len(buf)
+    if size == 0:
+        return
+    offset = records_start(buf, expected_file_types)
+    # Up to the break symbol, or the end of a file without header
+    while offset < size and buf[offset] != 0xff:
+        end = _item_end(buf, offset)
+        yield offset, end
+        offset = end
+
+def open_mmap(file):
+    """
+    Memory-map an open CBOR file for reading.
+
+    :rtype: mmap.mmap
+    """
+    if os.fstat(file.fileno()).st_size == 0:
+        # Empty files cannot be mapped
+        return b''
+    return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+class LazyRecord(object):
+    """
+    An abstract superclass for records of a memory-mapped CBOR file which are decoded on
+    first access to one of their fields. The fields read from the start of the record do
+    not decode the rest of it; any other field decodes the whole record, once.
+
+    Subclasses include
+
+    * :class:`LazyPage`
+    * :class:`LazyParagraph`
+    """
+    __slots__ = ()
+
+    def __init__(self, buf, start, end):
+        self._buf = buf
+        self._start = start
+        self._end = end
+
+    def to_cbor(self):
+        """
+        The encoded record.
+
+        :rtype: bytes
+        """
+        return self._buf[self._start:self._end]
+
+    def __getattr__(self, name):
+        # Only reached for the fields that are not decoded yet
+        if name not in self._fields:
+            raise AttributeError(name)
+        if name not in self._leading or not self._decode_leading():
+            record = self._from_cbor(cbor.loads(self.to_cbor()))
+            for field in self._fields:
+                setattr(self, field, getattr(record, field))
+        return getattr(self, name)
+
+class LazyPage(LazyRecord, Page):
+    """
+    A :class:`Page` decoded on first access: :attr:`page_name` and :attr:`page_id` are read
+    directly from the record.
+    """
+    __slots__ = ('_buf', '_start', '_end')
+    _fields = Page.__slots__
+    _leading = ('page_name', 'page_id')
+    _from_cbor = staticmethod(Page.from_cbor)
+
+    def _decode_leading(self):
+        fields = _leading_fields(self._buf, self._start, 3)
+        if fields is None:
+            return False
+        self.page_name = fields[1]
+        self.page_id = fields[2].decode('ascii')
+        return True
+
+class LazyParagraph(LazyRecord, Paragraph):
+    """
+    A :class:`Paragraph` decoded on first access: :attr:`para_id` is read directly from the
+    record.
+    """
+    __slots__ = ('_buf', '_start', '_end')
+    _fields = Paragraph.__slots__
+    _leading = ('para_id',)
+    _from_cbor = staticmethod(Paragraph.from_cbor)
+
+    def _decode_leading(self):
+        fields = _leading_fields(self._buf, self._start, 2)
+        if fields is None:
+            return False
+        self.para_id = fields[1].decode('ascii')
+        return True
+
+def _iter_lazy_with_header(file, record_class, expected_file_types):
+    buf = open_mmap(file)
+    for start, end in iter_records(buf, expected_file_types):
+        yield record_class(buf, start, end)
+
+def iter_annotations_lazy(file):
+    """
+    Iterate over the :class:`LazyPage`\ s of a memory-mapped annotations file.
+
+    :type file: typing.BinaryIO
+    :rtype: typing.Iterator[LazyPage]
+    """
+    return _iter_lazy_with_header(file, LazyPage, [0,1])
+
+def iter_pages_lazy(file):
+    """
+    Iterate over the :class:`LazyPage`\ s of a memory-mapped pages file.
+
+    :type file: typing.BinaryIO
+    :rtype: typing.Iterator[LazyPage]
+    """
+    return _iter_lazy_with_header(file, LazyPage, [0])
+
+def iter_outlines_lazy(file):
+    """
+    Iterate over the :class:`LazyPage`\ s of a memory-mapped outlines file.
+
+    :type file: typing.BinaryIO
+    :rtype: typing.Iterator[LazyPage]
+    """
+    return _iter_lazy_with_header(file, LazyPage, [1])
+
+def iter_paragraphs_lazy(file):
+    """
+    Iterate over the :class:`LazyParagraph`\ s of a memory-mapped paragraphs file. Unlike
+    :func:`iter_paragraphs`, paragraphs are only decoded when their fields are accessed.
+
+    :type file: typing.BinaryIO
+    :rtype: typing.Iterator[LazyParagraph]
+    """
+    return _iter_lazy_with_header(file, LazyParagraph, [2])
@@ -0,0 +1,320 @@
+#
+# Pyserini: Python interface to the Anserini IR toolkit built on Lucene
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Tables of contents of TREC CAR CBOR files, for random access to their pages and paragraphs.
+
+A sorted table of contents is a compact on-disk index, memory-mapped and searched by binary
+search, so that looking up a record does not load the whole table:
+
+    magic (8 bytes) | n (uint64) | key ends (n x uint64) | record offsets (n x uint64) | keys
+
+with all integers little-endian, and the UTF-8 keys concatenated in byte order. It is built by
+scanning byte ranges of the CBOR file in parallel. CBOR has no sync markers, so each range
+starts at the first position where a record of the expected type plausibly starts; a range is
+only kept if it starts exactly where the previous range ended, and is scanned again from there
+otherwise.
+"""
+
+import argparse
+import heapq
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from bisect import bisect_left
+from multiprocessing import Pool
+
+import cbor
+
+from trec_car_classes import LazyPage, LazyParagraph, _item_end, open_mmap, records_start
+
+TOC_SUFFIX = '.toc.sorted'
+MAGIC = b'CARTOC\x00\x01'
+UINT64 = struct.Struct('<Q')
+
+KINDS = {
+    'pages': (LazyPage, [0]),
+    'outlines': (LazyPage, [1]),
+    'annotations': (LazyPage, [0, 1]),
+    'paragraphs': (LazyParagraph, [2]),
+}
+
+KEYS = {
+    LazyPage: {'id': 'page_id', 'name': 'page_name'},
+    LazyParagraph: {'id': 'para_id'},
+}
+
+# First two bytes of a record: the head of its array and its tag
+SIGNATURES = {
+    LazyPage: (b'\x84\x00', b'\x84\x01', b'\x86\x00', b'\x86\x01'),
+    LazyParagraph: (b'\x83\x00',),
+}
+
+
+def _record_at(buf, offset, record_class):
+    """
+    The record at offset, if one plausibly starts there: it has the head of a record, its
+    leading fields decode, and it is followed by another record, a break or the end of the file.
+
+    :return: the end of the record, or None
+    """
+    signatures = SIGNATURES[record_class]
+    if buf[offset:offset + 2] not in signatures:
+        return None
+    try:
+        end = _item_end(buf, offset)
+        if end > len(buf) or not record_class(buf, offset, end)._decode_leading():
+            return None
+    except (IndexError, ValueError, AttributeError):
+        return None
+    if end < len(buf) and buf[end] != 0xff and buf[end:end + 2] not in signatures:
+        return None
+    return end
+
+
+def _resync(buf, start, stop, record_class):
+    """
+    The first position in [start, stop) where a record plausibly starts, or None.
+    """
+    signatures = SIGNATURES[record_class]
+    while start < stop:
+        candidates = [buf.find(signature, start, stop + 1) for signature in signatures]
+        candidates = [candidate for candidate in candidates if candidate >= 0]
+        if not candidates:
+            return None
+        offset = min(candidates)
+        if _record_at(buf, offset, record_class) is not None:
+            return offset
+        start = offset + 1
+    return None
+
+
+def scan_range(args):
+    """
+    Scan the records starting in a byte range of a CBOR file, from known_start if given,
+    else from the first position a record plausibly starts at.
+
+    @Return: (first record offset, [(key, offset)] sorted by key, or the number of records
+    if key is None, offset after the last record)
+    """
+    fname, kind, key, range_start, range_end, known_start = args
+    record_class, _ = KINDS[kind]
+    key_field = KEYS[record_class][key] if key is not None else None
+    with open(fname, 'rb') as f:
+        buf = open_mmap(f)
+    size = len(buf)
+
+    offset = known_start if known_start is not None else _resync(buf, range_start, range_end, record_class)
+    if offset is None:
+        return None, [], None
+    first = offset
+    entries = []
+    count = 0
+    try:
+        while offset < range_end and offset < size and buf[offset] != 0xff:
+            end = _item_end(buf, offset)
+            if key_field is not None:
+                entries.append((getattr(record_class(buf, offset, end), key_field).encode('utf-8'), offset))
+            count += 1
+            offset = end
+    except Exception:
+        if known_start is not None:
+            raise
+        # Resynced on a false record boundary, the range is scanned again from the known one
+        return None, [], None
+    if key_field is None:
+        return first, count, offset
+    entries.sort()
+    return first, entries, offset
+
+
+def scan_ranges(fname, kind, key, workers, pool):
+    """
+    Scan the records of a CBOR file in about equal byte ranges with a pool of workers, keeping
+    the result of a range only if it starts where the previous range ended.
+
+    @Return: the scan_range results of the ranges records start in, in file order
+    """
+    record_class, expected_file_types = KINDS[kind]
+    if key is not None and key not in KEYS[record_class]:
+        raise ValueError(f'{kind} files cannot be keyed by {key}')
+    with open(fname, 'rb') as f:
+        buf = open_mmap(f)
+    size = len(buf)
+    start = records_start(buf, expected_file_types) if size else 0
+    bounds = [start + (size - start) * i // workers for i in range(workers + 1)]
+    tasks = [(fname, kind, key, bounds[i], bounds[i + 1], start if i == 0 else None) for i in range(workers)]
+
+    results = []
+    expected = start
+    for task, (first, entries, end) in zip(tasks, pool.imap(scan_range, tasks)):
+        range_end = task[4]
+        if expected >= range_end:
+            # No record starts in this range, which is within the last record of the previous one
+            continue
+        if first != expected:
+            # The range was resynced on a false record boundary
+            first, entries, end = scan_range(task[:5] + (expected,))
+        results.append((first, entries, end))
+        expected = end
+    return results
+
+
+def write_toc(toc_fname, entries, count):
+    """
+    Write (key, offset) entries sorted by key as a sorted table of contents.
+    """
+    key_ends = array('Q')
+    offsets = array('Q')
+    header_size = len(MAGIC) + UINT64.size * (1 + 2 * count)
+    with open(toc_fname, 'wb') as f:
+        f.seek(header_size)
+        position = 0
+        for key, offset in entries:
+            f.write(key)
+            position += len(key)
+            key_ends.append(position)
+            offsets.append(offset)
+        assert len(offsets) == count
+        if sys.byteorder == 'big':
+            key_ends.byteswap()
+            offsets.byteswap()
+        f.seek(0)
+        f.write(MAGIC)
+        f.write(UINT64.pack(count))
+        f.write(key_ends.tobytes())
+        f.write(offsets.tobytes())
+
+
+def build_toc(fname, toc_fname=None, kind='paragraphs', key='id', workers=None, toc_format='sorted'):
+    """
+    Build the table of contents of a CBOR file by scanning byte ranges of it in parallel,
+    either as a sorted table of contents, or as the CBOR dict {key: offset} of the .toc files
+    read by AnnotationsFile and ParagraphsFile. Keys appearing more than once keep their
+    first offset.
+
+    @Return: the number of records
+    """
+    if toc_fname is None:
+        toc_fname = fname + (TOC_SUFFIX if toc_format == 'sorted' else '.toc')
+    workers = workers or os.cpu_count()
+    with Pool(workers) as pool:
+        parts = [entries for _, entries, _ in scan_ranges(fname, kind, key, workers, pool)]
+
+    count = sum(len(entries) for entries in parts)
+    if toc_format == 'sorted':
+        write_toc(toc_fname, heapq.merge(*parts), count)
+    else:
+        toc = {}
+        for entry_key, offset in heapq.merge(*parts):
+            toc.setdefault(entry_key.decode('utf-8'), offset)
+        with open(toc_fname, 'wb') as f:
+            cbor.dump(toc, f)
+    return count
+
+
+class SortedToc(object):
+    """
+    A memory-mapped sorted table of contents, looked up by binary search.
+    """
+    def __init__(self, toc_fname):
+        with open(toc_fname, 'rb') as f:
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.buf[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{toc_fname} is not a sorted table of contents')
+        self.count = UINT64.unpack_from(self.buf, len(MAGIC))[0]
+        self.key_ends_start = len(MAGIC) + UINT64.size
+        self.offsets_start = self.key_ends_start + UINT64.size * self.count
+        self.keys_start = self.offsets_start + UINT64.size * self.count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        # The key of the i-th entry, so that bisect searches the table directly
+        start = UINT64.unpack_from(self.buf, self.key_ends_start + UINT64.size * (i - 1))[0] if i > 0 else 0
+        end = UINT64.unpack_from(self.buf, self.key_ends_start + UINT64.size * i)[0]
+        return self.buf[self.keys_start + start:self.keys_start + end]
+
+    def offset(self, i):
+        return UINT64.unpack_from(self.buf, self.offsets_start + UINT64.size * i)[0]
+
+    def get(self, key):
+        """ Lookup the offset of a record by key. Returns an offset or None """
+        key = key.encode('utf-8')
+        i = bisect_left(self, key)
+        if i < self.count and self[i] == key:
+            return self.offset(i)
+        return None
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def keys(self):
+        """ The keys of the table of contents, in byte order. """
+        return (self[i].decode('utf-8') for i in range(self.count))
+
+
+def with_sorted_toc(record_class):
+    class IndexedFile(object):
+        def __init__(self, fname, toc_fname=None):
+            """
+            Read records from a file by key, without loading its table of contents.
+
+            Arguments:
+            fname      The name of the CBOR file. A sorted table-of-contents file, by
+                        default fname + '.toc.sorted', is also expected to be present.
+            """
+            with open(fname, 'rb') as f:
+                self.cbor = open_mmap(f)
+            self.toc = SortedToc(toc_fname or fname + TOC_SUFFIX)
+
+        def keys(self):
+            """ The keys contained in the table of contents. """
+            return self.toc.keys()
+
+        def get(self, key):
+            """ Lookup a record by key. Returns a lazily decoded record or None """
+            offset = self.toc.get(key)
+            if offset is not None:
+                return record_class(self.cbor, offset, _item_end(self.cbor, offset))
+            return None
+    return IndexedFile
+
+IndexedAnnotationsFile = with_sorted_toc(LazyPage)
+IndexedParagraphsFile = with_sorted_toc(LazyParagraph)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Builds the table of contents of a TREC CAR CBOR file.')
+    parser.add_argument('--cbor', required=True, help='TREC CAR cbor file.')
+    parser.add_argument('--kind', choices=list(KINDS), default='paragraphs', help='Kind of records of the file.')
+    parser.add_argument('--key', choices=['id', 'name'], default=None,
+                        help='Key of the records: the page name for pages, the paragraph id for paragraphs by default.')
+    parser.add_argument('--format', choices=['sorted', 'cbor'], default='sorted',
+                        help='Sorted on-disk table of contents, or CBOR dict as read by AnnotationsFile/ParagraphsFile.')
+    parser.add_argument('--output', default=None,
+                        help='Table of contents file, by default the cbor file with a .toc.sorted or .toc suffix.')
+    parser.add_argument('--workers', default=os.cpu_count(), type=int, help='Number of worker processes.')
+    args = parser.parse_args()
+
+    key = args.key or ('id' if args.kind == 'paragraphs' else 'name')
+    start = time.time()
+    count = build_toc(args.cbor, args.output, args.kind, key, args.workers, args.format)
+    print(f'Indexed {count} records in {time.time() - start:.1f}s')
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+#
+# Anserini: A toolkit for reproducible information retrieval research built on Lucene
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""In-process, vectorized replacement for the common trec_eval measures.
+
+Qrels are loaded once into NumPy arrays; each run is then loaded once,
+joined against the qrels, and every requested metric is computed for all
+topics at once with array operations. Supported metrics, using trec_eval
+names: map, recip_rank, ndcg, P.k, recall.k and ndcg_cut.k (either '.' or
+'_' may separate the cutoff). As in trec_eval, documents are ranked by
+descending score with ties broken by descending docid, a document is
+relevant if its judgment is at least 1, and only judged topics are
+evaluated.
+"""
+
+import argparse
+import numpy as np
+
+SUPPORTED_METRICS = ['map', 'recip_rank', 'ndcg', 'P', 'recall', 'ndcg_cut']
+
+
+def parse_metric(metric):
+    """Splits a trec_eval metric such as 'ndcg_cut.10' or 'P_10' into its name and cutoff."""
+    for separator in ['.', '_']:
+        name, _, cutoff = metric.rpartition(separator)
+        if name in SUPPORTED_METRICS and cutoff.isdigit():
+            return name, int(cutoff)
+    if metric in ['map', 'recip_rank', 'ndcg']:
+        return metric, None
+    raise ValueError(f'Unsupported metric {metric}, expected one of {SUPPORTED_METRICS}')
+
+
+def metric_key(metric):
+    """Returns the name trec_eval uses for a metric in its output, e.g. 'P_10' for 'P.10'."""
+    name, cutoff = parse_metric(metric)
+    return name if cutoff is None else f'{name}_{cutoff}'
+
+
+class Qrels:
+    """Relevance judgments, with topics and judged docids interned to integer indexes."""
+
+    def __init__(self, path):
+        topic_index = {}
+        doc_index = {}
+        topics, docs, rels = [], [], []
+        with open(path, 'r') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 4:
+                    continue
+                topics.append(topic_index.setdefault(fields[0], len(topic_index)))
+                docs.append(doc_index.setdefault(fields[2], len(doc_index)))
+                rels.append(int(fields[3]))
+
+        self.topic_index = topic_index
+        self.doc_index = doc_index
+        self.topics = np.array(list(topic_index), dtype=object)
+        self.num_topics = len(topic_index)
+        self.num_docs = len(doc_index)
+
+        topics = np.asarray(topics, dtype=np.int64)
+        docs = np.asarray(docs, dtype=np.int64)
+        rels = np.asarray(rels, dtype=np.int64)
+
+        # Sorted (topic, doc) keys for joining runs against the qrels with searchsorted
+        keys = topics * self.num_docs + docs
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        self.rels = rels[order]
+
+        self.num_rel = np.bincount(topics, weights=rels >= 1, minlength=self.num_topics)
+
+        # Ideal ranking: judged documents of each topic by descending gain
+        gains = np.maximum(rels, 0).astype(np.float64)
+        order = np.lexsort((-gains, topics))
+        self.ideal_topics = topics[order]
+        self.ideal_gains = gains[order]
+        self.ideal_ranks = _ranks_within_topics(self.ideal_topics, self.num_topics)
+
+    def lookup(self, topics, docs):
+        """Returns the judgment of each (topic, doc) pair, 0 for unjudged pairs."""
+        keys = topics * self.num_docs + docs
+        positions = np.searchsorted(self.keys, keys)
+        positions = np.minimum(positions, len(self.keys) - 1)
+        found = (docs >= 0) & (self.keys[positions] == keys)
+        return np.where(found, self.rels[positions], 0)
+
+
+class JudgedRun:
+    """A run sorted and truncated as trec_eval does, with the judgment of every retrieved document."""
+
+    def __init__(self, topics, ranks, rels, retrieved):
+        self.topics = topics
+        self.ranks = ranks
+        self.rels = rels
+        # Topics of the qrels that appear in the run
+        self.retrieved = retrieved
+
+
+def _ranks_within_topics(topics, num_topics):
+    """Computes 1-based ranks for rows already sorted by topic."""
+    counts = np.bincount(topics, minlength=num_topics)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    return np.arange(len(topics)) - starts[topics] + 1
+
+
+def load_run(path, qrels, depth=None):
+    """Loads a TREC run and joins it against the qrels, keeping the top depth documents per topic."""
+    topics, docids, scores = [], [], []
+    doc_index = qrels.doc_index
+    topic_index = qrels.topic_index
+    with open(path, 'r') as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) < 6:
+                continue
+            topic = topic_index.get(fields[0])
+            # Topics without judgments cannot contribute to any metric
+            if topic is None:
+                continue
+            topics.append(topic)
+            docids.append(fields[2])
+            scores.append(float(fields[4]))
+
+    topics = np.asarray(topics, dtype=np.int64)
+    scores = np.asarray(scores, dtype=np.float64)
+    docids = np.asarray(docids, dtype=object)
+
+    # trec_eval ranks by descending score, breaking ties by descending docid
+    if len(docids) > 0:
+        _, docid_order = np.unique(docids, return_inverse=True)
+    else:
+        docid_order = np.zeros(0, dtype=np.int64)
+    order = np.lexsort((-docid_order, -scores, topics))
+    topics = topics[order]
+    docids = docids[order]
+    ranks = _ranks_within_topics(topics, qrels.num_topics)
+
+    if depth is not None:
+        keep = ranks <= depth
+        topics, docids, ranks = topics[keep], docids[keep], ranks[keep]
+
+    docs = np.fromiter((doc_index.get(d, -1) for d in docids), dtype=np.int64, count=len(docids))
+    rels = qrels.lookup(topics, docs)
+    retrieved = np.bincount(topics, minlength=qrels.num_topics) > 0
+    return JudgedRun(topics, ranks, rels, retrieved)
+
+
+def _dcg(topics, ranks, gains, num_topics, cutoff):
+    weights = gains / np.log2(ranks + 1)
+    if cutoff is not None:
+        weights = np.where(ranks <= cutoff, weights, 0.0)
+    return np.bincount(topics, weights=weights, minlength=num_topics)
+
+
+def compute_metric(qrels, run, metric):
+    """Computes a metric for every topic of the qrels, returning an array indexed like qrels.topics."""
+    name, cutoff = parse_metric(metric)
+    num_topics = qrels.num_topics
+    relevant = run.rels >= 1
+    num_rel = qrels.num_rel
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if name == 'map':
+            starts = np.concatenate(([0], np.cumsum(np.bincount(run.topics, minlength=num_topics))[:-1]))
+            cumulative = np.cumsum(relevant)
+            # Number of relevant documents retrieved at or above each rank, within its topic
+            offsets = np.concatenate(([0], cumulative))[starts]
+            rel_so_far = cumulative - offsets[run.topics]
+            precisions = np.where(relevant, rel_so_far / run.ranks, 0.0)
+            scores = np.bincount(run.topics, weights=precisions, minlength=num_topics) / num_rel
+        elif name == 'recip_rank':
+            first = np.full(num_topics, np.inf)
+            np.minimum.at(first, run.topics[relevant], run.ranks[relevant])
+            scores = 1.0 / first
+        elif name in ['P', 'recall']:
+            hits = np.bincount(run.topics, weights=relevant & (run.ranks <= cutoff), minlength=num_topics)
+            scores = hits / cutoff if name == 'P' else hits / num_rel
+        else:
+            gains = np.maximum(run.rels, 0).astype(np.float64)
+            dcg = _dcg(run.topics, run.ranks, gains, num_topics, cutoff)
+            ideal = _dcg(qrels.ideal_topics, qrels.ideal_ranks, qrels.ideal_gains, num_topics, cutoff)
+            scores = np.where(ideal > 0, dcg / ideal, 0.0)
+
+    return np.nan_to_num(scores, nan=0.0, posinf=0.0)
+
+
+class EvalResult:
+    """Per-topic scores of one run: topics is an array of qids and scores maps metric to an aligned array."""
+
+    def __init__(self, topics, scores):
+        self.topics = topics
+        self.scores = scores
+
+    def mean(self, metric):
+        return float(np.mean(self.scores[metric_key(metric)])) if len(self.topics) else 0.0
+
+    def to_dict(self):
+        """Returns scores as nested dicts {metric: {qid: score}}, as parsed from trec_eval -q output."""
+        return {metric: dict(zip(self.topics, scores.tolist())) for metric, scores in self.scores.items()}
+
+
+def evaluate(qrels, run, metrics, complete=False):
+    """Evaluates a loaded run over the judged topics it retrieves, or over all judged topics
+    if complete is set (like trec_eval -c)."""
+    mask = np.ones(qrels.num_topics, dtype=bool) if complete else run.retrieved
+    scores = {metric_key(m): compute_metric(qrels, run, m)[mask] for m in metrics}
+    return EvalResult(qrels.topics[mask], scores)
+
+
+def evaluate_run(qrels, path, metrics, depth=None, complete=False):
+    """Loads and evaluates a run file against already loaded qrels."""
+    return evaluate(qrels, load_run(path, qrels, depth), metrics, complete)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Evaluate runs in-process with trec_eval measures.')
+    parser.add_argument('--qrels', type=str, help='qrels', required=True)
+    parser.add_argument('--runs', type=str, nargs='+', help='runs to evaluate', required=True)
+    parser.add_argument('--metrics', type=str, nargs='+', help='metrics', default=['map'])
+    parser.add_argument('--depth', type=int, help='number of documents per topic to evaluate (trec_eval -M)',
+                        default=None)
+    parser.add_argument('-c', '--complete', action='store_true', default=False,
+                        help='average over all topics in the qrels (trec_eval -c)')
+    parser.add_argument('-q', '--per-topic', action='store_true', default=False, help='print per-topic scores')
+    args = parser.parse_args()
+
+    qrels = Qrels(args.qrels)
+    for run_path in args.runs:
+        result = evaluate_run(qrels, run_path, args.metrics, args.depth, args.complete)
+        for metric in args.metrics:
+            key = metric_key(metric)
+            if args.per_topic:
+                for topic, score in zip(result.topics, result.scores[key]):
+                    print(f'{key:<22}\t{topic}\t{score:.4f}')
+            print(f'{key:<22}\tall\t{result.mean(metric):.4f}\t{run_path}')
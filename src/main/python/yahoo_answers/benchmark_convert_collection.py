@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Anserini: A Lucene toolkit for replicable information retrieval research
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import argparse
+import random
+import resource
+import tempfile
+import time
+from xml.sax.saxutils import escape
+
+import numpy as np
+
+from convert_collection_to_jsonl import convert_collection, open_file
+
+WORDS = ['how', 'do', 'I', 'what', 'is', 'the', 'best', 'way', 'to', 'learn',
+         'python', 'café', 'naïve', 'answer', 'question', '&', '<b>', '</b>',
+         '<br />', 'because', 'of', 'it', 'and', 'you', 'should', 'try']
+
+
+def generate_synthetic_collection(path, question_qty, answer_qty, answer_words,
+                                  seed=42):
+    """Writes a Yahoo Answers XML file of random questions, each with about
+    answer_qty answers of about answer_words words, and a few without answers.
+    """
+    rng = random.Random(seed)
+
+    def text(word_qty):
+        return escape(' '.join(rng.choice(WORDS) for _ in range(word_qty)))
+
+    with open_file(path, 'wt') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<ystfeed>\n')
+        for i in range(question_qty):
+            answer_range = (0 if rng.random() < 0.001 else 1, 2 * answer_qty)
+            answers = [text(rng.randint(1, 2 * answer_words))
+                       for _ in range(rng.randint(*answer_range))]
+            f.write('<vespaadd><document type="wisdom">\n')
+            f.write('<uri>{}</uri>\n'.format(i))
+            f.write('<subject>{}</subject>\n'.format(text(rng.randint(3, 15))))
+            f.write('<content>{}</content>\n'.format(text(rng.randint(0, 50))))
+            if answers:
+                f.write('<bestanswer>{}</bestanswer>\n'.
+                        format(rng.choice(answers)))
+                f.write('<nbestanswers>')
+                for answer in answers:
+                    f.write('<answer_item>{}</answer_item>'.format(answer))
+                f.write('</nbestanswers>\n')
+            f.write('<cat>Programming</cat>\n</document></vespaadd>\n')
+        f.write('</ystfeed>\n')
+
+
+def benchmark(args):
+    """Converts synthetic collections of increasingly long answers, reporting
+    MB/sec and questions/sec, which stay flat when parsing is linear-time,
+    and the peak RSS, which stays flat with bounded memory.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for answer_words in args.answer_words:
+            collection_path = os.path.join(tmp_dir, 'yahoo.xml')
+            generate_synthetic_collection(collection_path,
+                                          args.question_qty,
+                                          args.answer_qty,
+                                          answer_words)
+            size = os.path.getsize(collection_path)
+
+            convert_args = argparse.Namespace(
+                collection_path=collection_path,
+                output_folder=os.path.join(tmp_dir, str(answer_words)),
+                query_sample_qty=args.query_sample_qty,
+                max_docs_per_file=args.max_docs_per_file)
+            os.makedirs(convert_args.output_folder)
+            np.random.seed(0)
+            start = time.time()
+            convert_collection(convert_args)
+            elapsed = time.time() - start
+            # Kilobytes on Linux
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            results.append((answer_words, size, elapsed, max_rss))
+
+    print('{:>12} {:>10} {:>10} {:>10} {:>14} {:>12}'.format(
+        'answer words', 'MB', 'seconds', 'MB/sec', 'questions/sec',
+        'peak RSS MB'))
+    for answer_words, size, elapsed, max_rss in results:
+        print('{:>12} {:>10.1f} {:>10.2f} {:>10.1f} {:>14.0f} {:>12.1f}'.format(
+            answer_words, size / 2 ** 20, elapsed, size / 2 ** 20 / elapsed,
+            args.question_qty / elapsed, max_rss / 1024))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+      description='Benchmark the Yahoo Answers conversion on synthetic collections.')
+    parser.add_argument('--question_qty', default=10000, type=int,
+                        help='# of synthetic questions')
+    parser.add_argument('--answer_qty', default=4, type=int,
+                        help='average # of answers per question')
+    parser.add_argument('--answer_words', default=[10, 100, 1000], type=int,
+                        nargs='+', help='average # of words per answer, ' +
+                        'one synthetic collection for each')
+    parser.add_argument('--query_sample_qty', default=1000, type=int,
+                        help='# of queries to sample')
+    parser.add_argument('--max_docs_per_file', default=100000, type=int,
+                        help='maximum number of questions in each jsonl file.')
+
+    args = parser.parse_args()
+
+    benchmark(args)
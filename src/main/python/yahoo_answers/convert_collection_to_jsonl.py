@@ -21,8 +21,8 @@ import re
 import bz2
 import gzip
 import argparse
-import xml.sax
 import collections
+import xml.etree.ElementTree as ET
 import numpy as np
 
 YahooAnswerRecParsed = collections.namedtuple('YahooAnswerRecParsed',
@@ -39,52 +39,47 @@ YAWNS_ANSWITEM_TAG = 'answer_item'
 MAX_REL_GRADE = 4
 
 
-class YahooAnswersContentHandler(xml.sax.ContentHandler):
-    def __init__(self, worker_obj):
-        xml.sax.ContentHandler.__init__(self)
-        self.worker_obj = worker_obj
-        self.qty = 0
+def iter_records(f):
+    """Parses Yahoo Answers documents one at a time, in linear time
+    and bounded memory: the text of each element is accumulated by the
+    C parser, and every parsed document is dropped from the tree.
 
-    def startElement(self, name, attrs):
-        self.curr_txt = ''
-
-        if name == YAWNS_DOC_TAG:
-            self.best_answ = None
-            self.uri = None
-            self.subject = ''
-            self.content = ''
-            self.answ_list = []
-
-    def endElement(self, name):
+    :param f: the XML file, opened in binary mode
+    :return: an iterator of YahooAnswerRecParsed
+    """
+    root = None
+    best_answ, uri, subject, content, answ_list = None, None, '', '', []
+    for event, elem in ET.iterparse(f, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = elem
+            continue
+
+        name = elem.tag
         if name == YAWNS_DOC_TAG:
             best_answ_id = None
-            if self.best_answ is not None:
-                for i in range(len(self.answ_list)):
-                    if self.best_answ == self.answ_list[i]:
+            if best_answ is not None:
+                for i in range(len(answ_list)):
+                    if best_answ == answ_list[i]:
                         best_answ_id = i
                         break
 
-            self.worker_obj(self.qty,
-                            YahooAnswerRecParsed(self.uri,
-                                                 self.subject,
-                                                 self.content,
-                                                 best_answ_id,
-                                                 self.answ_list))
-            self.qty += 1
+            yield YahooAnswerRecParsed(uri, subject, content,
+                                       best_answ_id, answ_list)
+            best_answ, uri, subject, content, answ_list = \
+                None, None, '', '', []
+            root.clear()
 
         elif name == YAWNS_BESTANSW_TAG:
-            self.best_answ = remove_tags(self.curr_txt)
+            best_answ = remove_tags(elem.text or '')
         elif name == YAWNS_URI_TAG:
-            self.uri = self.curr_txt
+            uri = elem.text or ''
         elif name == YAWNS_ANSWITEM_TAG:
-            self.answ_list.append(remove_tags(self.curr_txt))
+            answ_list.append(remove_tags(elem.text or ''))
         elif name == YAWNS_SUBJ_TAG:
-            self.subject = remove_tags(self.curr_txt)
+            subject = remove_tags(elem.text or '')
         elif name == YAWNS_CONTENT_TAG:
-            self.content = remove_tags(self.curr_txt)
-
-    def characters(self, content):
-        self.curr_txt += content
+            content = remove_tags(elem.text or '')
 
 
 def qrel_entry(quest_id, answ_id, rel_grade):
@@ -123,6 +118,11 @@ def replace_tabs_nls(s):
 
 
 class Worker:
+    """Writes the answers of each question as documents, and the question
+    as a query with its qrels, to shards of max_docs_per_file questions:
+    docsNN.json, queriesNN.tsv and qrelsNN.tsv. Nothing is kept in memory,
+    the sampled queries and qrels are read back from the shards at the end.
+    """
 
     def __init__(self, output_folder, max_docs_per_file, query_sample_qty):
         self.max_docs_per_file = max_docs_per_file
@@ -130,20 +130,13 @@ class Worker:
         self.file_index = 0
         self.query_sample_qty = query_sample_qty
         self.conv_qty = 0
-        self.questions = []
-        self.qrels = dict()
+        self.output_files = None
 
-    def __call__(self, ln, rec):
-
-        if self.conv_qty % self.max_docs_per_file == 0:
-            if self.conv_qty > 0:
-                self.output_jsonl_file.close()
-            output_path = os.path.join(self.output_folder,
-                                       'docs{:02d}.json'.
-                                       format(self.file_index))
-            self.output_jsonl_file = open(output_path, 'w')
-            self.file_index += 1
+    def shard_path(self, prefix, file_index, ext):
+        return os.path.join(self.output_folder,
+                            '{}{:02d}.{}'.format(prefix, file_index, ext))
 
+    def __call__(self, ln, rec):
         question = replace_tabs_nls(rec.subject + ' ' + rec.content).strip()
         qid = rec.uri
 
@@ -157,11 +150,16 @@ class Worker:
             print('Ignoring b/c there question is empty, line id', ln)
             return
 
-        self.questions.append((qid, question))
-
-        self.qrels[qid] = []
+        if self.conv_qty % self.max_docs_per_file == 0:
+            self.close_files()
+            self.output_files = [
+                open(self.shard_path(prefix, self.file_index, ext), 'w')
+                for prefix, ext in [('docs', 'json'), ('queries', 'tsv'),
+                                    ('qrels', 'tsv')]]
+            self.file_index += 1
+        output_jsonl_file, queries_file, qrels_file = self.output_files
 
-        qrels = self.qrels[qid]
+        queries_file.write('%s\t%s\n' % (question, qid))
 
         for i in range(len(rec.answ_list)):
             aid = qid + '-' + str(i)
@@ -171,37 +169,63 @@ class Worker:
             if rec.best_answ_id is not None and rec.best_answ_id == i:
                 rel_grade += 1
 
-            qrels.append((aid, rel_grade))
+            qrels_file.write(qrel_entry(quest_id=qid, answ_id=aid,
+                                        rel_grade=rel_grade) + '\n')
 
             output_dict = {'id': aid, 'contents': answ}
-            self.output_jsonl_file.write(json.dumps(output_dict) + '\n')
+            output_jsonl_file.write(json.dumps(output_dict) + '\n')
 
         self.conv_qty += 1
         if self.conv_qty % 100000 == 0:
             print('Converted {} questions in {} files'.
                   format(self.conv_qty, self.file_index))
 
+    def close_files(self):
+        if self.output_files is not None:
+            for f in self.output_files:
+                f.close()
+            self.output_files = None
+
     def finish(self):
         print('Converted {} questions in {} files'.
               format(self.conv_qty, self.file_index))
-        self.output_jsonl_file.close()
+        self.close_files()
         # Let's sample queries and write corresponding data (queries + qrels)
-        query_qty = len(self.questions)
+        query_qty = self.conv_qty
         print('Sampling %d out of %d questions' %
               (self.query_sample_qty, query_qty))
         query_indx = np.random.choice(np.arange(query_qty),
                                       self.query_sample_qty)
+
+        # Only the sampled questions and their qrels are read back
+        sampled = set(query_indx.tolist())
+        questions = {}
+        qrels = {}
+        for file_index in range(self.file_index):
+            with open(self.shard_path('queries', file_index, 'tsv')) as f:
+                for ln, line in enumerate(f, file_index * self.max_docs_per_file):
+                    if ln in sampled:
+                        question, qid = line.rstrip('\n').split('\t', 1)
+                        questions[ln] = (qid, question)
+                        qrels[qid] = None
+        for file_index in range(self.file_index):
+            with open(self.shard_path('qrels', file_index, 'tsv')) as f:
+                for line in f:
+                    qid, _, aid, _ = line.rsplit('\t', 3)
+                    if qid in qrels:
+                        # As with questions sharing an ID, the last one wins
+                        if aid == qid + '-0':
+                            qrels[qid] = []
+                        qrels[qid].append(line)
+
         with open(os.path.join(self.output_folder, 'queries.tsv'), 'w') as f:
             for i in query_indx:
                 f.write('%s\t%s\n' %
-                        (self.questions[i][1],
-                         self.questions[i][0]))
+                        (questions[i][1],
+                         questions[i][0]))
         with open(os.path.join(self.output_folder, 'qrels.tsv'), 'w') as f:
             for i in query_indx:
-                qid = self.questions[i][0]
-                for aid, rel_grade in self.qrels[qid]:
-                    f.write(qrel_entry(quest_id=qid, answ_id=aid,
-                                       rel_grade=rel_grade) + '\n')
+                f.writelines(qrels[questions[i][0]])
 
 
 def convert_collection(args):
@@ -211,8 +235,9 @@ def convert_collection(args):
                     args.max_docs_per_file,
                     args.query_sample_qty)
 
-    xml.sax.parse(open_file(args.collection_path),
-                  YahooAnswersContentHandler(worker))
+    with open_file(args.collection_path, 'rb') as f:
+        for ln, rec in enumerate(iter_records(f)):
+            worker(ln, rec)
 
     worker.finish()
 
@@ -223,7 +248,7 @@ if __name__ == '__main__':
     parser.add_argument('--collection_path', required=True,
                         help='Yahoo Answers file')
     parser.add_argument('--output_folder', required=True, help='output file')
-    parser.add_argument('--random_seed', default=0, type=float,
+    parser.add_argument('--random_seed', default=0, type=int,
                         help='random seed')
     parser.add_argument('--query_sample_qty', type=int, required=True,
                         help='# of queries to sample')
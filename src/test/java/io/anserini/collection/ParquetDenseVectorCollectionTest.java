@@ -120,6 +120,41 @@ public class ParquetDenseVectorCollectionTest extends DocumentCollectionTest<Par
     }
   }
 
+  private static Map<String, float[]> readVectors(String path) throws IOException {
+    ParquetDenseVectorCollection collection = new ParquetDenseVectorCollection(Paths.get(path));
+    Map<String, float[]> vectors = new HashMap<>();
+    for (FileSegment<ParquetDenseVectorCollection.Document> segment : collection) {
+      for (ParquetDenseVectorCollection.Document doc : segment) {
+        vectors.put(doc.id(), doc.vector());
+      }
+    }
+    return vectors;
+  }
+
+  private static void assertDequantized(String path, float delta) throws IOException {
+    Map<String, float[]> expected = readVectors("src/test/resources/sample_docs/parquet/msmarco-passage-bge-base-en-v1.5.parquet-float");
+    Map<String, float[]> vectors = readVectors(path);
+
+    assertEquals("Collection should contain the same 10 documents", expected.keySet(), vectors.keySet());
+    for (String docId : expected.keySet()) {
+      assertEquals("Vector should have 768 dimensions", 768, vectors.get(docId).length);
+      assertArrayEquals("Dequantized vector of " + docId, expected.get(docId), vectors.get(docId), delta);
+    }
+  }
+
+  @Test
+  public void testFloat16Segment() throws IOException {
+    // Written by src/main/python/parquet/json_to_parquet.py --quantization float16 from the float sample
+    assertDequantized("src/test/resources/sample_docs/parquet/msmarco-passage-bge-base-en-v1.5.parquet-float16", 1e-4f);
+  }
+
+  @Test
+  public void testInt8Segment() throws IOException {
+    // Written by src/main/python/parquet/json_to_parquet.py --quantization int8 from the float sample,
+    // reconstructed to within half a quantization step of each dimension
+    assertDequantized("src/test/resources/sample_docs/parquet/msmarco-passage-bge-base-en-v1.5.parquet-int8", 1e-3f);
+  }
+
   @Test
   public void testSnowflakeParquetFormat() throws IOException {
     Path path = Paths.get("src/test/resources/sample_docs/parquet/snowflake-msmarco-arctic-embed/snowflake.parquet");
@@ -0,0 +1,100 @@
+/*
+ * Anserini: A Lucene toolkit for reproducible information retrieval research
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ * http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+package io.anserini.search;
+
+import java.io.BufferedReader;
+import java.io.File;
+import java.io.InputStreamReader;
+import java.io.OutputStreamWriter;
+import java.io.Writer;
+import java.net.Socket;
+import java.nio.charset.StandardCharsets;
+import java.util.List;
+import java.util.Map;
+
+import org.apache.logging.log4j.Level;
+import org.apache.logging.log4j.core.config.Configurator;
+import org.junit.After;
+import org.junit.Before;
+import org.junit.BeforeClass;
+import org.junit.Test;
+
+import com.fasterxml.jackson.databind.JsonNode;
+import com.fasterxml.jackson.databind.ObjectMapper;
+
+import io.anserini.StdOutStdErrRedirectableLuceneTestCase;
+import io.anserini.TestUtils;
+
+public class SearchCollectionServerTest extends StdOutStdErrRedirectableLuceneTestCase {
+  private static final String RUN_TEST = "target/run-search-collection-server-test";
+  private static final ObjectMapper JSON_MAPPER = new ObjectMapper();
+
+  private SearchCollectionServer server;
+
+  @BeforeClass
+  public static void setupClass() {
+    Configurator.setLevel(SearchCollection.class.getName(), Level.ERROR);
+  }
+
+  @Before
+  public void setUp() throws Exception {
+    super.setUp();
+    server = new SearchCollectionServer(new SearchCollectionServer.Args());
+    new Thread(server::serve).start();
+  }
+
+  @After
+  public void tearDown() throws Exception {
+    server.close();
+    new File(RUN_TEST + ".1").delete();
+    new File(RUN_TEST + ".2").delete();
+    super.tearDown();
+  }
+
+  private static JsonNode submit(BufferedReader in, Writer out, List<String> args) throws Exception {
+    out.write(JSON_MAPPER.writeValueAsString(Map.of("args", args)));
+    out.write('\n');
+    out.flush();
+    return JSON_MAPPER.readTree(in.readLine());
+  }
+
+  @Test
+  public void testSearches() throws Exception {
+    try (Socket socket = new Socket("127.0.0.1", server.getPort());
+         BufferedReader in = new BufferedReader(new InputStreamReader(socket.getInputStream(), StandardCharsets.UTF_8));
+         Writer out = new OutputStreamWriter(socket.getOutputStream(), StandardCharsets.UTF_8)) {
+      // Both searches share the reader of the index, which must stay open after the first one.
+      for (String run : new String[] {RUN_TEST + ".1", RUN_TEST + ".2"}) {
+        JsonNode response = submit(in, out, List.of(
+            "-index", "src/test/resources/prebuilt_indexes/lucene9-index.sample_docs_trec_collection2/",
+            "-topics", "src/test/resources/sample_topics/Trec",
+            "-topicReader", "Trec",
+            "-output", run, "-bm25"));
+        assertEquals("ok", response.get("status").asText());
+
+        TestUtils.checkFile(run, new String[]{
+            "1 Q0 DOC222 1 0.343200 Anserini",
+            "1 Q0 TREC_DOC_1 2 0.333400 Anserini",
+            "1 Q0 WSJ_1 3 0.068700 Anserini"});
+      }
+
+      JsonNode response = submit(in, out, List.of("-index", "foo"));
+      assertEquals("error", response.get("status").asText());
+      assertTrue(response.get("error").asText().contains("Option \"-output\" is required"));
+    }
+  }
+}